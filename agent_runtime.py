@@ -0,0 +1,250 @@
+from startup import mark_ready  # first import, starts the startup clock
+import asyncio
+import aio_pika
+import json
+import logging
+from collections import defaultdict
+from config import EXCHANGES, RUNTIME_CONFIG, SENSOR_DATAPOINTS, ENVELOPE_CONFIG
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from sensors_subscriber import SensorSubscriber
+from rabbitmq_management import AsyncRabbitMQManager
+from flow_control import AdaptiveConcurrencyLimiter
+from message_dedup import MessageDeduplicator
+from tracing import setup_tracing, tracer
+from envelopes import EnvelopeConsumer, envelopes_enabled
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("AgentRuntime")
+
+
+class LocalBus:
+    """
+    Takes the place of AsyncRabbitMQManager for stages running in the runtime.
+    publish() hands the payload dict straight to in-process consumers and only
+    goes to the broker for exchanges configured to forward, or that nothing in
+    the process consumes.
+    """
+
+    def __init__(self, rabbitmq: AsyncRabbitMQManager, forward: dict[str, bool]):
+        self.rabbitmq = rabbitmq
+        self.backpressure = rabbitmq.backpressure
+        self.forwarded = {EXCHANGES[key] for key, enabled in forward.items() if enabled}
+        self.consumers = defaultdict(list)  # { exchange: [async callable(payload)] }
+
+    def consume(self, exchange: str, handler):
+        self.consumers[exchange].append(handler)
+
+    async def publish(self, exchange: str, routing_key: str, payload: dict, **properties):
+        consumers = self.consumers.get(exchange)
+        for handler in consumers or ():
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.error(f"[AgentRuntime] ❌ In-process consumer of {exchange} failed: {e}")
+        if not consumers or exchange in self.forwarded:
+            await self.rabbitmq.publish(exchange, routing_key, payload, **properties)
+
+
+class Stage:
+    """
+    One pipeline in the runtime. process_record(room_id, sensor_type,
+    sensor_data, timestamp, output, message_id=...) gets every decoded reading
+    and its joined record; background are coroutine functions run alongside; close runs on shutdown;
+    backpressure reports how far the stage's writers have fallen behind (0.0 - 1.0).
+    """
+
+    __slots__ = ("name", "process_record", "background", "close", "backpressure")
+
+    def __init__(self, name: str, process_record=None, background=(), close=None, backpressure=None):
+        self.name = name
+        self.process_record = process_record
+        self.background = list(background)
+        self.close = close
+        self.backpressure = backpressure
+
+
+# -----------------------------
+# Stages (imported on demand, so unused stages cost nothing at startup)
+# -----------------------------
+def fault_stage(bus: LocalBus, tenant: str, rooms) -> Stage:
+    from fault_detection_agent import FaultDetectionAgent
+
+    agent = FaultDetectionAgent(bus, tenant)
+    for room_id in rooms:
+        for sensor_type in SENSOR_DATAPOINTS:
+            agent.watchdog.watch(room_id, sensor_type)
+    return Stage("fault", agent.process_record, [agent.run_watchdog, agent.run_digests, agent.run_room_sensors], agent.close,
+                 agent.backpressure)
+
+
+def occupancy_stage(bus: LocalBus, tenant: str, rooms) -> Stage:
+    from occupancy_detection_agent import OccupancyDetectionAgent
+
+    agent = OccupancyDetectionAgent(bus)
+    return Stage("occupancy", agent.process_record)
+
+
+def updater_stage(bus: LocalBus, tenant: str, rooms) -> Stage:
+    from supabase_updater_agent import ROOM_STATE_CACHE, process_update
+
+    # Consumes what the fault and occupancy stages publish; the room_states flusher is shared by all tenants
+    bus.consume(EXCHANGES["fault_alerts"], process_update)
+    bus.consume(EXCHANGES["occupancy"], process_update)
+    return Stage("updater", backpressure=ROOM_STATE_CACHE.backpressure)
+
+
+STAGES = {
+    "fault": fault_stage,
+    "occupancy": occupancy_stage,
+    "updater": updater_stage,
+}
+
+
+class AgentRuntime:
+    """
+    Runs the agents of one tenant in one process. Each sensor message is
+    delivered once, decoded once, deduplicated once and joined once; the
+    joined record is then passed to each stage in order. A failing stage is
+    logged and does not keep the others from seeing the reading.
+    """
+
+    def __init__(self, rabbitmq: AsyncRabbitMQManager, tenant: str, rooms, stages: list[str] = None,
+                 subscriber: SensorSubscriber = None):
+        self.bus = LocalBus(rabbitmq, RUNTIME_CONFIG["forward"])
+        self.subscriber = subscriber or SensorSubscriber()
+        self.dedup = MessageDeduplicator()
+        names = [name for name in stages or RUNTIME_CONFIG["stages"] if name in STAGES]
+        # Consumers register on the bus before any stage can publish
+        names.sort(key=lambda name: name != "updater")
+        self.stages = [STAGES[name](self.bus, tenant, rooms) for name in names]
+        self.pipeline = [stage for stage in self.stages if stage.process_record is not None]
+
+    async def handle_message(self, message: aio_pika.IncomingMessage):
+        try:
+            async with message.process(ignore_processed=True):
+                with tracer.span("decode"):
+                    parsed = json.loads(message.body)
+                room_id = parsed.get("room_id")
+                message_id = message.message_id or parsed.get("message_id")
+                if self.dedup.is_duplicate(room_id, message_id):
+                    logger.info(f"[AgentRuntime] ⏭️ Skipping redelivered message {message_id} for {room_id}")
+                    return
+
+                sensor_type = message.routing_key.rsplit(".", 1)[-1]
+                await self.process_reading(room_id, sensor_type, parsed.get("data", {}), parsed.get("timestamp"), message_id)
+                self.dedup.remember(room_id, message_id)
+
+        except Exception as e:
+            # Undecodable message; rejected without requeue, so the broker dead-letters it
+            logger.error(f"[AgentRuntime] ❌ Error processing message: {e}")
+
+    async def process_reading(self, room_id: str, sensor_type: str, sensor_data: dict, timestamp, message_id: str = None):
+        with tracer.span("join", room_id=room_id):
+            output = self.subscriber.join(room_id, sensor_type, sensor_data, timestamp)
+
+        for stage in self.pipeline:
+            try:
+                with tracer.span(stage.name):
+                    await stage.process_record(room_id, sensor_type, sensor_data, timestamp, output, message_id=message_id)
+            except Exception as e:
+                logger.error(f"[AgentRuntime] ❌ {stage.name} stage failed for {room_id}: {e}")
+
+    async def process_batch(self, readings: list[dict]):
+        """An envelope of raw readings, joined and run through the stages in order."""
+        for reading in readings:
+            try:
+                await self.process_reading(reading.get("room_id"), reading.get("sensor_type"),
+                                           reading.get("data", {}), reading.get("timestamp"), reading.get("message_id"))
+            except Exception as e:
+                logger.error(f"[AgentRuntime] ❌ Skipping reading {reading.get('message_id')} for {reading.get('room_id')} in envelope: {e}")
+
+    def background(self) -> list:
+        return [run() for stage in self.stages for run in stage.background]
+
+    def close(self):
+        for stage in self.stages:
+            if stage.close is not None:
+                stage.close()
+
+    def backpressure(self) -> float:
+        """Worst fill ratio of the publish retry buffer and the stages' writers (0.0 - 1.0)."""
+        stages = [stage.backpressure() for stage in self.stages if stage.backpressure is not None]
+        return max([self.bus.backpressure(), *stages])
+
+
+async def run_tenant(tenant: str, subscriber: SensorSubscriber = None):
+    name = tenant_name("AgentRuntime", tenant)
+    quota = tenant_quota(tenant)
+    rooms = tenant_rooms(tenant)
+    logger.info(f"[{name}] Connecting to RabbitMQ...")
+
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=quota.prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
+
+        runtime = AgentRuntime(rabbitmq, tenant, rooms, subscriber=subscriber)
+        flow = AdaptiveConcurrencyLimiter(name, backpressure=runtime.backpressure,
+                                          max_concurrency=quota.max_concurrency, max_prefetch=quota.prefetch)
+        await flow.attach(await rabbitmq.get_lane_channel("telemetry"))
+        handler = flow.wrap(runtime.handle_message)
+
+        # One queue per room and sensor instead of one per room, sensor and agent
+        for room_id in rooms:
+            for sensor_type in SENSOR_DATAPOINTS:
+                await rabbitmq.subscribe(
+                    EXCHANGES["sensor_data"], f"{room_id}_{sensor_type}_runtime_queue",
+                    f"{room_id}.{sensor_type}", handler, lane="telemetry"
+                )
+        if envelopes_enabled():
+            envelopes = EnvelopeConsumer(name, runtime.process_batch, runtime.dedup)
+            await rabbitmq.subscribe(
+                EXCHANGES["sensor_data"], "envelope_runtime_queue", ENVELOPE_CONFIG["routing_key"],
+                envelopes.handle_message, lane="telemetry"
+            )
+
+        tasks = [asyncio.create_task(coroutine) for coroutine in [flow.run(), *runtime.background()]]
+        logger.info(f"[{name}] 🟢 Running stages: {', '.join(stage.name for stage in runtime.stages)}")
+        mark_ready(name)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            runtime.close()
+
+
+async def main():
+    setup_tracing("AgentRuntime")
+    stages = RUNTIME_CONFIG["stages"]
+    tasks = []
+
+    subscriber = None
+    if "latest" in stages:
+        # Replaces sensors_subscriber.py: latest-value index and floor/building rollups over HTTP
+        from latest_values import LatestValueIndex, serve_http
+        from room_registry import HierarchyAggregator, get_registry
+
+        registry = get_registry()
+        registry.start_watching()
+        latest_index = LatestValueIndex()
+        aggregator = HierarchyAggregator(registry)
+        subscriber = SensorSubscriber(latest_index=latest_index, aggregator=aggregator)
+        serve_http(latest_index, aggregator=aggregator)
+
+    if "updater" in stages:
+        from supabase_updater_agent import room_state_flusher
+        tasks.append(asyncio.create_task(room_state_flusher()))
+
+    try:
+        await run_for_tenants("AgentRuntime", lambda tenant: run_tenant(tenant, subscriber))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("[AgentRuntime] 🔴 Stopped by user.")
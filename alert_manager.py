@@ -0,0 +1,111 @@
+# alert_manager.py
+
+import time
+from collections import defaultdict
+from anomaly_detection import SEVERITIES
+
+
+class Incident:
+    __slots__ = ("active", "severity", "violations", "clean", "details", "raised_at", "suppressed")
+
+    def __init__(self):
+        self.active = False
+        self.severity = "healthy"
+        self.violations = 0   # consecutive violating checks
+        self.clean = 0        # consecutive clean checks while active
+        self.details = []
+        self.raised_at = None
+        self.suppressed = 0   # repeats swallowed since the last digest
+
+
+class AlertManager:
+    """
+    Turns a stream of per-reading check results into incidents.
+    Incidents are keyed by (room_id, source, datapoint):
+      - raise after raise_after[severity] consecutive violations
+      - escalate immediately when an active incident gets worse
+      - swallow repeats of an active incident (counted for the digest)
+      - clear after clear_after consecutive clean checks
+    Only datapoints that are violating or active hold state.
+    """
+
+    def __init__(self, raise_after: dict[str, int], clear_after: int):
+        self.raise_after = raise_after
+        self.clear_after = clear_after
+        self.incidents = {}  # { (room_id, source, datapoint): Incident }
+
+    def observe(self, room_id: str, source: str, violations: dict[str, tuple[str, list[str]]],
+                checked, now: float = None) -> tuple[list[tuple[str, str, list[str]]], list[str]]:
+        """
+        violations: { datapoint: (severity, [details]) } found in this reading.
+        checked: every datapoint this reading was checked for.
+        Returns (raised, cleared): raised as (datapoint, severity, details) for new
+        or escalated incidents, cleared as datapoints whose incident ended.
+        """
+        now = time.time() if now is None else now
+        raised, cleared = [], []
+
+        for datapoint, (severity, details) in violations.items():
+            incident = self.incidents.setdefault((room_id, source, datapoint), Incident())
+            incident.violations += 1
+            incident.clean = 0
+            incident.details = details
+
+            if not incident.active:
+                if incident.violations >= self.raise_after.get(severity, 1):
+                    incident.active, incident.severity, incident.raised_at = True, severity, now
+                    raised.append((datapoint, severity, details))
+            elif SEVERITIES.index(severity) > SEVERITIES.index(incident.severity):
+                incident.severity = severity
+                raised.append((datapoint, severity, details))
+            else:
+                incident.suppressed += 1
+
+        for datapoint in checked:
+            if datapoint in violations:
+                continue
+            key = (room_id, source, datapoint)
+            incident = self.incidents.get(key)
+            if incident is None:
+                continue
+            if not incident.active:
+                del self.incidents[key]  # streak broken before it was raised
+                continue
+            incident.violations = 0
+            incident.clean += 1
+            if incident.clean >= self.clear_after:
+                del self.incidents[key]
+                cleared.append(datapoint)
+
+        return raised, cleared
+
+    def digest(self, now: float = None) -> list[dict]:
+        """One summary per room of active incidents that kept firing since the last digest."""
+        now = time.time() if now is None else now
+        rooms = defaultdict(list)
+        for (room_id, source, datapoint), incident in self.incidents.items():
+            if incident.active and incident.suppressed:
+                rooms[room_id].append((source, datapoint, incident))
+
+        digests = []
+        for room_id, entries in rooms.items():
+            digests.append({
+                "room_id": room_id,
+                "timestamp": int(now),
+                "faults": [
+                    f"{datapoint} ({source}) ongoing for {now - incident.raised_at:.0f}s, "
+                    f"{incident.suppressed} repeat(s): {'; '.join(incident.details)}"
+                    for source, datapoint, incident in entries
+                ],
+                "datapoint": ", ".join(sorted({datapoint for _, datapoint, _ in entries})),
+                "health_status": max((incident.severity for _, _, incident in entries), key=SEVERITIES.index),
+                "suppressed": sum(incident.suppressed for _, _, incident in entries),
+                "digest": True
+            })
+            for _, _, incident in entries:
+                incident.suppressed = 0
+        return digests
+
+    def active(self, room_id: str = None) -> list[tuple[str, str, str]]:
+        return [(r, source, datapoint) for (r, source, datapoint), incident in self.incidents.items()
+                if incident.active and (room_id is None or r == room_id)]
@@ -0,0 +1,148 @@
+# anomaly_detection.py
+
+import numpy as np
+from config import ANOMALY_CONFIG
+
+SEVERITIES = ["healthy", "warning", "critical"]
+
+
+class StreamingAnomalyDetector:
+    """
+    Statistical anomaly detection next to the fixed thresholds.
+    State is O(1) per (room, datapoint) and kept in NumPy arrays of shape
+    (rooms, datapoints): a windowed Welford mean/variance, the last value and
+    timestamp, and the run length of unchanged values. A batch of readings
+    from many rooms is checked in one vectorised pass for:
+      - spikes: z-score against the rolling mean/std
+      - stuck values: the same value repeated stuck_count times
+      - flat lines: rolling std collapsed below flat_std
+      - rate of change: |Δvalue| per minute above max_rate
+    Severities map onto room_states.health_status ("warning" / "critical").
+    """
+
+    def __init__(self, datapoints: list[str] = None, capacity: int = 64):
+        self.datapoints = datapoints or list(ANOMALY_CONFIG["datapoints"])
+        self.rules = [ANOMALY_CONFIG["datapoints"][dp] for dp in self.datapoints]
+        self.max_rate = np.array([rule["max_rate"] for rule in self.rules])
+        self.stuck_count = np.array([rule["stuck_count"] for rule in self.rules])
+        self.flat_std = np.array([rule["flat_std"] for rule in self.rules])
+        self.window = ANOMALY_CONFIG["window"]
+        self.room_index = {}  # { room_id: row }
+
+        shape = (capacity, len(self.datapoints))
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.last_value = np.full(shape, np.nan)
+        self.last_time = np.full(shape, np.nan)
+        self.run = np.zeros(shape, dtype=np.int64)
+
+    def _rows(self, room_ids: list[str]) -> np.ndarray:
+        for room_id in room_ids:
+            if room_id not in self.room_index:
+                if len(self.room_index) == len(self.count):
+                    self._grow(2 * len(self.count))
+                self.room_index[room_id] = len(self.room_index)
+        return np.array([self.room_index[room_id] for room_id in room_ids], dtype=np.int64)
+
+    def _grow(self, capacity: int):
+        def grown(array, fill):
+            bigger = np.full((capacity, array.shape[1]), fill, dtype=array.dtype)
+            bigger[:len(array)] = array
+            return bigger
+
+        self.count, self.mean, self.m2 = grown(self.count, 0), grown(self.mean, 0), grown(self.m2, 0)
+        self.last_value, self.last_time = grown(self.last_value, np.nan), grown(self.last_time, np.nan)
+        self.run = grown(self.run, 0)
+
+    def observe_batch(self, room_ids: list[str], values: np.ndarray, timestamps: np.ndarray) -> list[dict]:
+        """
+        values: (n, len(datapoints)) with NaN where a datapoint is absent.
+        timestamps: (n,) epoch seconds. Readings are applied in order; a room
+        appearing twice in one batch is handled in successive waves. Each
+        anomaly carries "index", the position of its reading in the batch.
+        """
+        values = np.asarray(values, dtype=float)
+        timestamps = np.asarray(timestamps, dtype=float)
+        rows = self._rows(room_ids)
+
+        # Occurrence rank of each row's room within the batch -> waves of unique rooms
+        rank = np.zeros(len(rows), dtype=np.int64)
+        seen = {}
+        for i, row in enumerate(rows):
+            rank[i] = seen.get(row, 0)
+            seen[row] = rank[i] + 1
+
+        anomalies = []
+        for wave in range(int(rank.max()) + 1 if len(rows) else 0):
+            picked = np.nonzero(rank == wave)[0]
+            anomalies.extend(self._observe_wave(
+                picked, [room_ids[i] for i in picked], rows[picked], values[picked], timestamps[picked]
+            ))
+        return anomalies
+
+    def _observe_wave(self, indices, room_ids, rows, x, t) -> list[dict]:
+        valid = ~np.isnan(x)
+        n, mean, m2 = self.count[rows], self.mean[rows], self.m2[rows]
+        last, last_t = self.last_value[rows], self.last_time[rows]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(np.where(n > 1, m2 / np.maximum(n - 1, 1), 0.0))
+            ready = valid & (n >= ANOMALY_CONFIG["min_samples"])
+            z = np.where(ready, np.abs(x - mean) / np.maximum(std, self.flat_std), 0.0)
+
+            minutes = (t[:, None] - last_t) / 60.0
+            rate = np.where(valid & ~np.isnan(last) & (minutes > 0), np.abs(x - last) / minutes, 0.0)
+
+        unchanged = valid & (x == last)
+        run = np.where(unchanged, self.run[rows] + 1, np.where(valid, 0, self.run[rows]))
+
+        severity = np.zeros(x.shape, dtype=np.int64)
+        kinds = {
+            "spike": (z >= ANOMALY_CONFIG["z_warning"], np.where(z >= ANOMALY_CONFIG["z_critical"], 2, 1)),
+            "stuck": (valid & (run >= self.stuck_count), 1),
+            "flat-line": (ready & ~unchanged & (std < self.flat_std), 1),
+            "rate": (rate > self.max_rate, np.where(rate > 3 * self.max_rate, 2, 1)),
+        }
+
+        anomalies = []
+        for kind, (hit, level) in kinds.items():
+            level = np.broadcast_to(level, hit.shape)
+            severity = np.where(hit, np.maximum(severity, level), severity)
+            for i, j in zip(*np.nonzero(hit)):
+                anomalies.append({
+                    "index": int(indices[i]),
+                    "room_id": room_ids[i],
+                    "datapoint": self.datapoints[j],
+                    "kind": kind,
+                    "severity": SEVERITIES[level[i, j]],
+                    "value": float(x[i, j]),
+                    "detail": self._describe(kind, j, x[i, j], mean[i, j], std[i, j], z[i, j], rate[i, j], run[i, j]),
+                })
+
+        # Windowed Welford update: past `window` samples, old history decays out
+        n_new = np.where(valid, np.minimum(n + 1, self.window), n)
+        decay = np.where(valid & (n >= self.window), (self.window - 1) / self.window, 1.0)
+        delta = np.where(valid, x - mean, 0.0)
+        mean_new = mean + np.where(valid, delta / np.maximum(n_new, 1), 0.0)
+        m2_new = m2 * decay + np.where(valid, delta * (x - mean_new), 0.0)
+
+        self.count[rows], self.mean[rows], self.m2[rows] = n_new, mean_new, m2_new
+        self.last_value[rows] = np.where(valid, x, last)
+        self.last_time[rows] = np.where(valid, t[:, None], last_t)
+        self.run[rows] = run
+        return anomalies
+
+    def _describe(self, kind, j, value, mean, std, z, rate, run) -> str:
+        name = self.datapoints[j]
+        if kind == "spike":
+            return f"{name} spike: {value:g} is {z:.1f}σ from rolling mean {mean:.1f} (σ={std:.2f})"
+        if kind == "stuck":
+            return f"{name} stuck at {value:g} for {run} readings"
+        if kind == "flat-line":
+            return f"{name} flat-lined: rolling σ={std:.4f} below {self.flat_std[j]:g}"
+        return f"{name} changing too fast: {rate:.1f}/min > {self.max_rate[j]:g}/min"
+
+
+def worst_severity(anomalies: list[dict]) -> str:
+    return max((a["severity"] for a in anomalies), key=SEVERITIES.index, default="healthy")
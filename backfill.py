@@ -0,0 +1,157 @@
+# backfill.py
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import psycopg2
+import pytz
+from config import ROOM_IDS, TIMESCALE_CONFIG, ALERT_CONFIG, TIMEZONE
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("Backfill")
+
+
+def stream_records(conn, room_id: str, start: datetime, end: datetime, chunk_records: int):
+    """
+    Stream one room's raw_data through a server-side cursor and pivot it back
+    into combined records ({datapoint: value, ...} per reading time), yielded
+    in chunks of chunk_records. Only one chunk is held in memory at a time.
+    """
+    with conn.cursor(name=f"backfill_{room_id}") as cursor:
+        cursor.itersize = chunk_records * 8  # ~8 datapoints per combined record
+        cursor.execute("""
+            SELECT timestamp, datetime, datapoint, value FROM raw_data
+            WHERE device_id = %s AND datetime >= %s AND datetime < %s
+            ORDER BY datetime
+        """, (room_id, start, end))
+
+        chunk, record = [], None
+        for timestamp, dt, datapoint, value in cursor:
+            if record is None or record["datetime"] != dt:
+                if record is not None:
+                    chunk.append(record)
+                    if len(chunk) >= chunk_records:
+                        yield chunk
+                        chunk = []
+                record = {"device_id": room_id, "timestamp": timestamp or int(dt.timestamp()), "datetime": dt}
+            record[datapoint] = value
+        if record is not None:
+            chunk.append(record)
+        if chunk:
+            yield chunk
+
+
+def backfill_window(room_id: str, start: datetime, end: datetime, chunk_records: int, dry_run: bool) -> dict:
+    """
+    Worker: replay one room/time window through the fault and occupancy logic.
+    Detection state (incidents, CO₂ history) starts fresh for each window.
+    """
+    # Agent modules are imported in the worker so the parent process stays light
+    from alert_manager import AlertManager
+    from database_writer import BackfillWriter
+    from fault_detection_agent import THRESHOLDS, check_thresholds
+    from occupancy_detection_agent import OccupancyDetectionAgent
+
+    logging.getLogger("OccupancyAgent").setLevel(logging.WARNING)  # per-reading logs would dominate the run
+
+    alerts = AlertManager(ALERT_CONFIG["raise_after"], ALERT_CONFIG["clear_after"])
+    occupancy = OccupancyDetectionAgent(rabbitmq=None)
+    fault_rows, occupancy_rows = [], []
+    records, last_decision = 0, None
+
+    conn = psycopg2.connect(
+        host=TIMESCALE_CONFIG["host"],
+        port=TIMESCALE_CONFIG["port"],
+        user=TIMESCALE_CONFIG["user"],
+        password=TIMESCALE_CONFIG["password"],
+        dbname=TIMESCALE_CONFIG["dbname"],
+    )
+    try:
+        for chunk in stream_records(conn, room_id, start, end, chunk_records):
+            for record in chunk:
+                dt = record["datetime"]
+                violations = check_thresholds(record)
+                raised, cleared = alerts.observe(
+                    room_id, "threshold", {dp: ("critical", faults) for dp, faults in violations.items()},
+                    checked=[key for key in THRESHOLDS if key in record], now=record["timestamp"]
+                )
+                for datapoint, severity, details in raised:
+                    fault_rows.append((room_id, dt, "threshold", datapoint, severity, "; ".join(details)))
+                for datapoint in cleared:
+                    fault_rows.append((room_id, dt, "threshold", datapoint, "healthy", None))
+
+                decision = occupancy.detect_occupancy(room_id, {k: v for k, v in record.items() if v != "null"})
+                if decision != last_decision:
+                    occupancy_rows.append((room_id, dt, decision))
+                    last_decision = decision
+            records += len(chunk)
+    finally:
+        conn.close()
+
+    if not dry_run and records:
+        writer = BackfillWriter()
+        try:
+            writer.replace_events(room_id, start, end, fault_rows, occupancy_rows)
+        finally:
+            writer.close()
+
+    return {"room_id": room_id, "start": start, "records": records,
+            "fault_events": len(fault_rows), "occupancy_events": len(occupancy_rows)}
+
+
+def work_units(room_ids: list[str], start: datetime, end: datetime, window: timedelta):
+    for room_id in room_ids:
+        t = start
+        while t < end:
+            yield room_id, t, min(t + window, end)
+            t += window
+
+
+def parse_time(value: str) -> datetime:
+    dt = datetime.fromisoformat(value)
+    return pytz.timezone(TIMEZONE).localize(dt) if dt.tzinfo is None else dt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay raw_data history through the fault and occupancy logic.")
+    parser.add_argument("--start", required=True, type=parse_time, help="ISO time, local timezone if naive")
+    parser.add_argument("--end", type=parse_time, default=None, help="ISO time (default: now)")
+    parser.add_argument("--rooms", default=",".join(ROOM_IDS), help="comma-separated room IDs")
+    parser.add_argument("--window-hours", type=float, default=24, help="room time slice per work unit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=5000, help="combined records per cursor chunk")
+    parser.add_argument("--dry-run", action="store_true", help="run detection but do not write results")
+    args = parser.parse_args()
+
+    end = args.end or datetime.now(pytz.timezone(TIMEZONE))
+    units = list(work_units(args.rooms.split(","), args.start, end, timedelta(hours=args.window_hours)))
+    logger.info(f"[Backfill] {len(units)} work unit(s) from {args.start} to {end} on {args.workers} worker(s)")
+
+    started = time.monotonic()
+    totals = {"records": 0, "fault_events": 0, "occupancy_events": 0}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(backfill_window, room_id, t0, t1, args.chunk, args.dry_run): (room_id, t0)
+                   for room_id, t0, t1 in units}
+        for future in as_completed(futures):
+            room_id, t0 = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"[Backfill] ❌ {room_id} from {t0} failed: {e}")
+                continue
+            for key in totals:
+                totals[key] += result[key]
+            logger.info(f"[Backfill] ✅ {room_id} from {t0}: {result['records']} records, "
+                        f"{result['fault_events']} fault event(s), {result['occupancy_events']} occupancy change(s)")
+
+    elapsed = time.monotonic() - started
+    logger.info(f"[Backfill] Done in {elapsed:.1f}s: {totals['records']} records "
+                f"({totals['records'] / max(elapsed, 1e-9):.0f}/s), {totals['fault_events']} fault event(s), "
+                f"{totals['occupancy_events']} occupancy change(s){' (dry run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,88 @@
 # database_writer.py
 
 
-import psycopg2
-from psycopg2.extras import execute_values
 import logging
+import os
+import time
 from datetime import datetime
-from config import TIMESCALE_CONFIG, SUPABASE_HTTP_CONFIG
-from supabase import create_client, Client
+import asyncio
+from config import (TIMESCALE_CONFIG, SUPABASE_CONFIG, SUPABASE_HTTP_CONFIG, SPOOL_CONFIG,
+                    TENANCY_CONFIG, ROOM_SENSORS_CONFIG)
+from spool import SegmentedSpool
+from startup import lazy_import
+from time_service import clock
+
+# Database clients load on first use, so importing a writer costs nothing at agent startup
+psycopg2 = lazy_import("psycopg2")
+psycopg2_pool = lazy_import("psycopg2.pool")
+httpx = lazy_import("httpx")
 
 # Logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INSERT_RAW_DATA = """
+    INSERT INTO raw_data (timestamp, datetime, device_id, datapoint, value, tenant_id, message_id)
+    VALUES %s
+    ON CONFLICT (tenant_id, device_id, datapoint, datetime, message_id) DO NOTHING
+"""
+
+
+def execute_values(*args, **kwargs):
+    from psycopg2.extras import execute_values
+    return execute_values(*args, **kwargs)
+
+
+_schema_checked = set()  # relations known to exist, checked once per process
+
+
+def _schema_ready(cursor, relation: str) -> bool:
+    """
+    True when `relation` already exists. Lets writers skip their DDL (and the
+    locks it takes) on every start and reconnect except against a fresh database.
+    """
+    if relation in _schema_checked:
+        return True
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (relation,))
+    exists = cursor.fetchone()[0]
+    cursor.connection.commit()  # don't leave the connection idle in a transaction
+    if exists:
+        _schema_checked.add(relation)
+        return True
+    return False
+
+
+def _raw_data_row(data: dict, tenant_id: str) -> tuple:
+    dt = data.get("datetime") or clock.isoformat(data["timestamp"])
+    return data["timestamp"], dt, data["device_id"], data["datapoint"], data["value"], tenant_id, data.get("message_id") or ""
+
+
 class TimescaleDBWriter:
-    def __init__(self):
+    """
+    raw_data writer for one tenant. Rows beyond the tenant's write quota, like
+    rows written while TimescaleDB is down, go to the tenant's spool and are
+    drained in batches as the quota refills. The connection is opened by the
+    first write, not at construction.
+    """
+
+    def __init__(self, tenant_id: str = None, write_quota=None):
         self.conn = None
         self.cursor = None
-        self.connect()
-        self._create_table()
+        self.next_retry = 0.0
+        self.tenant_id = tenant_id or TENANCY_CONFIG["default_tenant"]
+        self.write_quota = write_quota  # tenancy.TokenBucket
+        spool_name = "timescale" if self.tenant_id == TENANCY_CONFIG["default_tenant"] else f"timescale_{self.tenant_id}"
+        self.spool = SegmentedSpool(
+            os.path.join(SPOOL_CONFIG["directory"], spool_name),
+            segment_bytes=SPOOL_CONFIG["segment_bytes"],
+            max_bytes=SPOOL_CONFIG["max_bytes"],
+            fsync=SPOOL_CONFIG["fsync"]
+        )
+
+    def backpressure(self) -> float:
+        """Fill ratio of the spool against its high-water mark (0.0 - 1.0); rows over quota or
+        written while TimescaleDB is down pile up there."""
+        return min(1.0, len(self.spool) / SPOOL_CONFIG["high_water"])
 
     def connect(self):
         try:
@@ -34,8 +99,35 @@ class TimescaleDBWriter:
             logger.error(f"❌ Failed to connect to TimescaleDB: {e}")
             raise
 
+    def _ensure_connection(self) -> bool:
+        """Reconnect at most once per retry interval while TimescaleDB is down."""
+        if self.conn is not None and not self.conn.closed:
+            return True
+        if time.monotonic() < self.next_retry:
+            return False
+        try:
+            self.connect()
+            self._create_table()
+            return True
+        except Exception as e:
+            self._mark_down(e)
+            return False
+
+    def _mark_down(self, reason):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+        self.next_retry = time.monotonic() + SPOOL_CONFIG["retry_interval"]
+        logger.warning(f"⚠️ TimescaleDB unavailable ({reason}), spooling rows to disk | spool={self.spool.stats()}")
+
     def _create_table(self):
-        """Create the raw_data table if not exists"""
+        """
+        Create the raw_data table and its reading key if missing. Raises when the
+        key cannot be built: without it every insert fails its ON CONFLICT, so
+        rows stay spooled until the table is fixed.
+        """
+        if _schema_ready(self.cursor, "raw_data_tenant_message_key"):
+            return
         try:
             self.cursor.execute("""
                 CREATE TABLE IF NOT EXISTS raw_data (
@@ -43,33 +135,219 @@ class TimescaleDBWriter:
                     datetime TIMESTAMPTZ NOT NULL,
                     device_id TEXT NOT NULL,
                     datapoint TEXT NOT NULL,
-                    value TEXT NOT NULL
+                    value TEXT NOT NULL,
+                    tenant_id TEXT NOT NULL DEFAULT 'default',
+                    message_id TEXT NOT NULL DEFAULT ''
                 );
             """)
+            self.cursor.execute("ALTER TABLE raw_data ADD COLUMN IF NOT EXISTS tenant_id TEXT NOT NULL DEFAULT 'default';")
+            self.cursor.execute("ALTER TABLE raw_data ADD COLUMN IF NOT EXISTS message_id TEXT NOT NULL DEFAULT '';")
+            # A reading is its producer message: redeliveries hit ON CONFLICT DO NOTHING, while two
+            # readings in the same second stay apart. Rows without a message ID ('') fall back to
+            # the per-second key. Room IDs are unique across tenants; tenant_id is only in the key
+            # because TimescaleDB unique indexes must include every partitioning column.
+            self.cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS raw_data_tenant_message_key
+                ON raw_data (tenant_id, device_id, datapoint, datetime, message_id);
+            """)
+            self.cursor.execute("DROP INDEX IF EXISTS raw_data_tenant_reading_key;")
+            self.cursor.execute("DROP INDEX IF EXISTS raw_data_reading_key;")
             self.conn.commit()
+            _schema_checked.add("raw_data_tenant_message_key")
             logger.info("✅ Ensured table 'raw_data' exists")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
         except Exception as e:
-            logger.error(f"❌ Failed to create table: {e}")
             self.conn.rollback()
+            logger.critical(f"❌ Cannot create raw_data_tenant_message_key ({e}); remove the duplicate rows it reports, "
+                            f"raw_data rows are spooled until then")
+            raise
 
     def insert_sensor_data(self, data: dict):
-        """Insert one data row into raw_data"""
+        """Insert one data row into raw_data, or spool it while TimescaleDB is down or the tenant is over quota"""
+        self.insert_many([data])
+
+    def insert_many(self, records: list[dict]):
+        """Insert rows into raw_data with one statement and commit; spooled like insert_sensor_data."""
+        if not records:
+            return
+        # Older spooled rows go first, as far as the quota and the connection allow
+        self.drain_spool()
+        # Keep arrival order: only while rows are still spooled do new ones queue up behind them
+        backlog = len(self.spool) > 0
+        over_quota = not backlog and self.write_quota is not None and not self.write_quota.try_take(len(records))
+        if backlog or over_quota or not self._ensure_connection():
+            for data in records:
+                self.spool.append(data)
+                if len(self.spool) % 1000 == 0:
+                    logger.warning(f"📦 TimescaleDB spool depth: {self.spool.stats()}")
+            return
+
+        rows = [_raw_data_row(data, self.tenant_id) for data in records]
+        try:
+            execute_values(self.cursor, INSERT_RAW_DATA, rows, page_size=len(rows))
+            self.conn.commit()
+            logger.debug(f"Inserted {len(rows)} row(s)")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self._mark_down(e)
+            for data in records:
+                self.spool.append(data)
+        except Exception as e:
+            self.conn.rollback()
+            if len(rows) == 1:
+                logger.error(f"❌ Insert failed: {e} | Data: {records[0]}")
+                return
+            # One bad row fails the whole batch; retry row by row and drop only the rejects
+            logger.error(f"❌ Batch insert rejected ({e}), retrying row by row")
+            for i, (data, row) in enumerate(zip(records, rows)):
+                try:
+                    execute_values(self.cursor, INSERT_RAW_DATA, [row])
+                    self.conn.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as row_error:
+                    # Not a rejected row: spool it and the rest instead of dropping them
+                    self._mark_down(row_error)
+                    for pending in records[i:]:
+                        self.spool.append(pending)
+                    return
+                except Exception as row_error:
+                    self.conn.rollback()
+                    logger.error(f"❌ Insert failed: {row_error} | Data: {data}")
+
+    def drain_spool(self, ignore_quota: bool = False):
+        """Write spooled rows back in large batches once TimescaleDB is reachable (and the tenant has quota)."""
+        if not len(self.spool) or not self._ensure_connection():
+            return
+
+        drained = 0
+        while len(self.spool):
+            batch = min(SPOOL_CONFIG["drain_batch"], len(self.spool))  # don't take quota for rows that aren't there
+            if self.write_quota is not None and not ignore_quota:
+                batch = self.write_quota.take_up_to(batch)
+                if not batch:
+                    break
+            records, token = self.spool.read_batch(batch)
+            rows = [_raw_data_row(record, self.tenant_id) for record in records]
+            try:
+                execute_values(self.cursor, INSERT_RAW_DATA, rows, page_size=len(rows))
+                self.conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self._mark_down(e)
+                return
+            except Exception as e:
+                # One bad row fails the whole batch; retry row by row and drop only the rejects
+                self.conn.rollback()
+                logger.error(f"❌ Spooled batch rejected ({e}), retrying row by row")
+                for row in rows:
+                    try:
+                        execute_values(self.cursor, INSERT_RAW_DATA, [row])
+                        self.conn.commit()
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError) as row_error:
+                        # Not a rejected row (e.g. QueryCanceled, lost connection): leave the batch
+                        # spooled; rows already written conflict and are skipped on the retry
+                        self._mark_down(row_error)
+                        return
+                    except Exception as row_error:
+                        self.conn.rollback()
+                        logger.error(f"❌ Dropping spooled row {row}: {row_error}")
+            self.spool.commit(token)
+            drained += len(rows)
+
+        if drained and not len(self.spool):
+            logger.info(f"✅ Drained {drained} spooled row(s) into TimescaleDB")
+
+    def close(self):
+        self.drain_spool(ignore_quota=True)
+        self.spool.close()
+        if self.cursor:
+            self.cursor.close()
+        if self.conn:
+            self.conn.close()
+            logger.info("🛑 TimescaleDB connection closed")
+
+
+class EnergyRollupWriter:
+    """
+    Adds kWh deltas onto energy_rollups (room/floor x hour/day buckets). Each
+    batch is recorded in energy_rollup_batches in the same transaction, so a
+    batch retried after a lost commit response is not added twice. Connects
+    on the first flush.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.cursor = None
+
+    def connect(self):
+        try:
+            self.conn = psycopg2.connect(
+                host=TIMESCALE_CONFIG["host"],
+                port=TIMESCALE_CONFIG["port"],
+                user=TIMESCALE_CONFIG["user"],
+                password=TIMESCALE_CONFIG["password"],
+                dbname=TIMESCALE_CONFIG["dbname"],
+            )
+            self.cursor = self.conn.cursor()
+            logger.info("✅ Connected to TimescaleDB (energy rollups)")
+        except Exception as e:
+            logger.error(f"❌ Failed to connect to TimescaleDB: {e}")
+            raise
+
+    def _create_table(self):
         try:
+            if _schema_ready(self.cursor, "energy_rollup_batches"):
+                return
             self.cursor.execute("""
-                INSERT INTO raw_data (timestamp, datetime, device_id, datapoint, value)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (
-                data["timestamp"],
-                data["datetime"],
-                data["device_id"],
-                data["datapoint"],
-                data["value"]
-            ))
+                CREATE TABLE IF NOT EXISTS energy_rollups (
+                    scope TEXT NOT NULL,
+                    scope_id TEXT NOT NULL,
+                    granularity TEXT NOT NULL,
+                    bucket TIMESTAMPTZ NOT NULL,
+                    kwh DOUBLE PRECISION NOT NULL,
+                    vacant_kwh DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (scope, scope_id, granularity, bucket)
+                );
+                CREATE TABLE IF NOT EXISTS energy_rollup_batches (
+                    batch_id TEXT PRIMARY KEY,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            """)
             self.conn.commit()
-            logger.debug(f"Inserted data: {data}")
+            logger.info("✅ Ensured tables 'energy_rollups' and 'energy_rollup_batches' exist")
         except Exception as e:
-            logger.error(f"❌ Insert failed: {e} | Data: {data}")
+            logger.error(f"❌ Failed to create table: {e}")
+            self.conn.rollback()
+
+    def upsert_rollups(self, rows: list[tuple], batch_id: str) -> bool:
+        """
+        rows: (scope, scope_id, granularity, bucket, kwh, vacant_kwh) deltas. Returns False
+        when batch_id was already applied (nothing is added again). Raises on failure.
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+            self._create_table()
+        try:
+            self.cursor.execute(
+                "INSERT INTO energy_rollup_batches (batch_id) VALUES (%s) ON CONFLICT DO NOTHING", (batch_id,)
+            )
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                logger.info(f"🟢 Energy rollup batch {batch_id} was already applied")
+                return False
+            execute_values(self.cursor, """
+                INSERT INTO energy_rollups (scope, scope_id, granularity, bucket, kwh, vacant_kwh)
+                VALUES %s
+                ON CONFLICT (scope, scope_id, granularity, bucket) DO UPDATE SET
+                    kwh = energy_rollups.kwh + EXCLUDED.kwh,
+                    vacant_kwh = energy_rollups.vacant_kwh + EXCLUDED.vacant_kwh
+            """, rows, page_size=len(rows))
+            # Batch IDs are only needed while a batch can still be retried
+            self.cursor.execute("DELETE FROM energy_rollup_batches WHERE applied_at < NOW() - INTERVAL '1 day'")
+            self.conn.commit()
+            logger.info(f"🟢 Upserted {len(rows)} energy rollup(s)")
+            return True
+        except Exception:
             self.conn.rollback()
+            raise
 
     def close(self):
         if self.cursor:
@@ -79,49 +357,320 @@ class TimescaleDBWriter:
             logger.info("🛑 TimescaleDB connection closed")
 
 
-class SupabaseWriter:
+class BackfillWriter:
+    """Bulk writes of offline detection results (fault_events / occupancy_events)."""
+
     def __init__(self):
-        self.supabase: Client = create_client(
-            SUPABASE_HTTP_CONFIG["url"],
-            SUPABASE_HTTP_CONFIG["key"]
-        )
-        logger.info("✅ Connected to Supabase via HTTP")
+        self.conn = None
+        self.cursor = None
+        self.connect()
+        self._create_tables()
 
-    def upsert_sensor_data(self, room_id: str, data: dict):
+    def connect(self):
         try:
-            payload = {
-                "room_id": room_id,
-                "timestamp": data["timestamp"],
-                "datetime": data["datetime"],
-                "temperature": data.get("temperature", 0),
-                "humidity": data.get("humidity", 0),
-                "co2": data.get("co2", 0),
-                "presence_state": data.get("presence_state", "unknown"),
-                "power_data": data.get("power_kw_power_meter", 0)
-            }
-            self.supabase.table("room_sensors").upsert(payload).execute()
-            logger.info(f"🟢 Upserted sensor data for {room_id}")
+            self.conn = psycopg2.connect(
+                host=TIMESCALE_CONFIG["host"],
+                port=TIMESCALE_CONFIG["port"],
+                user=TIMESCALE_CONFIG["user"],
+                password=TIMESCALE_CONFIG["password"],
+                dbname=TIMESCALE_CONFIG["dbname"],
+            )
+            self.cursor = self.conn.cursor()
+            logger.info("✅ Connected to TimescaleDB (backfill results)")
         except Exception as e:
-            logger.error(f"❌ Failed to upsert sensor data to Supabase: {e}")
+            logger.error(f"❌ Failed to connect to TimescaleDB: {e}")
+            raise
 
-    def upsert_room_state(self, room_id: str, is_occupied: bool, datapoint: str, health_status: str = "healthy"):
+    def _create_tables(self):
         try:
-            now = datetime.now().isoformat()
-            payload = {
-                "room_id": room_id,
-                "is_occupied": is_occupied,
-                "vacancy_last_updated": now,
-                "datapoint": datapoint,
-                "health_status": health_status,
-                "datapoint_last_updated": now
-            }
-            self.supabase.table("room_states").upsert(payload).execute()
-            logger.info(f"🟢 Upserted room state for {room_id}, datapoint={datapoint}")
+            if _schema_ready(self.cursor, "fault_events") and _schema_ready(self.cursor, "occupancy_events"):
+                return
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS fault_events (
+                    device_id TEXT NOT NULL,
+                    datetime TIMESTAMPTZ NOT NULL,
+                    source TEXT NOT NULL,
+                    datapoint TEXT NOT NULL,
+                    health_status TEXT NOT NULL,
+                    detail TEXT,
+                    PRIMARY KEY (device_id, datapoint, source, datetime)
+                );
+                CREATE TABLE IF NOT EXISTS occupancy_events (
+                    device_id TEXT NOT NULL,
+                    datetime TIMESTAMPTZ NOT NULL,
+                    is_occupied BOOLEAN,
+                    PRIMARY KEY (device_id, datetime)
+                );
+            """)
+            self.conn.commit()
+            logger.info("✅ Ensured tables 'fault_events' and 'occupancy_events' exist")
         except Exception as e:
-            logger.error(f"❌ Failed to upsert room state to Supabase: {e}")
+            logger.error(f"❌ Failed to create tables: {e}")
+            self.conn.rollback()
+
+    def replace_events(self, room_id: str, start: datetime, end: datetime,
+                       fault_rows: list[tuple], occupancy_rows: list[tuple]):
+        """
+        Swap the results of one room and time window in a single transaction.
+        fault_rows: (device_id, datetime, source, datapoint, health_status, detail)
+        occupancy_rows: (device_id, datetime, is_occupied). Raises on failure.
+        """
+        try:
+            for table in ("fault_events", "occupancy_events"):
+                self.cursor.execute(
+                    f"DELETE FROM {table} WHERE device_id = %s AND datetime >= %s AND datetime < %s",
+                    (room_id, start, end)
+                )
+            if fault_rows:
+                execute_values(self.cursor, """
+                    INSERT INTO fault_events (device_id, datetime, source, datapoint, health_status, detail)
+                    VALUES %s ON CONFLICT DO NOTHING
+                """, fault_rows, page_size=1000)
+            if occupancy_rows:
+                execute_values(self.cursor, """
+                    INSERT INTO occupancy_events (device_id, datetime, is_occupied)
+                    VALUES %s ON CONFLICT DO NOTHING
+                """, occupancy_rows, page_size=1000)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
 
     def close(self):
-        logger.info("🛑 SupabaseWriter does not need explicit close (HTTP connection).")
+        if self.cursor:
+            self.cursor.close()
+        if self.conn:
+            self.conn.close()
+            logger.info("🛑 TimescaleDB connection closed")
+
+
+def room_sensors_row(room_id: str, data: dict) -> dict:
+    """room_sensors row for a combined message."""
+    return {
+        "room_id": room_id,
+        "timestamp": data["timestamp"],
+        "datetime": data.get("datetime") or clock.isoformat(data["timestamp"]),
+        "temperature": data.get("temperature", 0),
+        "humidity": data.get("humidity", 0),
+        "co2": data.get("co2", 0),
+        "presence_state": data.get("presence_state", "unknown"),
+        "power_data": data.get("power_kw_power_meter", 0)
+    }
+
+
+class RowsRejected(Exception):
+    """The database answered and refused the rows; retrying them unchanged would not help."""
+
+
+class PostgrestRoomSensorsBackend:
+    """
+    room_sensors upserts as one JSON array per request to PostgREST, over a
+    pooled keep-alive HTTP client instead of a request per row.
+    """
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            pool = ROOM_SENSORS_CONFIG["pool_size"]
+            self._client = httpx.AsyncClient(
+                base_url=f"{SUPABASE_HTTP_CONFIG['url']}/rest/v1",
+                headers={"apikey": SUPABASE_HTTP_CONFIG["key"],
+                         "Authorization": f"Bearer {SUPABASE_HTTP_CONFIG['key']}"},
+                limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+                timeout=ROOM_SENSORS_CONFIG["timeout"],
+            )
+        return self._client
+
+    async def upsert(self, rows: list[dict]):
+        resp = await self.client.post(
+            "/room_sensors", json=rows,
+            params={"on_conflict": "room_id,timestamp"},
+            headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+        )
+        if 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+            raise RowsRejected(f"HTTP {resp.status_code}: {resp.text}")
+        resp.raise_for_status()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class PostgresRoomSensorsBackend:
+    """
+    room_sensors upserts as multi-row INSERT ... ON CONFLICT straight to the
+    Supabase Postgres (SUPABASE_CONFIG), from a small connection pool. The
+    blocking driver runs in a worker thread so the event loop keeps consuming.
+    """
+
+    UPSERT = """
+        INSERT INTO room_sensors (room_id, timestamp, datetime, temperature, humidity, co2, presence_state, power_data)
+        VALUES %s
+        ON CONFLICT (room_id, timestamp) DO UPDATE SET
+            datetime = EXCLUDED.datetime,
+            temperature = EXCLUDED.temperature,
+            humidity = EXCLUDED.humidity,
+            co2 = EXCLUDED.co2,
+            presence_state = EXCLUDED.presence_state,
+            power_data = EXCLUDED.power_data
+    """
+    COLUMNS = ("room_id", "timestamp", "datetime", "temperature", "humidity", "co2", "presence_state", "power_data")
+
+    def __init__(self):
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = psycopg2_pool.ThreadedConnectionPool(
+                1, ROOM_SENSORS_CONFIG["pool_size"],
+                host=SUPABASE_CONFIG["host"],
+                port=SUPABASE_CONFIG["port"],
+                user=SUPABASE_CONFIG["user"],
+                password=SUPABASE_CONFIG["password"],
+                dbname=SUPABASE_CONFIG["dbname"]
+            )
+            logger.info("✅ Connected to Supabase Postgres (room_sensors pool)")
+        return self._pool
+
+    def _upsert(self, rows: list[dict]):
+        pool = self.pool
+        conn = pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                execute_values(cursor, self.UPSERT, [tuple(row[c] for c in self.COLUMNS) for row in rows])
+            conn.commit()
+        except psycopg2.DataError as e:
+            conn.rollback()
+            raise RowsRejected(str(e)) from e
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            raise RowsRejected(str(e)) from e
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    async def upsert(self, rows: list[dict]):
+        await asyncio.to_thread(self._upsert, rows)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+
+ROOM_SENSORS_BACKENDS = {
+    "http": PostgrestRoomSensorsBackend,
+    "postgres": PostgresRoomSensorsBackend,
+}
+
+
+class RoomSensorsWriter:
+    """
+    Batched room_sensors snapshots. Rows collect in memory (the latest row
+    per room_id/timestamp wins) and go out as one upsert when max_batch is
+    reached or every flush_interval, instead of one round trip per message.
+    Batches the database cannot take right now are spooled to disk; rows it
+    rejects are retried one by one so a bad row does not drop its batch.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or ROOM_SENSORS_BACKENDS[ROOM_SENSORS_CONFIG["backend"]]()
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.next_retry = 0.0
+        # The only writer of room_sensors rows; also drains what the old SupabaseWriter spooled there
+        self.spool = SegmentedSpool(
+            os.path.join(SPOOL_CONFIG["directory"], "supabase_room_sensors"),
+            segment_bytes=SPOOL_CONFIG["segment_bytes"],
+            max_bytes=SPOOL_CONFIG["max_bytes"],
+            fsync=SPOOL_CONFIG["fsync"]
+        )
+
+    def __len__(self):
+        return len(self.pending)
+
+    def backpressure(self) -> float:
+        """Worst fill ratio of the pending rows and the spool against their high-water marks (0.0 - 1.0)."""
+        return min(1.0, max(len(self.pending) / ROOM_SENSORS_CONFIG["high_water"],
+                            len(self.spool) / SPOOL_CONFIG["high_water"]))
+
+    async def upsert(self, room_id: str, data: dict):
+        row = room_sensors_row(room_id, data)
+        self.pending[(row["room_id"], row["timestamp"])] = row
+        if len(self.pending) >= ROOM_SENSORS_CONFIG["max_batch"]:
+            await self.flush()
+
+    async def _write(self, rows: list[dict]) -> int:
+        """Upsert rows; returns how many were rejected and dropped. Other failures propagate."""
+        try:
+            await self.backend.upsert(rows)
+            return 0
+        except RowsRejected as e:
+            if len(rows) == 1:
+                logger.error(f"❌ Dropping room_sensors row {rows[0]}: {e}")
+                return 1
+            logger.error(f"❌ room_sensors batch of {len(rows)} rejected ({e}), retrying row by row")
+        rejected = 0
+        for row in rows:
+            rejected += await self._write([row])
+        return rejected
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            rows, self.pending = list(self.pending.values()), {}
+            if len(self.spool) or time.monotonic() < self.next_retry:
+                # Keep arrival order: once rows are spooled, new ones queue up behind them
+                self._spool(rows)
+                return
+            try:
+                rejected = await self._write(rows)
+                logger.info(f"🟢 Upserted {len(rows) - rejected} room_sensors row(s)")
+            except Exception as e:
+                self._spool(rows)
+                self.next_retry = time.monotonic() + SPOOL_CONFIG["retry_interval"]
+                logger.warning(f"⚠️ room_sensors unreachable ({e}), spooling rows | spool={self.spool.stats()}")
+
+    def _spool(self, rows: list[dict]):
+        for row in rows:
+            self.spool.append(row)
+
+    async def drain_spool(self):
+        """Upsert spooled room_sensors rows in large batches once the database answers again."""
+        async with self.lock:
+            if not len(self.spool) or time.monotonic() < self.next_retry:
+                return
+
+            drained = 0
+            while len(self.spool):
+                records, token = self.spool.read_batch(SPOOL_CONFIG["drain_batch"])
+                # A bulk upsert may not touch the same key twice; keep the latest row per key
+                batch = list({(r["room_id"], r["timestamp"]): r for r in records}.values())
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    self.next_retry = time.monotonic() + SPOOL_CONFIG["retry_interval"]
+                    logger.warning(f"⚠️ room_sensors still unreachable ({e}) | spool={self.spool.stats()}")
+                    return
+                self.spool.commit(token)
+                drained += len(records)
+
+            logger.info(f"✅ Drained {drained} spooled row(s) into room_sensors")
+
+    async def close(self):
+        await self.flush()
+        await self.drain_spool()
+        await self.backend.close()
+        self.spool.close()
 
 
 # class SupabaseWriter:
@@ -261,16 +810,9 @@ if __name__ == "__main__":
     writer.insert_sensor_data(sample)
     writer.close()
 
-    from time import time
-
-    supabase = SupabaseWriter()
-
-    now = int(time())
-    iso = datetime.now().isoformat()
-
+    room_sensors = RoomSensorsWriter()
     sensor_data = {
-        "timestamp": now,
-        "datetime": iso,
+        "timestamp": clock.now_s(),
         "temperature": 25.1,
         "humidity": 51.7,
         "co2": 700,
@@ -278,20 +820,8 @@ if __name__ == "__main__":
         "power_kw_power_meter": 4.2
     }
 
-    supabase.upsert_sensor_data("room101", sensor_data)
-    supabase.upsert_room_state("room101", is_occupied=True, datapoint="co2", health_status="healthy")
-
-    # supabase = SupabaseWriter()
-
-    # test_sensor_data = {
-    #     "timestamp": int(datetime.now().timestamp()),
-    #     "datetime": datetime.now().isoformat(),
-    #     "temperature": 24.5,
-    #     "humidity": 53.2,
-    #     "co2": 635,
-    #     "presence_state": "occupied",
-    #     "power_kw_power_meter": 5.2
-    # }
-    # supabase.upsert_sensor_data("room101", test_sensor_data)
-    # supabase.upsert_room_state("room101", is_occupied=True, datapoint="co2", health_status="healthy")
-    # supabase.close()
\ No newline at end of file
+    async def upsert_sample():
+        await room_sensors.upsert("room101", sensor_data)
+        await room_sensors.close()  # flushes the pending row
+
+    asyncio.run(upsert_sample())
@@ -0,0 +1,94 @@
+# dead_letter_replay.py
+
+import argparse
+import asyncio
+import logging
+from config import QUEUES, DEAD_LETTER_QUEUES
+from rabbitmq_management import AsyncRabbitMQManager
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("DeadLetterReplay")
+
+# A message that fails this many replays stays parked in the dead-letter queue
+MAX_REPLAYS = 3
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+# Message properties carried over on replay (priority keeps fault alerts on the fast path)
+REPLAYED_PROPERTIES = ("content_type", "content_encoding", "delivery_mode", "priority", "correlation_id",
+                       "reply_to", "expiration", "message_id", "timestamp", "type", "app_id")
+
+
+def original_properties(message) -> dict:
+    return {name: getattr(message, name) for name in REPLAYED_PROPERTIES if getattr(message, name, None) is not None}
+
+
+def original_route(message) -> tuple[str, str, str] | None:
+    """Return (queue, routing_key, reason) from the most recent x-death entry."""
+    deaths = (message.headers or {}).get("x-death")
+    if not deaths:
+        return None
+    death = deaths[0]
+    routing_keys = death.get("routing-keys") or [message.routing_key]
+    return _text(death.get("queue", "")), _text(routing_keys[0]), _text(death.get("reason", ""))
+
+
+async def replay(limit: int, reasons: set[str], dry_run: bool, dead_letter_queue: str = QUEUES["dead_letter"]):
+    async with AsyncRabbitMQManager("DeadLetterReplay") as rabbitmq:
+        for exchange_name, (queue_name, _) in DEAD_LETTER_QUEUES.items():
+            if queue_name == dead_letter_queue:
+                await rabbitmq.ensure_dead_letter(exchange_name)
+        queue = await rabbitmq.consumer_channel.declare_queue(dead_letter_queue, passive=True)
+        pending = queue.declaration_result.message_count
+        total = min(pending, limit) if limit else pending
+        logger.info(f"[Replay] {pending} dead-lettered message(s), inspecting {total}")
+
+        replayed = 0
+        held = []  # skipped messages stay unacked until the end, or basic.get would return them again
+        for _ in range(total):
+            message = await queue.get(no_ack=False, fail=False)
+            if message is None:
+                break
+
+            route = original_route(message)
+            headers = dict(message.headers or {})
+            replays = int(headers.get("x-replay-count", 0))
+
+            if route is None or route[2] not in reasons or replays >= MAX_REPLAYS or dry_run:
+                if route is not None:
+                    logger.info(f"[Replay] {'Would replay' if dry_run else 'Skipping'} {route[0]}.{route[1]} "
+                                f"(reason={route[2]}, replays={replays})")
+                held.append(message)
+                continue
+
+            # Straight back into the queue that rejected it, not to every queue bound to the exchange
+            queue_name = route[0]
+            headers.pop("x-death", None)
+            headers["x-replay-count"] = replays + 1
+            # retry=False: on failure the message is nacked back to the dead-letter queue, not also buffered
+            if await rabbitmq.publish_body("", queue_name, message.body, retry=False,
+                                           headers=headers, **original_properties(message)):
+                await message.ack()
+                replayed += 1
+            else:
+                held.append(message)
+
+        for message in held:
+            await message.nack(requeue=True)
+        logger.info(f"[Replay] ✅ Replayed {replayed}, left {len(held)} in {dead_letter_queue}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dead-lettered messages into the queue that rejected them.")
+    parser.add_argument("--limit", type=int, default=0, help="max messages to inspect (0 = whole queue)")
+    parser.add_argument("--reason", action="append", default=None,
+                        help="x-death reason to replay (default: rejected); repeatable")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be replayed")
+    parser.add_argument("--queue", default=QUEUES["dead_letter"],
+                        help=f"dead-letter queue to replay from (e.g. {QUEUES['telemetry_dead_letter']})")
+    args = parser.parse_args()
+
+    asyncio.run(replay(args.limit, set(args.reason or ["rejected"]), args.dry_run, args.queue))
@@ -4,11 +4,99 @@ CREATE TABLE raw_data (
     datetime TIMESTAMPTZ DEFAULT NOW(),
     device_id TEXT NOT NULL,
     datapoint TEXT NOT NULL,
-    value TEXT NOT NULL
+    value TEXT NOT NULL,
+    tenant_id TEXT NOT NULL DEFAULT 'default',  -- property the reading belongs to (see tenancy.py)
+    message_id TEXT NOT NULL DEFAULT ''          -- producer message ID of the reading ('' when unknown)
 );
 
 -- Convert to hypertable with time partitioning on datetime
 SELECT create_hypertable('raw_data', 'datetime');
 
+-- Space partitioning by tenant, so one property's chunks never mix with another's
+SELECT add_dimension('raw_data', 'tenant_id', number_partitions => 4);
+
 -- Add indexes for efficient room-based queries
-CREATE INDEX idx_raw_data_room_id ON raw_data(device_id);
\ No newline at end of file
+CREATE INDEX idx_raw_data_room_id ON raw_data(device_id);
+
+-- Key of a reading, so redelivered messages are ignored (ON CONFLICT DO NOTHING) while
+-- distinct readings within the same second are kept
+CREATE UNIQUE INDEX raw_data_tenant_message_key ON raw_data(tenant_id, device_id, datapoint, datetime, message_id);
+
+-- Numeric readings pre-aggregated per minute and per hour for the query service
+CREATE MATERIALIZED VIEW raw_data_1m
+WITH (timescaledb.continuous) AS
+SELECT time_bucket('1 minute', datetime) AS bucket,
+       device_id,
+       datapoint,
+       avg(NULLIF(value, 'null')::DOUBLE PRECISION) AS avg_value,
+       min(NULLIF(value, 'null')::DOUBLE PRECISION) AS min_value,
+       max(NULLIF(value, 'null')::DOUBLE PRECISION) AS max_value,
+       count(*) AS samples
+FROM raw_data
+WHERE datapoint IN ('temperature', 'humidity', 'co2', 'power_kw_power_meter', 'sensitivity')
+GROUP BY bucket, device_id, datapoint
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW raw_data_1h
+WITH (timescaledb.continuous) AS
+SELECT time_bucket('1 hour', datetime) AS bucket,
+       device_id,
+       datapoint,
+       avg(NULLIF(value, 'null')::DOUBLE PRECISION) AS avg_value,
+       min(NULLIF(value, 'null')::DOUBLE PRECISION) AS min_value,
+       max(NULLIF(value, 'null')::DOUBLE PRECISION) AS max_value,
+       count(*) AS samples
+FROM raw_data
+WHERE datapoint IN ('temperature', 'humidity', 'co2', 'power_kw_power_meter', 'sensitivity')
+GROUP BY bucket, device_id, datapoint
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('raw_data_1m',
+    start_offset => INTERVAL '1 hour', end_offset => INTERVAL '1 minute', schedule_interval => INTERVAL '1 minute');
+SELECT add_continuous_aggregate_policy('raw_data_1h',
+    start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '30 minutes');
+
+-- kWh per room and floor, hourly and daily (written by energy_analytics_agent.py)
+CREATE TABLE energy_rollups (
+    scope TEXT NOT NULL,          -- 'room' or 'floor'
+    scope_id TEXT NOT NULL,
+    granularity TEXT NOT NULL,    -- 'hour' or 'day'
+    bucket TIMESTAMPTZ NOT NULL,
+    kwh DOUBLE PRECISION NOT NULL,
+    vacant_kwh DOUBLE PRECISION NOT NULL,  -- energy used while the room was vacant
+    PRIMARY KEY (scope, scope_id, granularity, bucket)
+);
+
+-- Rollup batches already added onto energy_rollups, so a batch retried after a lost
+-- commit response is not counted twice (kept for a day)
+CREATE TABLE energy_rollup_batches (
+    batch_id TEXT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Offline detection results written by backfill.py
+CREATE TABLE fault_events (
+    device_id TEXT NOT NULL,
+    datetime TIMESTAMPTZ NOT NULL,
+    source TEXT NOT NULL,         -- 'threshold'
+    datapoint TEXT NOT NULL,
+    health_status TEXT NOT NULL,  -- raised severity, or 'healthy' when the incident cleared
+    detail TEXT,
+    PRIMARY KEY (device_id, datapoint, source, datetime)
+);
+
+CREATE TABLE occupancy_events (
+    device_id TEXT NOT NULL,
+    datetime TIMESTAMPTZ NOT NULL,
+    is_occupied BOOLEAN,          -- occupancy decision from this reading on
+    PRIMARY KEY (device_id, datetime)
+);
+
+-- Room hierarchy for room_registry.py (ROOM_REGISTRY_CONFIG["source"] = "table")
+CREATE TABLE rooms (
+    room_id TEXT PRIMARY KEY,
+    floor_id TEXT NOT NULL,       -- floor within the building; grouped as property:building:floor
+    building_id TEXT NOT NULL,
+    property_id TEXT NOT NULL,
+    metadata JSONB
+);
@@ -0,0 +1,239 @@
+from startup import mark_ready  # first import, starts the startup clock
+import asyncio
+import aio_pika
+import json
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from config import EXCHANGES, ENERGY_CONFIG, ENVELOPE_CONFIG
+from room_registry import get_registry
+from rabbitmq_management import AsyncRabbitMQManager
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from database_writer import EnergyRollupWriter
+from message_dedup import MessageDeduplicator
+from tracing import setup_tracing
+from envelopes import EnvelopeConsumer, envelopes_enabled
+from time_service import clock
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("EnergyAgent")
+
+HOUR = 3600
+DAY = 86400
+
+
+class EnergyIntegrator:
+    """
+    Streaming kWh integration of instantaneous power readings per room.
+    Each pair of consecutive readings adds a trapezoid (kW x h) to the hourly
+    and daily bucket it falls in; segments crossing an hour boundary are split
+    at the boundary with the power linearly interpolated. Energy used while
+    the room is known to be vacant is tracked separately. Gaps longer than
+    max_gap_seconds are not integrated.
+    """
+
+    def __init__(self, utc_offset_seconds: int = 0, max_gap_seconds: int = 900):
+        self.utc_offset = utc_offset_seconds  # local-day boundaries for daily buckets
+        self.max_gap = max_gap_seconds
+        self.last_reading = {}  # { room_id: (timestamp, kw) }
+        self.occupied = {}      # { room_id: bool }
+        self.pending = defaultdict(lambda: [0.0, 0.0])  # { (room_id, granularity, bucket): [kwh, vacant_kwh] }
+        self.totals = {}        # { (room_id, granularity): (bucket, kwh, vacant_kwh) } rolling current buckets
+
+    def bucket_start(self, timestamp: float, granularity: str) -> int:
+        if granularity == "hour":
+            return int(timestamp // HOUR * HOUR)
+        return int((timestamp + self.utc_offset) // DAY * DAY - self.utc_offset)
+
+    def set_occupancy(self, room_id: str, is_occupied: bool):
+        self.occupied[room_id] = is_occupied
+
+    def add_power(self, room_id: str, timestamp: float, kw: float) -> float:
+        """Integrate up to this reading; returns the kWh added."""
+        previous = self.last_reading.get(room_id)
+        if previous is not None and timestamp <= previous[0]:
+            return 0.0  # late or duplicate reading
+        self.last_reading[room_id] = (timestamp, kw)
+        if previous is None:
+            return 0.0
+
+        t_prev, kw_prev = previous
+        if timestamp - t_prev > self.max_gap:
+            logger.warning(f"[EnergyAgent] Gap of {timestamp - t_prev:.0f}s for {room_id}, not integrated")
+            return 0.0
+
+        vacant = self.occupied.get(room_id) is False
+        slope = (kw - kw_prev) / (timestamp - t_prev)
+        t0, p0, added = t_prev, kw_prev, 0.0
+        while t0 < timestamp:
+            t1 = min(timestamp, (t0 // HOUR + 1) * HOUR)
+            p1 = kw_prev + slope * (t1 - t_prev)
+            kwh = (p0 + p1) / 2 * (t1 - t0) / HOUR
+            self._accumulate(room_id, t0, kwh, vacant)
+            added += kwh
+            t0, p0 = t1, p1
+        return added
+
+    def _accumulate(self, room_id: str, timestamp: float, kwh: float, vacant: bool):
+        vacant_kwh = kwh if vacant else 0.0
+        for granularity in ("hour", "day"):
+            bucket = self.bucket_start(timestamp, granularity)
+            delta = self.pending[(room_id, granularity, bucket)]
+            delta[0] += kwh
+            delta[1] += vacant_kwh
+
+            current = self.totals.get((room_id, granularity))
+            if current is None or current[0] != bucket:
+                current = (bucket, 0.0, 0.0)
+            self.totals[(room_id, granularity)] = (bucket, current[1] + kwh, current[2] + vacant_kwh)
+
+    def take_rollups(self) -> list[tuple]:
+        """
+        Hand out the pending energy deltas as rollup rows for rooms and floors:
+        (scope, scope_id, granularity, bucket, kwh, vacant_kwh), floors under
+        their qualified ID ("hotel:main:1"). Deltas are added onto the stored
+        totals, so restarts and partial buckets are safe; a batch that failed
+        is retried as is, under the same batch ID.
+        """
+        floors = defaultdict(lambda: [0.0, 0.0])
+        rows = []
+        for (room_id, granularity, bucket), (kwh, vacant_kwh) in self.pending.items():
+            rows.append(("room", room_id, granularity, bucket, kwh, vacant_kwh))
+            floor = floors[(get_registry().floor_of(room_id), granularity, bucket)]
+            floor[0] += kwh
+            floor[1] += vacant_kwh
+        for (floor_id, granularity, bucket), (kwh, vacant_kwh) in floors.items():
+            rows.append(("floor", floor_id, granularity, bucket, kwh, vacant_kwh))
+        self.pending.clear()
+        return [(scope, scope_id, granularity, datetime.fromtimestamp(bucket, timezone.utc), round(kwh, 6), round(vacant_kwh, 6))
+                for scope, scope_id, granularity, bucket, kwh, vacant_kwh in rows]
+
+
+class EnergyAnalyticsAgent:
+    def __init__(self):
+        self.integrator = EnergyIntegrator(
+            utc_offset_seconds=clock.utc_offset_seconds(),
+            max_gap_seconds=ENERGY_CONFIG["max_gap_seconds"]
+        )
+        self.dedup = MessageDeduplicator()
+        self.writer = EnergyRollupWriter()
+        self.unconfirmed = None  # (batch_id, rows) of a flush whose outcome is unknown
+
+    async def handle_power(self, message: aio_pika.IncomingMessage):
+        try:
+            async with message.process(ignore_processed=True):
+                parsed = json.loads(message.body.decode())
+                room_id = parsed.get("room_id")
+                message_id = message.message_id or parsed.get("message_id")
+                if self.dedup.is_duplicate(room_id, message_id):
+                    return
+
+                kw = parsed.get("data", {}).get("power_consumption_kw")
+                if kw is None:
+                    return
+                timestamp = parsed.get("timestamp") or clock.now_s()
+                self.integrator.add_power(room_id, float(timestamp), float(kw))
+                self.dedup.remember(room_id, message_id)
+        except Exception as e:
+            logger.error(f"[EnergyAgent] ❌ Error processing power reading: {e}")
+
+    async def process_batch(self, readings: list[dict]):
+        """Power readings of an envelope, in order; other sensor types are skipped."""
+        for reading in readings:
+            kw = reading.get("data", {}).get("power_consumption_kw") if reading.get("sensor_type") == "power" else None
+            if kw is None:
+                continue
+            try:
+                self.integrator.add_power(reading["room_id"], float(reading.get("timestamp") or clock.now_s()), float(kw))
+            except Exception as e:
+                logger.error(f"[EnergyAgent] ❌ Skipping power reading {reading.get('message_id')} in envelope: {e}")
+
+    async def handle_occupancy(self, message: aio_pika.IncomingMessage):
+        try:
+            async with message.process(ignore_processed=True):
+                parsed = json.loads(message.body.decode())
+                self.integrator.set_occupancy(parsed["room_id"], bool(parsed.get("is_occupied")))
+        except Exception as e:
+            logger.error(f"[EnergyAgent] ❌ Error processing occupancy update: {e}")
+
+    async def flush(self):
+        """
+        Write the pending rollups. A failed batch may still have been committed (the
+        response can be lost), so it is kept and retried under the same batch ID,
+        ahead of any newer deltas, instead of being merged back into them.
+        """
+        while True:
+            retry = self.unconfirmed is not None
+            if not retry:
+                rows = self.integrator.take_rollups()
+                if not rows:
+                    return
+                self.unconfirmed = (uuid.uuid4().hex, rows)
+            batch_id, rows = self.unconfirmed
+            try:
+                await asyncio.to_thread(self.writer.upsert_rollups, rows, batch_id)
+            except Exception as e:
+                logger.error(f"[EnergyAgent] ❌ Failed to write energy rollups, retrying batch {batch_id} on the next flush: {e}")
+                return
+            self.unconfirmed = None
+            if not retry:
+                break
+
+        for (room_id, granularity), (bucket, kwh, vacant_kwh) in self.integrator.totals.items():
+            if granularity == "day":
+                logger.info(f"[EnergyAgent] ⚡ {room_id}: {kwh:.3f} kWh today, {vacant_kwh:.3f} kWh while vacant")
+
+    async def run_flusher(self):
+        try:
+            while True:
+                await asyncio.sleep(ENERGY_CONFIG["flush_interval"])
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+async def run_tenant(tenant: str):
+    name = tenant_name("EnergyAgent", tenant)
+    logger.info(f"[{name}] Connecting to RabbitMQ...")
+
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=tenant_quota(tenant).prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
+
+        agent = EnergyAnalyticsAgent()
+
+        for room_id in tenant_rooms(tenant):
+            await rabbitmq.subscribe(
+                EXCHANGES["sensor_data"], f"{room_id}_power_energy_queue", f"{room_id}.power",
+                agent.handle_power, lane="telemetry"
+            )
+            await rabbitmq.subscribe(
+                EXCHANGES["occupancy"], f"{room_id}_occupancy_energy_queue", f"{room_id}.occupancy",
+                agent.handle_occupancy, lane="telemetry"
+            )
+        if envelopes_enabled():
+            envelopes = EnvelopeConsumer(name, agent.process_batch, agent.dedup)
+            await rabbitmq.subscribe(
+                EXCHANGES["sensor_data"], "envelope_energy_queue", ENVELOPE_CONFIG["routing_key"],
+                envelopes.handle_message, lane="telemetry"
+            )
+
+        logger.info(f"[{name}] 🟢 Integrating power readings...")
+        mark_ready(name)
+        try:
+            await agent.run_flusher()
+        finally:
+            agent.writer.close()
+
+
+async def main():
+    setup_tracing("EnergyAgent")
+    get_registry().start_watching()  # floor moves apply to the next rollup flush
+    await run_for_tenants("EnergyAgent", run_tenant)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("[EnergyAgent] 🔴 Stopped by user.")
@@ -0,0 +1,65 @@
+# envelopes.py
+
+import asyncio
+import json
+import logging
+import aio_pika
+from config import ENVELOPE_CONFIG
+from message_dedup import MessageDeduplicator
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def envelopes_enabled() -> bool:
+    return ENVELOPE_CONFIG["enabled"]
+
+
+def pack(readings: list[dict]) -> bytes:
+    """
+    One AMQP body for many readings, in the order they were taken. Each
+    reading keeps its room_id, sensor_type and producer message_id, so
+    consumers can dedup and route it as if it had arrived on its own.
+    """
+    return json.dumps({"readings": readings}, separators=(",", ":")).encode()
+
+
+def unpack(body: bytes) -> list[dict]:
+    return json.loads(body)["readings"]
+
+
+class EnvelopeConsumer:
+    """
+    Consumer callback for envelope messages. The readings are deduplicated
+    and handed to process_batch in one call, and the envelope is acked once
+    when it returns. process_batch logs and skips a reading that fails on its
+    own, so one bad reading does not send the rest back round; it raises only
+    for what fails the whole envelope (dead-lettered as a whole). Envelopes
+    are processed one at a time in delivery order, which keeps every room's
+    readings in order across envelopes.
+    """
+
+    def __init__(self, name: str, process_batch, dedup: MessageDeduplicator = None):
+        self.name = name
+        self.process_batch = process_batch
+        self.dedup = dedup or MessageDeduplicator()
+        self.lock = asyncio.Lock()  # waiters are woken first come, first served
+
+    async def handle_message(self, message: aio_pika.IncomingMessage):
+        async with self.lock:
+            try:
+                async with message.process(ignore_processed=True):
+                    with tracer.span("decode", envelope=True):
+                        readings = unpack(message.body)
+                    fresh = [reading for reading in readings
+                             if not self.dedup.is_duplicate(reading.get("room_id"), reading.get("message_id"))]
+                    if len(fresh) < len(readings):
+                        logger.info(f"[{self.name}] ⏭️ Skipping {len(readings) - len(fresh)} redelivered reading(s) in envelope")
+                    if fresh:
+                        await self.process_batch(fresh)
+                    for reading in fresh:
+                        self.dedup.remember(reading.get("room_id"), reading.get("message_id"))
+
+            except Exception as e:
+                # Rejected without requeue, so the broker dead-letters the envelope
+                logger.error(f"[{self.name}] ❌ Error processing envelope: {e}")
@@ -1,10 +1,22 @@
+from startup import mark_ready  # first import, starts the startup clock
 import asyncio
 import aio_pika
 import json
 import logging
-from config import ROOM_IDS, EXCHANGES, RABBITMQ_CONFIG
-from sensors_subscriber import SensorSubscriber
-from database_writer import TimescaleDBWriter, SupabaseWriter
+import time
+import numpy as np
+from config import (EXCHANGES, FAULT_PRIORITIES, LIVENESS_CONFIG, SENSOR_DATAPOINTS, ALERT_CONFIG, TENANCY_CONFIG,
+                    ROOM_SENSORS_CONFIG, ENVELOPE_CONFIG)
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from anomaly_detection import StreamingAnomalyDetector, worst_severity
+from liveness_watchdog import LivenessWatchdog
+from alert_manager import AlertManager, SEVERITIES
+from database_writer import TimescaleDBWriter, RoomSensorsWriter
+from rabbitmq_management import AsyncRabbitMQManager
+from flow_control import AdaptiveConcurrencyLimiter
+from message_dedup import MessageDeduplicator
+from tracing import setup_tracing, tracer
+from envelopes import EnvelopeConsumer, envelopes_enabled
 
 # -----------------------------
 # GLOBAL THRESHOLDS
@@ -30,42 +42,132 @@ logger = logging.getLogger("FaultAgent")
 # -----------------------------
 active_tasks = set()
 
-class FaultDetectionAgent:
-    def __init__(self, fault_exchange: aio_pika.Exchange):
-        self.fault_exchange = fault_exchange
-        self.subscriber = SensorSubscriber()
-        self.db_writer = TimescaleDBWriter()
-        self.supabase_writer = SupabaseWriter()
 
-    def detect_faults(self, message: dict) -> tuple[list[str], list[str]]:
-        faults = []
-        datapoints = []
+def check_thresholds(message: dict) -> dict[str, list[str]]:
+    """Threshold violations grouped by datapoint (pure, also used by backfill.py)."""
+    violations = {}
 
-        for key, rule in THRESHOLDS.items():
-            if key not in message:
-                continue
+    for key, rule in THRESHOLDS.items():
+        if key not in message:
+            continue
 
-            value = message.get(key)
-            if value == "null" or value is None:
-                faults.append(f"{key} is missing or null.")
-                datapoints.append(key)
-                continue
+        value = message.get(key)
+        if value == "null" or value is None:
+            violations.setdefault(key, []).append(f"{key} is missing or null.")
+            continue
+
+        try:
+            if "min" in rule and float(value) < rule["min"]:
+                violations.setdefault(key, []).append(f"{key} below min: {value} < {rule['min']}")
+            if "max" in rule and float(value) > rule["max"]:
+                violations.setdefault(key, []).append(f"{key} above max: {value} > {rule['max']}")
+            if "allowed" in rule and value not in rule["allowed"]:
+                violations.setdefault(key, []).append(f"{key} value not allowed: {value}")
+        except Exception as e:
+            violations.setdefault(key, []).append(f"{key} invalid value: {value} ({e})")
+
+    return violations
+
+
+class FaultDetectionAgent:
+    def __init__(self, rabbitmq: AsyncRabbitMQManager, tenant: str = None):
+        self.rabbitmq = rabbitmq
+        self.dedup = MessageDeduplicator()
+        self.tenant = tenant or TENANCY_CONFIG["default_tenant"]
+        self._db_writer = None
+        self._room_sensors = None
+        self.anomaly_detector = StreamingAnomalyDetector()
+        self.watchdog = LivenessWatchdog(LIVENESS_CONFIG["timeouts"])
+        self.alerts = AlertManager(ALERT_CONFIG["raise_after"], ALERT_CONFIG["clear_after"])
+
+    # Writers (and their spools and clients) are created by the first reading, so the agent
+    # is consuming before any database is touched
+    @property
+    def db_writer(self) -> TimescaleDBWriter:
+        if self._db_writer is None:
+            self._db_writer = TimescaleDBWriter(self.tenant, tenant_quota(self.tenant).writes)
+        return self._db_writer
+
+    @property
+    def room_sensors(self) -> RoomSensorsWriter:
+        if self._room_sensors is None:
+            self._room_sensors = RoomSensorsWriter()
+        return self._room_sensors
+
+    def backpressure(self) -> float:
+        """Worst fill ratio of the publish retry buffer and the writers created so far (0.0 - 1.0)."""
+        writers = [writer for writer in (self._db_writer, self._room_sensors) if writer is not None]
+        return max([self.rabbitmq.backpressure(), *(writer.backpressure() for writer in writers)])
+
+    async def run_room_sensors(self):
+        """Flush batched room_sensors rows every flush_interval; the last batch is flushed on cancellation."""
+        try:
+            while True:
+                await asyncio.sleep(ROOM_SENSORS_CONFIG["flush_interval"])
+                if self._room_sensors is not None:
+                    await self._room_sensors.drain_spool()
+                    await self._room_sensors.flush()
+        finally:
+            if self._room_sensors is not None:
+                await self._room_sensors.close()
+                logger.info("[FaultAgent] ✅ room_sensors flushed and closed.")
+
+    def close(self):
+        if self._db_writer is not None:
+            self._db_writer.close()
+            logger.info("[FaultAgent] ✅ TimescaleDB connection closed.")
 
+    def detect_violations(self, message: dict) -> dict[str, list[str]]:
+        return check_thresholds(message)
+
+    def detect_faults(self, message: dict) -> tuple[list[str], list[str]]:
+        violations = self.detect_violations(message)
+        faults = [fault for messages in violations.values() for fault in messages]
+        return faults, list(violations)  # unique datapoints
+
+    def _anomaly_row(self, sensor_data: dict) -> list[float]:
+        readings = dict(sensor_data)
+        if "power_consumption_kw" in readings:
+            readings["power_kw_power_meter"] = readings["power_consumption_kw"]
+        row = []
+        for datapoint in self.anomaly_detector.datapoints:
             try:
-                if "min" in rule and float(value) < rule["min"]:
-                    faults.append(f"{key} below min: {value} < {rule['min']}")
-                    datapoints.append(key)
-                if "max" in rule and float(value) > rule["max"]:
-                    faults.append(f"{key} above max: {value} > {rule['max']}")
-                    datapoints.append(key)
-                if "allowed" in rule and value not in rule["allowed"]:
-                    faults.append(f"{key} value not allowed: {value}")
-                    datapoints.append(key)
-            except Exception as e:
-                faults.append(f"{key} invalid value: {value} ({e})")
-                datapoints.append(key)
+                row.append(float(readings[datapoint]))
+            except (KeyError, TypeError, ValueError):
+                row.append(np.nan)
+        return row
+
+    def detect_anomalies(self, room_id: str, sensor_type: str, sensor_data: dict, timestamp) -> list[dict]:
+        """
+        Feed a fresh IAQ/power reading to the statistical detector. Only the raw
+        reading is used: combined messages repeat the last IAQ/power values on
+        every presence update and would look like stuck sensors.
+        """
+        if sensor_type not in ("iaq", "power"):
+            return []
+        return self.anomaly_detector.observe_batch(
+            [room_id], np.array([self._anomaly_row(sensor_data)]), np.array([timestamp or time.time()])
+        )
 
-        return faults, list(set(datapoints))  # unique datapoints
+    def detect_anomalies_batch(self, records: list[dict]) -> dict[int, list[dict]]:
+        """The IAQ/power readings of an envelope in one vectorised pass: { record index: anomalies }."""
+        picked, rows, timestamps = [], [], []
+        for i, record in enumerate(records):
+            if record.get("sensor_type") not in ("iaq", "power"):
+                continue
+            try:
+                timestamp = float(record.get("timestamp") or time.time())
+            except (TypeError, ValueError):
+                timestamp = time.time()
+            picked.append(i)
+            rows.append(self._anomaly_row(record.get("data", {})))
+            timestamps.append(timestamp)
+        found = {i: [] for i in picked}
+        if picked:
+            for anomaly in self.anomaly_detector.observe_batch(
+                    [records[i].get("room_id") for i in picked], np.array(rows), np.array(timestamps)):
+                found[picked[anomaly["index"]]].append(anomaly)
+        return found
 
     async def handle_message(self, message: aio_pika.IncomingMessage):
         task = asyncio.current_task()
@@ -73,128 +175,268 @@ class FaultDetectionAgent:
 
         try:
             async with message.process(ignore_processed=True):
-                routing_key = message.routing_key
-                logger.info(f"[FaultAgent] Received from {routing_key}")
-                raw_body = message.body.decode()
-                parsed = json.loads(raw_body)
+                logger.info(f"[FaultAgent] Received from {message.routing_key}")
+                parsed = json.loads(message.body.decode())
 
                 room_id = parsed.get("room_id")
-                sensor_data = parsed.get("data", {})
-                sensor_type = routing_key.split(".")[-1]
-
-                # Mock method/props for SensorSubscriber
-                mock_method = type("Method", (), {"routing_key": routing_key})
-                mock_props = type("Props", (), {})()
-
-                output = self.subscriber.sensor_callback(
-                    ch=None,
-                    method=mock_method,
-                    properties=mock_props,
-                    body=json.dumps({
-                        "room_id": room_id,
-                        "data": sensor_data
-                    }).encode()
-                )
-
-                # This is to stop upserting when the output is None
-                if not output:
+                message_id = message.message_id or parsed.get("message_id")
+                if self.dedup.is_duplicate(room_id, message_id):
+                    logger.info(f"[FaultAgent] ⏭️ Skipping redelivered message {message_id} for {room_id}")
                     return
 
-                try:
-                    self.supabase_writer.upsert_sensor_data(output["device_id"], output)
-                except Exception as e:
-                    logger.error(f"[FaultAgent] ❌ Failed to upsert Supabase room_sensors: {e}")
-
-
-                if not output:
-                    return
-
-                # Insert each sensor datapoint into TimescaleDB
-                for key, value in output.items():
-                    if key in ["temperature", "humidity", "co2", "power_kw_power_meter", "presence_state", "sensitivity", "online_status"]:
-                        try:
-                            self.db_writer.insert_sensor_data({
-                                "timestamp": output["timestamp"],
-                                "datetime": output["datetime"],
-                                "device_id": output["device_id"],
-                                "datapoint": key,
-                                "value": str(value)
-                            })
-                            logger.info(f"[FaultAgent] 📥 Inserted: device={output['device_id']} | {key}={value}")
-                        except Exception as e:
-                            logger.error(f"[FaultAgent] ❌ Failed to insert {key} for {output['device_id']}: {e}")
-
-                # Detect faults and publish alert if needed
-                faults, datapoints = self.detect_faults(output)
-                if faults:
-                    payload = {
-                        "room_id": room_id,
-                        "timestamp": output["timestamp"],
-                        "faults": faults,
-                        "datapoint": ", ".join(datapoints)
-                    }
-                    await self.fault_exchange.publish(
-                        aio_pika.Message(body=json.dumps(payload).encode()),
-                        routing_key=f"{room_id}.fault"
-                    )
-                    logger.warning(f"[FaultAgent] 🚨 Fault alert sent: {payload}")
-                else:
-                    logger.info(f"[FaultAgent] ✅ No faults detected for {room_id}")
+                await self.process_reading(message.routing_key, parsed, message_id)
+                self.dedup.remember(room_id, message_id)
 
         except Exception as e:
             logger.error(f"[FaultAgent] ❌ Error processing message: {e}")
         finally:
             active_tasks.discard(task)
 
-async def main():
-    logger.info("[FaultAgent] Connecting to RabbitMQ...")
-
-    connection = await aio_pika.connect_robust(
-        host=RABBITMQ_CONFIG["host"],
-        port=RABBITMQ_CONFIG["port"],
-        login=RABBITMQ_CONFIG["user"],
-        password=RABBITMQ_CONFIG["password"],
-        virtualhost=RABBITMQ_CONFIG["vhost"]
-    )
-
-    async with connection:
-        channel = await connection.channel()
-        logger.info("[FaultAgent] ✅ Connected to RabbitMQ.")
-
-        sensor_exchange = await channel.declare_exchange(
-            EXCHANGES["sensor_data"], aio_pika.ExchangeType.TOPIC, durable=True
+    async def process_reading(self, routing_key: str, parsed: dict, message_id: str = None):
+        """One record from the combined exchange, already joined by sensors_subscriber.py."""
+        sensor_type = parsed.get("sensor_type") or routing_key.rsplit(".", 1)[-1]
+        await self.process_record(parsed.get("room_id"), sensor_type, parsed.get("data", {}),
+                                  parsed.get("timestamp"), parsed.get("combined"), message_id=message_id)
+
+    async def process_batch(self, records: list[dict]):
+        """An envelope of combined records in order; raw_data rows for the whole envelope go in one insert."""
+        raw_rows = []
+        with tracer.span("detect", readings=len(records), kind="anomaly"):
+            anomalies = self.detect_anomalies_batch(records)
+        for i, record in enumerate(records):
+            try:
+                await self.process_record(record.get("room_id"), record.get("sensor_type"), record.get("data", {}),
+                                          record.get("timestamp"), record.get("combined"), raw_rows,
+                                          message_id=record.get("message_id"), anomalies=anomalies.get(i))
+            except Exception as e:
+                logger.error(f"[FaultAgent] ❌ Skipping record {record.get('message_id')} for {record.get('room_id')} in envelope: {e}")
+        if not raw_rows:
+            return
+        with tracer.span("db_write", rows=len(raw_rows)):
+            try:
+                self.db_writer.insert_many(raw_rows)
+                logger.info(f"[FaultAgent] 📥 Inserted {len(raw_rows)} datapoint(s) from {len(records)} record(s)")
+            except Exception as e:
+                logger.error(f"[FaultAgent] ❌ Failed to insert {len(raw_rows)} datapoint(s): {e}")
+
+    async def process_record(self, room_id: str, sensor_type: str, sensor_data: dict, timestamp, output: dict | None,
+                             raw_rows: list = None, message_id: str = None, anomalies: list[dict] = None):
+        """
+        Fault stage for one decoded reading and its joined record (None until a presence
+        reading arrives). raw_data rows are collected into raw_rows when given, not inserted;
+        they carry the reading's message_id, which raw_data deduplicates on. anomalies are
+        passed in when process_batch already ran the detector over the whole envelope.
+        """
+        if self.watchdog.seen(room_id, sensor_type):
+            await self.publish_liveness(room_id, sensor_type)
+
+        # Statistical anomalies (spikes, stuck values, flat lines, rate of change) on the raw
+        # IAQ / power reading; those never carry a joined record, so this runs before the check below
+        if sensor_type in ("iaq", "power"):
+            if anomalies is None:
+                with tracer.span("detect", room_id=room_id, kind="anomaly"):
+                    anomalies = self.detect_anomalies(room_id, sensor_type, sensor_data, timestamp)
+            by_datapoint = {}
+            for anomaly in anomalies:
+                by_datapoint.setdefault(anomaly["datapoint"], []).append(anomaly)
+            await self.publish_alerts(
+                room_id, timestamp, "anomaly",
+                {datapoint: (worst_severity(found), [anomaly["detail"] for anomaly in found])
+                 for datapoint, found in by_datapoint.items()},
+                checked=[dp for dp in SENSOR_DATAPOINTS.get(sensor_type, []) if dp in self.anomaly_detector.datapoints]
+            )
+
+        # room_sensors, raw_data and thresholds need the joined record (presence readings only)
+        if not output:
+            return
+
+        with tracer.span("db_write", room_id=room_id):
+            try:
+                await self.room_sensors.upsert(output["device_id"], output)
+            except Exception as e:
+                logger.error(f"[FaultAgent] ❌ Failed to stage room_sensors row: {e}")
+
+            # Insert each sensor datapoint into TimescaleDB
+            for key, value in output.items():
+                if key in ["temperature", "humidity", "co2", "power_kw_power_meter", "presence_state", "sensitivity", "online_status"]:
+                    row = {
+                        "timestamp": output["timestamp"],
+                        "device_id": output["device_id"],
+                        "datapoint": key,
+                        "value": str(value),
+                        "message_id": message_id,
+                    }
+                    if raw_rows is not None:
+                        raw_rows.append(row)
+                        continue
+                    try:
+                        self.db_writer.insert_sensor_data(row)
+                        logger.info(f"[FaultAgent] 📥 Inserted: device={output['device_id']} | {key}={value}")
+                    except Exception as e:
+                        logger.error(f"[FaultAgent] ❌ Failed to insert {key} for {output['device_id']}: {e}")
+
+        # Threshold faults; the alert manager only lets new, escalated and cleared incidents through
+        with tracer.span("detect", room_id=room_id, kind="threshold"):
+            violations = self.detect_violations(output)
+        await self.publish_alerts(
+            room_id, output["timestamp"], "threshold",
+            {datapoint: ("critical", faults) for datapoint, faults in violations.items()},
+            checked=[key for key in THRESHOLDS if key in output]
         )
-        fault_exchange = await channel.declare_exchange(
-            EXCHANGES["fault_alerts"], aio_pika.ExchangeType.TOPIC, durable=True
+        if not violations:
+            logger.info(f"[FaultAgent] ✅ No faults detected for {room_id}")
+
+    # -----------------------------
+    # Alerts
+    # -----------------------------
+    async def publish_alerts(self, room_id: str, timestamp: int, source: str,
+                             violations: dict[str, tuple[str, list[str]]], checked):
+        raised, cleared = self.alerts.observe(room_id, source, violations, checked)
+
+        if raised:
+            payload = {
+                "room_id": room_id,
+                "timestamp": timestamp,
+                "faults": [fault for _, _, faults in raised for fault in faults],
+                "datapoint": ", ".join(datapoint for datapoint, _, _ in raised),
+                "health_status": max((severity for _, severity, _ in raised), key=SEVERITIES.index),
+                "source": source
+            }
+            await self.rabbitmq.publish(
+                EXCHANGES["fault_alerts"], f"{room_id}.fault", payload,
+                priority=FAULT_PRIORITIES[payload["health_status"]]
+            )
+            logger.warning(f"[FaultAgent] 🚨 Fault alert sent: {payload}")
+        elif violations:
+            logger.info(f"[FaultAgent] 🔕 Ongoing {source} incident for {room_id}: {', '.join(violations)}")
+
+        if cleared:
+            payload = {
+                "room_id": room_id,
+                "timestamp": timestamp,
+                "faults": [],
+                "datapoint": ", ".join(cleared),
+                "health_status": "healthy",
+                "source": source
+            }
+            await self.rabbitmq.publish(
+                EXCHANGES["fault_alerts"], f"{room_id}.fault", payload,
+                priority=FAULT_PRIORITIES["healthy"]
+            )
+            logger.info(f"[FaultAgent] ✅ {source} incident cleared for {room_id}: {payload['datapoint']}")
+
+    async def run_digests(self):
+        """Periodic summary of incidents that are still firing, instead of one alert per reading."""
+        while True:
+            await asyncio.sleep(ALERT_CONFIG["digest_interval"])
+            for payload in self.alerts.digest():
+                try:
+                    await self.rabbitmq.publish(
+                        EXCHANGES["fault_alerts"], f"{payload['room_id']}.fault", payload,
+                        priority=FAULT_PRIORITIES[payload["health_status"]]
+                    )
+                    logger.warning(f"[FaultAgent] 📋 Digest sent for {payload['room_id']}: {payload['suppressed']} repeat(s) suppressed")
+                except Exception as e:
+                    logger.error(f"[FaultAgent] ❌ Failed to publish digest for {payload['room_id']}: {e}")
+
+    # -----------------------------
+    # Missing data
+    # -----------------------------
+    async def publish_liveness(self, room_id: str, sensor_type: str, silent_seconds: float = None):
+        """Missing-data fault when silent_seconds is given, otherwise the recovery."""
+        missing = silent_seconds is not None
+        payload = {
+            "room_id": room_id,
+            "timestamp": int(time.time()),
+            "faults": [f"{sensor_type} sensor silent for {silent_seconds:.0f}s"] if missing else [],
+            "datapoint": ", ".join(SENSOR_DATAPOINTS[sensor_type]),
+            "health_status": "critical" if missing else "healthy",
+            "source": "liveness"
+        }
+        await self.rabbitmq.publish(
+            EXCHANGES["fault_alerts"], f"{room_id}.fault", payload,
+            priority=FAULT_PRIORITIES[payload["health_status"]]
         )
+        if missing:
+            logger.warning(f"[FaultAgent] 📵 {room_id} {sensor_type} sensor missing for {silent_seconds:.0f}s")
+        else:
+            logger.info(f"[FaultAgent] 📶 {room_id} {sensor_type} sensor reporting again")
+
+    async def run_watchdog(self):
+        while True:
+            for room_id, sensor_type, silent_seconds in self.watchdog.expired():
+                try:
+                    await self.publish_liveness(room_id, sensor_type, silent_seconds)
+                except Exception as e:
+                    logger.error(f"[FaultAgent] ❌ Failed to publish missing-data fault for {room_id}: {e}")
+
+            next_deadline = self.watchdog.next_deadline()
+            delay = LIVENESS_CONFIG["check_interval"]
+            if next_deadline is not None:
+                delay = min(delay, max(0.0, next_deadline - time.monotonic()))
+            await asyncio.sleep(delay)
+
+async def run_tenant(tenant: str):
+    name = tenant_name("FaultAgent", tenant)
+    quota = tenant_quota(tenant)
+    logger.info(f"[{name}] Connecting to RabbitMQ...")
+
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=quota.prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
 
-        agent = FaultDetectionAgent(fault_exchange)
+        agent = FaultDetectionAgent(rabbitmq, tenant)
 
-        # Declare and bind queues for each room and sensor
-        for room_id in ROOM_IDS:
+        # Bound in-flight handlers and prefetch; back off while fault alerts cannot be published
+        # or the raw_data / room_sensors writers fall behind
+        flow = AdaptiveConcurrencyLimiter(name, backpressure=agent.backpressure,
+                                          max_concurrency=quota.max_concurrency, max_prefetch=quota.prefetch)
+        await flow.attach(await rabbitmq.get_lane_channel("telemetry"))
+        handler = flow.wrap(agent.handle_message)
+
+        # Declare and bind queues for each room and sensor on the combined exchange
+        for room_id in tenant_rooms(tenant):
             for sensor_type in ["iaq", "power", "presence"]:
                 routing_key = f"{room_id}.{sensor_type}"
-                queue_name = f"{room_id}_{sensor_type}_fault_queue"
-
-                queue = await channel.declare_queue(queue_name, durable=True)
-                await queue.bind(sensor_exchange, routing_key=routing_key)
-                await queue.consume(agent.handle_message)
+                queue_name = f"{room_id}_{sensor_type}_combined_fault_queue"
 
-        logger.info("[FaultAgent] 🟢 Waiting for sensor data...")
+                await rabbitmq.subscribe(
+                    EXCHANGES["combined"], queue_name, routing_key, handler, lane="telemetry"
+                )
+                agent.watchdog.watch(room_id, sensor_type)
+        if envelopes_enabled():
+            envelopes = EnvelopeConsumer(name, agent.process_batch, agent.dedup)
+            await rabbitmq.subscribe(
+                EXCHANGES["combined"], "envelope_combined_fault_queue", ENVELOPE_CONFIG["routing_key"],
+                envelopes.handle_message, lane="telemetry"
+            )
+
+        flow_task = asyncio.create_task(flow.run())
+        watchdog_task = asyncio.create_task(agent.run_watchdog())
+        digest_task = asyncio.create_task(agent.run_digests())
+        room_sensors_task = asyncio.create_task(agent.run_room_sensors())
+        logger.info(f"[{name}] 🟢 Waiting for sensor data...")
+        mark_ready(name)
 
         try:
             await asyncio.Future()  # keep alive
         except asyncio.CancelledError:
-            logger.info("[FaultAgent] 🔁 Cancel signal received. Cancelling tasks...")
+            logger.info(f"[{name}] 🔁 Cancel signal received. Cancelling tasks...")
             for task in active_tasks:
                 task.cancel()
             await asyncio.gather(*active_tasks, return_exceptions=True)
         finally:
-            agent.db_writer.close()
-            logger.info("[FaultAgent] ✅ TimescaleDB connection closed.")
-            agent.db_writer.close()
-            agent.supabase_writer.close()
-            logger.info("[FaultAgent] ✅ Supabase connection closed.")
+            flow_task.cancel()
+            watchdog_task.cancel()
+            digest_task.cancel()
+            room_sensors_task.cancel()
+            # Wait for the final room_sensors flush before closing the writers
+            await asyncio.gather(flow_task, watchdog_task, digest_task, room_sensors_task, return_exceptions=True)
+            agent.close()
+
+
+async def main():
+    setup_tracing("FaultAgent")
+    await run_for_tenants("FaultAgent", run_tenant)
 
 
 if __name__ == "__main__":
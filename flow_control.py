@@ -0,0 +1,304 @@
+# flow_control.py
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+from config import FLOW_CONTROL_CONFIG, PUBLISH_FLOW_CONFIG, ENVELOPE_CONFIG
+from envelopes import pack
+from tenancy import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrently running message handlers.
+    The limit grows while handlers are saturated, latency stays near its
+    baseline and downstream writers have headroom; it halves when latency
+    inflates or a writer reports backpressure. The channel prefetch follows
+    the limit, so the broker never pushes more than the agent can work on.
+    """
+
+    def __init__(self, name: str, backpressure: Callable[[], float] = None,
+                 max_concurrency: int = None, max_prefetch: int = None):
+        self.name = name
+        self.backpressure = backpressure or (lambda: 0.0)
+        self.channel = None
+        # Per-tenant ceilings (tenancy.TenantQuota) on top of FLOW_CONTROL_CONFIG
+        self.max_concurrency = min(FLOW_CONTROL_CONFIG["max_concurrency"], max_concurrency or FLOW_CONTROL_CONFIG["max_concurrency"])
+        self.max_prefetch = max_prefetch
+        self.limit = min(FLOW_CONTROL_CONFIG["initial_concurrency"], self.max_concurrency)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.condition = asyncio.Condition()
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.baseline = None  # best recent average handler latency (seconds)
+        self.prefetch = None
+
+    async def attach(self, channel):
+        """Let the limiter drive this channel's prefetch."""
+        self.channel = channel
+        await self._apply_prefetch()
+
+    async def _apply_prefetch(self):
+        prefetch = self.limit * FLOW_CONTROL_CONFIG["prefetch_per_handler"]
+        if self.max_prefetch:
+            prefetch = min(prefetch, self.max_prefetch)
+        if self.channel is None or prefetch == self.prefetch:
+            return
+        await self.channel.set_qos(prefetch_count=prefetch)
+        self.prefetch = prefetch
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency_sum += time.perf_counter() - started
+            self.latency_count += 1
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def wrap(self, handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        async def limited(message):
+            async with self.slot():
+                await handler(message)
+        return limited
+
+    async def adjust(self):
+        """Re-evaluate the limit from the last window of latency samples."""
+        if not self.latency_count:
+            return
+
+        latency = self.latency_sum / self.latency_count
+        saturated = self.peak_in_flight >= self.limit
+        self.latency_sum, self.latency_count, self.peak_in_flight = 0.0, 0, self.in_flight
+
+        # Let the baseline creep up so a permanently slower downstream becomes the new normal
+        self.baseline = latency if self.baseline is None else min(self.baseline * 1.05, latency)
+        pressure = self.backpressure()
+        old_limit = self.limit
+
+        if pressure >= FLOW_CONTROL_CONFIG["backpressure_high"] or \
+                latency > self.baseline * FLOW_CONTROL_CONFIG["latency_tolerance"]:
+            self.limit = max(FLOW_CONTROL_CONFIG["min_concurrency"], self.limit // 2)
+        elif saturated and pressure < FLOW_CONTROL_CONFIG["backpressure_high"] / 2:
+            self.limit = min(self.max_concurrency, self.limit + max(1, self.limit // 8))
+
+        if self.limit != old_limit:
+            logger.info(f"[{self.name}] ⚖️ Concurrency {old_limit} -> {self.limit} "
+                        f"(latency={latency * 1000:.1f}ms, baseline={self.baseline * 1000:.1f}ms, pressure={pressure:.2f})")
+            async with self.condition:
+                self.condition.notify_all()
+            await self._apply_prefetch()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLOW_CONTROL_CONFIG["adjust_interval"])
+            try:
+                await self.adjust()
+            except Exception as e:
+                logger.error(f"[{self.name}] ❌ Flow control adjustment failed: {e}")
+
+
+class PublishFlowController:
+    """
+    Publisher-side flow control. Readings are admitted per room through a
+    token bucket (a runaway room cannot crowd out the others), held in a
+    bounded local buffer and sent by one loop paced by a global token bucket,
+    with an AIMD window of unconfirmed publishes driven by confirm latency.
+
+    aio_pika does not surface connection.blocked, but a blocked connection
+    (memory / disk alarm) or one that is reconnecting simply stops confirming.
+    A confirm missing for confirm_timeout therefore marks the broker blocked:
+    the window drops to one probe every retry_interval until confirms are fast
+    again. When the buffer is full, the oldest presence reading is dropped
+    first, since a newer one supersedes it; IAQ and power readings only go
+    once no presence reading is left.
+
+    Without envelopes, each room has at most one reading in flight, so a
+    reading that is requeued after a failed or missing confirm still goes out
+    before the room's later readings. With envelopes on, up to max_readings
+    buffered readings (waiting at most max_delay to fill up) go out as one
+    message, and only one envelope is in flight at a time so every room's
+    readings reach the broker in order.
+    """
+
+    def __init__(self, name: str, rabbitmq, exchange: str):
+        self.name = name
+        self.rabbitmq = rabbitmq
+        self.exchange = exchange
+        self.global_bucket = TokenBucket(PUBLISH_FLOW_CONFIG["global_rate"], PUBLISH_FLOW_CONFIG["global_burst"])
+        self.room_buckets = {}
+        self.presence = deque()  # (seq, room_id, routing_key, payload)
+        self.readings = deque()  # every other sensor type
+        self.seq = 0
+        self.envelope_size = ENVELOPE_CONFIG["max_readings"] if ENVELOPE_CONFIG["enabled"] else 1
+        self.window = 1 if self.envelope_size > 1 else PUBLISH_FLOW_CONFIG["initial_window"]
+        self.in_flight = 0
+        self.rooms_in_flight = set()
+        self.blocked = False
+        self.paused_until = 0.0
+        self.changed = asyncio.Event()
+        self.dropped = {"presence": 0, "other": 0, "rate_limited": 0}
+
+    def __len__(self):
+        return len(self.presence) + len(self.readings)
+
+    def submit(self, room_id: str, sensor_type: str, routing_key: str, payload: dict) -> bool:
+        """Queue a reading for sending; never waits. Returns False if the room is over its rate."""
+        bucket = self.room_buckets.get(room_id)
+        if bucket is None:
+            bucket = self.room_buckets[room_id] = TokenBucket(PUBLISH_FLOW_CONFIG["room_rate"], PUBLISH_FLOW_CONFIG["room_burst"])
+        if not bucket.try_take():
+            self._count_drop("rate_limited", room_id)
+            return False
+
+        if len(self) >= PUBLISH_FLOW_CONFIG["max_buffered"]:
+            if self.presence:
+                self.presence.popleft()
+                self._count_drop("presence", room_id)
+            else:
+                self.readings.popleft()
+                self._count_drop("other", room_id)
+
+        self.seq += 1
+        entry = (self.seq, room_id, routing_key, payload)
+        (self.presence if sensor_type == "presence" else self.readings).append(entry)
+        self.changed.set()
+        return True
+
+    def _count_drop(self, reason: str, room_id: str):
+        self.dropped[reason] += 1
+        if self.dropped[reason] % 1000 == 1:
+            logger.warning(f"[{self.name}] 🗑️ Dropping readings ({reason}, latest from {room_id}) | "
+                           f"dropped={self.dropped} buffered={len(self)}")
+
+    def _pop_oldest(self):
+        if not self.readings or (self.presence and self.presence[0][0] < self.readings[0][0]):
+            return self.presence.popleft()
+        return self.readings.popleft()
+
+    def _next_sendable(self):
+        """(queue, index) of the oldest reading whose room has nothing in flight, or None."""
+        best = None
+        for queue in (self.presence, self.readings):
+            for index, entry in enumerate(queue):
+                if entry[1] not in self.rooms_in_flight:
+                    if best is None or entry[0] < best[0][best[1]][0]:
+                        best = (queue, index)
+                    break
+        return best
+
+    def _requeue(self, entries: list):
+        """Put unconfirmed readings back at the front of their queues (consumers dedup a late duplicate)."""
+        for entry in reversed(entries):
+            routing_key = entry[2]
+            (self.presence if routing_key.endswith(".presence") else self.readings).appendleft(entry)
+
+    def _publish(self, entries: list):
+        if self.envelope_size == 1:
+            seq, room_id, routing_key, payload = entries[0]
+            return self.rabbitmq.publish(self.exchange, routing_key, payload,
+                                         message_id=payload.get("message_id"), retry=False)
+        readings = [{**payload, "sensor_type": routing_key.rsplit(".", 1)[-1]}
+                    for seq, room_id, routing_key, payload in entries]
+        return self.rabbitmq.publish_body(self.exchange, ENVELOPE_CONFIG["routing_key"], pack(readings),
+                                          message_id=uuid.uuid4().hex, retry=False)
+
+    async def _send(self, entries: list):
+        started = time.perf_counter()
+        try:
+            confirmed = await asyncio.wait_for(self._publish(entries), PUBLISH_FLOW_CONFIG["confirm_timeout"])
+        except asyncio.TimeoutError:
+            confirmed = False
+        latency = time.perf_counter() - started
+
+        if confirmed:
+            if len(entries) == 1:
+                seq, room_id, routing_key, payload = entries[0]
+                logger.info(f"[{self.name}] [{room_id}] Published to '{routing_key}': {payload.get('data')}")
+            else:
+                logger.info(f"[{self.name}] 📦 Published envelope of {len(entries)} reading(s) "
+                            f"from {len({entry[1] for entry in entries})} room(s)")
+            if self.blocked:
+                self.blocked = False
+                self.window = 1 if self.envelope_size > 1 else PUBLISH_FLOW_CONFIG["initial_window"]
+                logger.info(f"[{self.name}] ✅ Broker confirming again, sending {len(self)} buffered reading(s)")
+            elif self.envelope_size == 1:  # one envelope in flight keeps per-room order, so no window to adapt
+                if latency > PUBLISH_FLOW_CONFIG["confirm_target"]:
+                    self.window = max(1, self.window // 2)
+                else:
+                    self.window = min(PUBLISH_FLOW_CONFIG["max_window"], self.window + 1)
+        else:
+            self._requeue(entries)
+            self.paused_until = time.monotonic() + PUBLISH_FLOW_CONFIG["retry_interval"]
+            if not self.blocked:
+                self.blocked = True
+                logger.warning(f"[{self.name}] ⛔ No confirm after {latency:.1f}s (broker blocked or reconnecting), "
+                               f"holding readings locally | buffered={len(self)}")
+            self.window = 1
+
+        self.in_flight -= 1
+        if self.envelope_size == 1:
+            self.rooms_in_flight.discard(entries[0][1])
+        self.changed.set()
+
+    async def run(self):
+        """Send buffered readings until cancelled."""
+        tasks = set()
+        lingered = False
+        try:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+                if not len(self) or self.in_flight >= self.window:
+                    self.changed.clear()
+                    await self.changed.wait()
+                    continue
+                sendable = self._next_sendable() if self.envelope_size == 1 else None
+                if self.envelope_size == 1 and sendable is None:
+                    # Every buffered room already has a reading in flight
+                    self.changed.clear()
+                    await self.changed.wait()
+                    continue
+                if len(self) < self.envelope_size and not lingered:
+                    # Give a partial envelope a moment to fill up
+                    lingered = True
+                    await asyncio.sleep(ENVELOPE_CONFIG["max_delay"])
+                    continue
+                if not self.global_bucket.try_take():
+                    await asyncio.sleep(1 / PUBLISH_FLOW_CONFIG["global_rate"])
+                    continue
+                lingered = False
+
+                self.in_flight += 1
+                if sendable is not None:
+                    queue, index = sendable
+                    entries = [queue[index]]
+                    del queue[index]
+                    self.rooms_in_flight.add(entries[0][1])
+                else:
+                    entries = [self._pop_oldest() for _ in range(min(self.envelope_size, len(self)))]
+                task = asyncio.create_task(self._send(entries))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if len(self):
+                logger.warning(f"[{self.name}] ⚠️ Stopped with {len(self)} unsent reading(s)")
@@ -49,10 +49,46 @@ function RoomCard({ room, data }) {
   );
 }
 
+// e.g. ws://localhost:8082/ws?floor=hotel:main:1 (push_gateway.py); falls back to Supabase realtime when unset
+const PUSH_GATEWAY_URL = process.env.REACT_APP_PUSH_GATEWAY_URL;
+
+function mergeRooms(prev, rooms) {
+  const next = { ...prev };
+  Object.values(rooms).forEach(rows => {
+    Object.values(rows).forEach(row => {
+      next[row.room_id + '-' + row.datapoint] = row;
+    });
+  });
+  return next;
+}
+
 function Dashboard() {
   const [roomData, setRoomData] = useState({});
 
   useEffect(() => {
+    if (!PUSH_GATEWAY_URL) return;
+    let socket;
+    let retry;
+    const connect = () => {
+      socket = new WebSocket(PUSH_GATEWAY_URL);
+      socket.onmessage = event => {
+        const frame = JSON.parse(event.data);
+        if (frame.type === 'snapshot') setRoomData(mergeRooms({}, frame.rooms));
+        else if (frame.type === 'delta') setRoomData(prev => mergeRooms(prev, frame.rooms));
+      };
+      socket.onclose = () => { retry = setTimeout(connect, 2000); };
+    };
+    connect();
+
+    return () => {
+      clearTimeout(retry);
+      socket.onclose = null;
+      socket.close();
+    };
+  }, []);
+
+  useEffect(() => {
+    if (PUSH_GATEWAY_URL) return;
     fetchRoomStates();
     console.log("fetchRoomStates called");
     const channel = supabase
@@ -0,0 +1,196 @@
+# latest_values.py
+
+import json
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from config import LATEST_VALUES_CONFIG
+from room_registry import LEVELS, HierarchyAggregator, get_registry
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_DATAPOINTS = ["temperature", "humidity", "co2", "power_kw_power_meter", "sensitivity"]
+CATEGORICAL_DATAPOINTS = {
+    "presence_state": ["occupied", "unoccupied", "passive"],
+    "online_status": ["online", "offline"],
+}
+
+
+class LatestValueIndex:
+    """
+    In-process table of the latest reading of every datapoint for every room.
+    Storage is columnar: one NumPy array per datapoint, indexed by room slot
+    (float64 with NaN for numeric datapoints, int8 codes with -1 for
+    categorical ones), plus the reading timestamp of every value and a
+    last-update timestamp per room. A reading older than the stored value of
+    a datapoint (late or redelivered) does not overwrite it. Whole columns
+    can be handed to vectorised code, and snapshots never touch the database.
+    """
+
+    def __init__(self, room_ids: list[str] = None, capacity: int = 64):
+        room_ids = room_ids if room_ids is not None else get_registry().room_ids
+        capacity = max(capacity, len(room_ids))
+        self.lock = threading.Lock()
+        self.room_index = {}   # { room_id: slot }
+        self.rooms = []        # slot -> room_id
+        self.values = {dp: np.full(capacity, np.nan) for dp in NUMERIC_DATAPOINTS}
+        self.codes = {dp: np.full(capacity, -1, dtype=np.int8) for dp in CATEGORICAL_DATAPOINTS}
+        self.categories = {dp: list(labels) for dp, labels in CATEGORICAL_DATAPOINTS.items()}
+        self.category_codes = {dp: {label: i for i, label in enumerate(labels)}
+                               for dp, labels in CATEGORICAL_DATAPOINTS.items()}
+        self.stamps = {dp: np.zeros(capacity, dtype=np.int64) for dp in [*self.values, *self.codes]}
+        self.updated = np.zeros(capacity, dtype=np.int64)
+        self.version = 0  # bumped on every update, lets readers cache encoded snapshots
+        for room_id in room_ids:
+            self._slot(room_id)
+
+    def _slot(self, room_id: str) -> int:
+        slot = self.room_index.get(room_id)
+        if slot is not None:
+            return slot
+
+        slot = len(self.rooms)
+        if slot == len(self.updated):
+            self._grow(2 * slot)
+        self.room_index[room_id] = slot
+        self.rooms.append(room_id)
+        return slot
+
+    def _grow(self, capacity: int):
+        def grown(array, fill):
+            bigger = np.full(capacity, fill, dtype=array.dtype)
+            bigger[:len(array)] = array
+            return bigger
+
+        self.values = {dp: grown(column, np.nan) for dp, column in self.values.items()}
+        self.codes = {dp: grown(column, -1) for dp, column in self.codes.items()}
+        self.stamps = {dp: grown(column, 0) for dp, column in self.stamps.items()}
+        self.updated = grown(self.updated, 0)
+
+    def _code(self, datapoint: str, label: str) -> int:
+        code = self.category_codes[datapoint].get(label)
+        if code is None:
+            code = len(self.categories[datapoint])
+            self.categories[datapoint].append(label)
+            self.category_codes[datapoint][label] = code
+        return code
+
+    def update(self, room_id: str, readings: dict, timestamp: int):
+        """Store the datapoints present in readings unless a newer value is stored; unknown keys are ignored."""
+        timestamp = int(timestamp or 0)
+        with self.lock:
+            slot = self._slot(room_id)
+            for datapoint, value in readings.items():
+                stamps = self.stamps.get(datapoint)
+                if stamps is None or timestamp < stamps[slot]:
+                    continue
+                stamps[slot] = timestamp
+                if datapoint in self.values:
+                    try:
+                        self.values[datapoint][slot] = float(value)
+                    except (TypeError, ValueError):
+                        self.values[datapoint][slot] = np.nan
+                elif datapoint in self.codes:
+                    self.codes[datapoint][slot] = -1 if value in (None, "null") else self._code(datapoint, value)
+            self.updated[slot] = max(self.updated[slot], timestamp or 0)
+            self.version += 1
+
+    def column(self, datapoint: str) -> np.ndarray:
+        """Copy of one datapoint across all known rooms, in slot order (see self.rooms)."""
+        with self.lock:
+            source = self.values.get(datapoint)
+            if source is None:
+                source = self.codes[datapoint]
+            return source[:len(self.rooms)].copy()
+
+    def snapshot(self, room_ids: list[str] = None) -> dict[str, dict]:
+        """Latest readings per room; missing values are None."""
+        with self.lock:
+            slots = [(room_id, self.room_index[room_id]) for room_id in (room_ids or self.rooms)
+                     if room_id in self.room_index]
+            result = {}
+            for room_id, slot in slots:
+                room = {"timestamp": int(self.updated[slot]) or None}
+                for datapoint, column in self.values.items():
+                    value = column[slot]
+                    room[datapoint] = None if math.isnan(value) else float(value)
+                for datapoint, column in self.codes.items():
+                    code = column[slot]
+                    room[datapoint] = None if code < 0 else self.categories[datapoint][code]
+                result[room_id] = room
+            return result
+
+
+class _SnapshotHandler(BaseHTTPRequestHandler):
+    index: LatestValueIndex = None
+    aggregator: HierarchyAggregator = None
+    cached = (-1, b"")  # (version, encoded full snapshot)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts and parts[0] == "groups":
+            self._send_groups(parts[1:])
+            return
+        if not parts or parts[0] != "rooms" or len(parts) > 2:
+            self.send_error(404)
+            return
+
+        if len(parts) == 2:
+            body = json.dumps(self.index.snapshot([parts[1]]).get(parts[1])).encode()
+            if body == b"null":
+                self.send_error(404, f"Unknown room {parts[1]}")
+                return
+        elif "ids" in parse_qs(url.query):
+            room_ids = parse_qs(url.query)["ids"][0].split(",")
+            body = json.dumps(self.index.snapshot(room_ids)).encode()
+        else:
+            # Whole-property snapshot: re-encode only when something changed
+            version, body = type(self).cached
+            if version != self.index.version:
+                version = self.index.version
+                body = json.dumps(self.index.snapshot()).encode()
+                type(self).cached = (version, body)
+
+        self._send_json(body)
+
+    def _send_groups(self, parts: list[str]):
+        if self.aggregator is None or not parts or parts[0] not in LEVELS or len(parts) > 2:
+            self.send_error(404)
+            return
+        if len(parts) == 2:
+            body = json.dumps(self.aggregator.summary(parts[0], parts[1])).encode()
+        else:
+            body = json.dumps(self.aggregator.summaries(parts[0])).encode()
+        self._send_json(body)
+
+    def _send_json(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"[LatestValues] {self.address_string()} {format % args}")
+
+
+def serve_http(index: LatestValueIndex, host: str = None, port: int = None,
+               aggregator: HierarchyAggregator = None) -> ThreadingHTTPServer:
+    """
+    Serve snapshots on a background thread:
+      GET /rooms                 -> all rooms
+      GET /rooms?ids=room101,... -> selected rooms
+      GET /rooms/<room_id>       -> one room
+      GET /groups/<level>[/<id>] -> floor / building / property summaries
+    """
+    host = host or LATEST_VALUES_CONFIG["host"]
+    port = port or LATEST_VALUES_CONFIG["port"]
+    handler = type("SnapshotHandler", (_SnapshotHandler,), {"index": index, "aggregator": aggregator})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="latest-values-http", daemon=True).start()
+    logger.info(f"[LatestValues] 🌐 Serving room snapshots on http://{host}:{port}/rooms")
+    return server
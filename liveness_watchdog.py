@@ -0,0 +1,62 @@
+# liveness_watchdog.py
+
+import heapq
+import time
+
+
+class LivenessWatchdog:
+    """
+    Tracks the last time each (room_id, sensor_type) delivered data and reports
+    sensors that went silent for longer than their timeout.
+    Deadlines live in a min-heap with at most one entry per sensor. seen() only
+    records the arrival time (O(1), no heap work); when an entry's deadline comes
+    up, expired() re-checks the real last-seen time and lazily pushes it back if
+    the sensor reported in the meantime. A check therefore only touches sensors
+    whose deadline actually passed, however many are tracked.
+    """
+
+    def __init__(self, timeouts: dict[str, float]):
+        self.timeouts = timeouts  # { sensor_type: seconds }
+        self.last_seen = {}       # { (room_id, sensor_type): monotonic time }
+        self.missing = set()      # sensors currently reported as silent
+        self.heap = []            # (deadline, room_id, sensor_type)
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def watch(self, room_id: str, sensor_type: str, now: float = None):
+        """Start expecting data from a sensor that has not reported yet (one timeout of grace)."""
+        if (room_id, sensor_type) not in self.last_seen:
+            self.seen(room_id, sensor_type, now)
+
+    def seen(self, room_id: str, sensor_type: str, now: float = None) -> bool:
+        """Record data from a sensor. Returns True if it had been reported missing."""
+        key = (room_id, sensor_type)
+        now = time.monotonic() if now is None else now
+        known = key in self.last_seen
+        self.last_seen[key] = now
+
+        recovered = key in self.missing
+        if recovered:
+            self.missing.discard(key)
+        if recovered or not known:
+            heapq.heappush(self.heap, (now + self.timeouts[sensor_type], room_id, sensor_type))
+        return recovered
+
+    def expired(self, now: float = None) -> list[tuple[str, str, float]]:
+        """Sensors that just went silent, as (room_id, sensor_type, silent_seconds)."""
+        now = time.monotonic() if now is None else now
+        silent = []
+        while self.heap and self.heap[0][0] <= now:
+            _, room_id, sensor_type = heapq.heappop(self.heap)
+            last_seen = self.last_seen[(room_id, sensor_type)]
+            deadline = last_seen + self.timeouts[sensor_type]
+            if deadline > now:
+                heapq.heappush(self.heap, (deadline, room_id, sensor_type))
+                continue
+            self.missing.add((room_id, sensor_type))
+            silent.append((room_id, sensor_type, now - last_seen))
+        return silent
+
+    def next_deadline(self) -> float | None:
+        return self.heap[0][0] if self.heap else None
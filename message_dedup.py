@@ -0,0 +1,38 @@
+# message_dedup.py
+
+from collections import OrderedDict
+from config import DEDUP_CONFIG
+
+
+class MessageDeduplicator:
+    """
+    Per-room LRU window of producer-assigned message IDs.
+    Redelivered messages (e.g. after a broker failover) are recognised and
+    acked without being processed again. IDs are only remembered once a
+    message was processed successfully, so a dead-lettered message can still
+    be replayed.
+    """
+
+    def __init__(self, window: int = None):
+        self.window = window or DEDUP_CONFIG["window_per_room"]
+        self.rooms = {}  # { room_id: OrderedDict[message_id, None] }
+        self.duplicates = 0
+
+    def is_duplicate(self, room_id: str, message_id: str | None) -> bool:
+        if not message_id:
+            return False
+        seen = self.rooms.get(room_id)
+        if seen is not None and message_id in seen:
+            seen.move_to_end(message_id)
+            self.duplicates += 1
+            return True
+        return False
+
+    def remember(self, room_id: str, message_id: str | None):
+        if not message_id:
+            return
+        seen = self.rooms.setdefault(room_id, OrderedDict())
+        seen[message_id] = None
+        seen.move_to_end(message_id)
+        if len(seen) > self.window:
+            seen.popitem(last=False)
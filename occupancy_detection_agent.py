@@ -1,12 +1,18 @@
+from startup import mark_ready  # first import, starts the startup clock
 import asyncio
 import aio_pika
 import json
 import logging
-from datetime import datetime, timedelta
 from collections import deque
 
-from config import ROOM_IDS, EXCHANGES, RABBITMQ_CONFIG
-from sensors_subscriber import SensorSubscriber
+from config import EXCHANGES, ENVELOPE_CONFIG
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from rabbitmq_management import AsyncRabbitMQManager
+from flow_control import AdaptiveConcurrencyLimiter
+from message_dedup import MessageDeduplicator
+from tracing import setup_tracing, tracer
+from envelopes import EnvelopeConsumer, envelopes_enabled
+from time_service import clock
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("OccupancyAgent")
@@ -61,15 +67,15 @@ class RoomContextManager:
 
 
 class OccupancyDetectionAgent:
-    def __init__(self, occupancy_exchange: aio_pika.Exchange):
-        self.exchange = occupancy_exchange
-        self.subscriber = SensorSubscriber()
+    def __init__(self, rabbitmq: AsyncRabbitMQManager):
+        self.rabbitmq = rabbitmq
+        self.dedup = MessageDeduplicator()
         self.context_manager = RoomContextManager()
 
     def detect_occupancy(self, room_id: str, message: dict) -> bool | None:
         timestamp = message["timestamp"]
         co2 = float(message.get("co2", 0))
-        hour = datetime.fromtimestamp(timestamp).hour
+        hour = clock.local_hour(timestamp)
 
         # Update context
         presence_state = message.get("presence_state")
@@ -116,92 +122,103 @@ class OccupancyDetectionAgent:
         return decision
 
     async def handle_message(self, message: aio_pika.IncomingMessage):
-        async with message.process(ignore_processed=True):
-            try:
-                routing_key = message.routing_key
-                logger.info(f"[OccupancyAgent] Received from {routing_key}")
-                raw_body = message.body.decode()
-                parsed = json.loads(raw_body)
+        try:
+            async with message.process(ignore_processed=True):
+                logger.info(f"[OccupancyAgent] Received from {message.routing_key}")
+                parsed = json.loads(message.body.decode())
 
                 room_id = parsed.get("room_id")
-                sensor_data = parsed.get("data", {})
-                sensor_type = routing_key.split(".")[-1]
-
-                mock_method = type("Method", (), {"routing_key": routing_key})
-                mock_props = type("Props", (), {})()
-
-                output = self.subscriber.sensor_callback(
-                    ch=None,
-                    method=mock_method,
-                    properties=mock_props,
-                    body=json.dumps({
-                        "room_id": room_id,
-                        "data": sensor_data
-                    }).encode()
-                )
-
-                if not output:
+                message_id = message.message_id or parsed.get("message_id")
+                if self.dedup.is_duplicate(room_id, message_id):
+                    logger.info(f"[OccupancyAgent] ⏭️ Skipping redelivered message {message_id} for {room_id}")
                     return
 
-                decision = self.detect_occupancy(room_id, output)
-                if decision is None:
-                    logger.info(f"[OccupancyAgent] Holding state for {room_id}")
-                    return
+                await self.process_reading(message.routing_key, parsed)
+                self.dedup.remember(room_id, message_id)
 
-                payload = {
-                    "room_id": room_id,
-                    "timestamp": output["timestamp"],
-                    "is_occupied": decision,
-                    "datapoint": sensor_type
-                }
+        except Exception as e:
+            # Rejected without requeue, so the broker dead-letters it
+            logger.error(f"[OccupancyAgent] ❌ Error processing message: {e}")
 
-                # ✅ Publish
-                await self.exchange.publish(
-                    aio_pika.Message(body=json.dumps(payload).encode()),
-                    routing_key=f"{room_id}.occupancy"
-                )
-                logger.info(f"[OccupancyAgent] 📡 Published: {payload}")
+    async def process_reading(self, routing_key: str, parsed: dict):
+        """One record from the combined exchange, already joined by sensors_subscriber.py."""
+        sensor_type = parsed.get("sensor_type") or routing_key.split(".")[-1]
+        await self.process_record(parsed.get("room_id"), sensor_type, parsed.get("data", {}),
+                                  parsed.get("timestamp"), parsed.get("combined"))
 
+    async def process_batch(self, records: list[dict]):
+        """An envelope of combined records, in order; only joined (presence) records matter here."""
+        for record in records:
+            if not record.get("combined"):
+                continue
+            try:
+                await self.process_record(record.get("room_id"), record.get("sensor_type"), record.get("data", {}),
+                                          record.get("timestamp"), record["combined"])
             except Exception as e:
-                logger.error(f"[OccupancyAgent] ❌ Error processing message: {e}")
+                logger.error(f"[OccupancyAgent] ❌ Skipping record {record.get('message_id')} for {record.get('room_id')} in envelope: {e}")
+
+    async def process_record(self, room_id: str, sensor_type: str, sensor_data: dict, timestamp, output: dict | None,
+                             message_id: str = None):
+        """Occupancy stage for one decoded reading and its joined record."""
+        if not output:
+            return
+
+        with tracer.span("detect", room_id=room_id):
+            decision = self.detect_occupancy(room_id, output)
+        if decision is None:
+            logger.info(f"[OccupancyAgent] Holding state for {room_id}")
+            return
+
+        payload = {
+            "room_id": room_id,
+            "timestamp": output["timestamp"],
+            "is_occupied": decision,
+            "datapoint": sensor_type
+        }
+
+        # ✅ Publish
+        await self.rabbitmq.publish(EXCHANGES["occupancy"], f"{room_id}.occupancy", payload)
+        logger.info(f"[OccupancyAgent] 📡 Published: {payload}")
+
+
+async def run_tenant(tenant: str):
+    name = tenant_name("OccupancyAgent", tenant)
+    quota = tenant_quota(tenant)
+    logger.info(f"[{name}] Connecting to RabbitMQ...")
+
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=quota.prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
+
+        agent = OccupancyDetectionAgent(rabbitmq)
+
+        # Occupancy decisions are only published (the updater writes them), so the publish
+        # retry buffer is the only sink that can fall behind here
+        flow = AdaptiveConcurrencyLimiter(name, backpressure=rabbitmq.backpressure,
+                                          max_concurrency=quota.max_concurrency, max_prefetch=quota.prefetch)
+        await flow.attach(await rabbitmq.get_lane_channel("telemetry"))
+        handler = flow.wrap(agent.handle_message)
+
+        # Joined records are only produced by presence readings, so IAQ traffic is no longer needed here
+        for room_id in tenant_rooms(tenant):
+            await rabbitmq.subscribe(
+                EXCHANGES["combined"], f"{room_id}_presence_combined_occupancy_queue", f"{room_id}.presence",
+                handler, lane="telemetry"
+            )
+        if envelopes_enabled():
+            envelopes = EnvelopeConsumer(name, agent.process_batch, agent.dedup)
+            await rabbitmq.subscribe(
+                EXCHANGES["combined"], "envelope_combined_occupancy_queue", ENVELOPE_CONFIG["routing_key"],
+                envelopes.handle_message, lane="telemetry"
+            )
+
+        logger.info(f"[{name}] 🟢 Waiting for sensor data...")
+        mark_ready(name)
+        await flow.run()
 
 
 async def main():
-    logger.info("[OccupancyAgent] Connecting to RabbitMQ...")
-
-    connection = await aio_pika.connect_robust(
-        host=RABBITMQ_CONFIG["host"],
-        port=RABBITMQ_CONFIG["port"],
-        login=RABBITMQ_CONFIG["user"],
-        password=RABBITMQ_CONFIG["password"],
-        virtualhost=RABBITMQ_CONFIG["vhost"]
-    )
-
-    async with connection:
-        channel = await connection.channel()
-        logger.info("[OccupancyAgent] ✅ Connected to RabbitMQ.")
-
-        # Declare exchanges
-        sensor_exchange = await channel.declare_exchange(
-            EXCHANGES["sensor_data"], aio_pika.ExchangeType.TOPIC, durable=True
-        )
-        occupancy_exchange = await channel.declare_exchange(
-            EXCHANGES["occupancy"], aio_pika.ExchangeType.TOPIC, durable=True
-        )
-
-        agent = OccupancyDetectionAgent(occupancy_exchange)
-
-        for room_id in ROOM_IDS:
-            for sensor_type in ["iaq", "presence"]:
-                routing_key = f"{room_id}.{sensor_type}"
-                queue_name = f"{room_id}_{sensor_type}_occupancy_queue"
-
-                queue = await channel.declare_queue(queue_name, durable=True)
-                await queue.bind(sensor_exchange, routing_key=routing_key)
-                await queue.consume(agent.handle_message)
-
-        logger.info("[OccupancyAgent] 🟢 Waiting for sensor data...")
-        await asyncio.Future()
+    setup_tracing("OccupancyAgent")
+    await run_for_tenants("OccupancyAgent", run_tenant)
 
 
 if __name__ == "__main__":
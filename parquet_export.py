@@ -0,0 +1,236 @@
+# parquet_export.py
+
+import argparse
+import logging
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytz
+from pyarrow import fs
+from config import ROOM_IDS, TIMESCALE_CONFIG, EXPORT_CONFIG, TIMEZONE
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ParquetExport")
+
+NUMERIC_DATAPOINTS = ["temperature", "humidity", "co2", "power_kw_power_meter", "sensitivity"]
+
+# COPY output columns and their Arrow types
+COPY_COLUMNS = {
+    "timestamp": pa.int64(),
+    "datetime_us": pa.int64(),
+    "device_id": pa.string(),
+    "datapoint": pa.string(),
+    "value": pa.string(),
+    "value_num": pa.float64(),
+}
+
+# What lands in each file; room and date come from the directory names
+FILE_SCHEMA = pa.schema([
+    ("timestamp", pa.int64()),
+    ("datetime", pa.timestamp("us", tz="UTC")),
+    ("datapoint", pa.string()),
+    ("value", pa.string()),
+    ("value_num", pa.float64()),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string()), ("room_id", pa.string())]), flavor="hive")
+
+COPY_SQL = """
+    COPY (
+        SELECT timestamp,
+               (extract(epoch FROM datetime) * 1000000)::BIGINT AS datetime_us,
+               device_id,
+               datapoint,
+               value,
+               CASE WHEN datapoint = ANY(%s) THEN NULLIF(value, 'null')::DOUBLE PRECISION END AS value_num
+        FROM raw_data
+        WHERE device_id = ANY(%s) AND datetime >= %s AND datetime < %s
+        ORDER BY device_id, datetime
+    ) TO STDOUT WITH (FORMAT csv, HEADER true)
+"""
+
+
+def _copy_stream(conn, sql: str):
+    """
+    Run COPY ... TO STDOUT on a background thread into a pipe and return the
+    read end. The pipe's buffer is the only slack, so the database is never
+    read further ahead than the Arrow CSV reader consumes.
+    """
+    read_fd, write_fd = os.pipe()
+    reader, writer = os.fdopen(read_fd, "rb"), os.fdopen(write_fd, "wb")
+    errors = []
+
+    def produce():
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(sql, writer, size=EXPORT_CONFIG["copy_buffer"])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            writer.close()
+
+    thread = threading.Thread(target=produce, name="copy-stream", daemon=True)
+    thread.start()
+    return reader, thread, errors
+
+
+def _partition_dir(directory: str, day: date, room_id: str = None) -> str:
+    path = os.path.join(directory, f"date={day.isoformat()}")
+    return os.path.join(path, f"room_id={room_id}") if room_id else path
+
+
+class ParquetExporter:
+    """
+    Exports raw_data to Parquet files partitioned as
+    <directory>/date=YYYY-MM-DD/room_id=<room>/part.parquet (property-local dates).
+    Each day is one COPY streamed through pyarrow's incremental CSV reader,
+    so memory stays at roughly one block per open room file. A day's files
+    are written under temporary names and swapped in when complete, so a
+    re-export replaces a partition atomically per room.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or EXPORT_CONFIG["directory"]
+        self.tz = pytz.timezone(TIMEZONE)
+        self.conn = psycopg2.connect(
+            host=TIMESCALE_CONFIG["host"],
+            port=TIMESCALE_CONFIG["port"],
+            user=TIMESCALE_CONFIG["user"],
+            password=TIMESCALE_CONFIG["password"],
+            dbname=TIMESCALE_CONFIG["dbname"],
+        )
+        self.conn.set_session(readonly=True, autocommit=True)
+
+    def export_day(self, day: date, room_ids: list[str]) -> int:
+        start = self.tz.localize(datetime.combine(day, datetime.min.time()))
+        end = self.tz.localize(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+        with self.conn.cursor() as cursor:
+            sql = cursor.mogrify(COPY_SQL, (NUMERIC_DATAPOINTS, room_ids, start, end)).decode()
+
+        reader, thread, errors = _copy_stream(self.conn, sql)
+        writers, rows, completed = {}, 0, False  # { room_id: (ParquetWriter, tmp path) }
+        try:
+            batches = pacsv.open_csv(
+                reader,
+                read_options=pacsv.ReadOptions(block_size=EXPORT_CONFIG["block_size"]),
+                convert_options=pacsv.ConvertOptions(column_types=COPY_COLUMNS),
+            )
+            for batch in batches:
+                rows += batch.num_rows
+                for room_id in pc.unique(batch.column("device_id")).to_pylist():
+                    part = batch.filter(pc.equal(batch.column("device_id"), room_id))
+                    if room_id not in writers:
+                        path = _partition_dir(self.directory, day, room_id)
+                        os.makedirs(path, exist_ok=True)
+                        tmp = os.path.join(path, "part.parquet.tmp")
+                        writers[room_id] = (pq.ParquetWriter(tmp, FILE_SCHEMA, compression="zstd"), tmp)
+                    writers[room_id][0].write_table(pa.Table.from_arrays([
+                        part.column("timestamp"),
+                        part.column("datetime_us").cast(pa.timestamp("us", tz="UTC")),
+                        part.column("datapoint"),
+                        part.column("value"),
+                        part.column("value_num"),
+                    ], schema=FILE_SCHEMA), row_group_size=EXPORT_CONFIG["row_group_rows"])
+            completed = True
+        finally:
+            reader.close()
+            thread.join()
+            for writer, tmp in writers.values():
+                writer.close()
+                if errors or not completed:
+                    os.remove(tmp)  # keep the previous export of this partition
+        if errors:
+            raise errors[0]
+
+        for room_id in room_ids:
+            if room_id not in writers:
+                shutil.rmtree(_partition_dir(self.directory, day, room_id), ignore_errors=True)
+        for _, tmp in writers.values():
+            os.replace(tmp, tmp[:-len(".tmp")])
+        return rows
+
+    def export(self, start: date, end: date, room_ids: list[str] = None) -> int:
+        """Export whole local days from start to end (inclusive)."""
+        room_ids = room_ids or ROOM_IDS
+        total, day = 0, start
+        while day <= end:
+            rows = self.export_day(day, room_ids)
+            total += rows
+            logger.info(f"[ParquetExport] 📦 {day}: {rows} rows for {len(room_ids)} room(s)")
+            day += timedelta(days=1)
+        return total
+
+    def close(self):
+        self.conn.close()
+
+
+# -----------------------------
+# Reading
+# -----------------------------
+def open_dataset(directory: str = None) -> ds.Dataset:
+    """Exported history as an Arrow dataset; files are memory-mapped, not read into buffers."""
+    return ds.dataset(
+        directory or EXPORT_CONFIG["directory"], format="parquet", partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def read_history(directory: str = None, room_ids: list[str] = None, start: datetime = None,
+                 end: datetime = None, datapoints: list[str] = None, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Load a slice of the exported history. Room and day filters prune whole
+    partitions; the rest is pushed down to the Parquet row groups.
+    """
+    dataset = open_dataset(directory)
+    conditions = []
+    if room_ids:
+        conditions.append(ds.field("room_id").isin(room_ids))
+    if start is not None:
+        conditions.append(ds.field("date") >= start.astimezone(pytz.timezone(TIMEZONE)).date().isoformat())
+        conditions.append(ds.field("datetime") >= pa.scalar(start, pa.timestamp("us", tz="UTC")))
+    if end is not None:
+        conditions.append(ds.field("date") <= end.astimezone(pytz.timezone(TIMEZONE)).date().isoformat())
+        conditions.append(ds.field("datetime") < pa.scalar(end, pa.timestamp("us", tz="UTC")))
+    if datapoints:
+        conditions.append(ds.field("datapoint").isin(datapoints))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def to_wide(frame: pd.DataFrame, freq: str = "1min") -> pd.DataFrame:
+    """Numeric datapoints as columns, averaged per room and time bucket (model-ready)."""
+    return frame.pivot_table(
+        index=["room_id", pd.Grouper(key="datetime", freq=freq)],
+        columns="datapoint", values="value_num", aggfunc="mean"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export raw_data to date/room partitioned Parquet files.")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="first local day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="last local day (default: start)")
+    parser.add_argument("--rooms", default=",".join(ROOM_IDS), help="comma-separated room IDs")
+    parser.add_argument("--out", default=EXPORT_CONFIG["directory"], help="output directory")
+    args = parser.parse_args()
+
+    exporter = ParquetExporter(args.out)
+    try:
+        total = exporter.export(args.start, args.end or args.start, args.rooms.split(","))
+        logger.info(f"[ParquetExport] ✅ Exported {total} rows to {args.out}")
+    finally:
+        exporter.close()
+
+
+if __name__ == "__main__":
+    main()
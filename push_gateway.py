@@ -0,0 +1,337 @@
+# push_gateway.py
+
+import asyncio
+import aio_pika
+import json
+import logging
+import httpx
+from aiohttp import WSMsgType, web
+from config import EXCHANGES, PUSH_GATEWAY_CONFIG, SUPABASE_HTTP_CONFIG
+from rabbitmq_management import AsyncRabbitMQManager
+from room_registry import floor_id, get_registry
+from tenancy import run_for_tenants, tenant_name, tenant_vhost
+from tracing import setup_tracing
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("PushGateway")
+
+
+def _encode(kind: str, rooms: dict, seq: int) -> str:
+    return json.dumps({"type": kind, "seq": seq, "rooms": rooms}, separators=(",", ":"))
+
+
+class RoomStateStore:
+    """
+    In-memory room_states: { room_id: { datapoint: row } }, rows shaped like the
+    Supabase table. Changed rows collect in a dirty map until the next frame,
+    so many updates to one row between frames become a single delta entry.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.dirty = {}
+        self.seq = 0
+
+    def apply(self, payload: dict) -> bool:
+        """Occupancy or fault payload, read the same way supabase_updater_agent.py does."""
+        room_id = payload.get("room_id")
+        datapoint = payload.get("datapoint", "unknown")
+        row = {
+            "room_id": room_id,
+            "datapoint": datapoint,
+            "is_occupied": payload.get("is_occupied", True),
+            "health_status": payload.get("health_status", "healthy"),
+        }
+        room = self.rows.setdefault(room_id, {})
+        if room.get(datapoint) == row:
+            return False
+        room[datapoint] = row
+        self.dirty.setdefault(room_id, {})[datapoint] = row
+        return True
+
+    def load(self, rows: list[dict]):
+        for row in rows:
+            self.apply(row)
+        self.dirty = {}
+
+    def take_delta(self) -> dict:
+        delta, self.dirty = self.dirty, {}
+        if delta:
+            self.seq += 1
+        return delta
+
+
+class SubscriptionFilter:
+    """
+    Floors and/or room IDs a client watches; no filter means the whole property.
+    Floors are qualified IDs ("hotel:main:1"); a bare number is a floor of the
+    default building.
+    """
+
+    __slots__ = ("floors", "rooms", "key")
+
+    def __init__(self, floors=(), rooms=()):
+        self.floors = frozenset(floor_id(floor) for floor in floors)
+        self.rooms = frozenset(rooms)
+        self.key = (self.floors, self.rooms)
+
+    @classmethod
+    def parse(cls, params) -> "SubscriptionFilter":
+        """From ?floor=hotel:main:1,2&rooms=room101 query parameters or a {"floors": [...], "rooms": [...]} message."""
+        def values(name):
+            value = params.get(name) or ()
+            return [v for v in value.split(",") if v] if isinstance(value, str) else value
+        return cls(values("floor") or values("floors"), values("rooms"))
+
+    def matches(self, room_id: str) -> bool:
+        if not self.floors and not self.rooms:
+            return True
+        return room_id in self.rooms or get_registry().floor_of(room_id) in self.floors
+
+    def select(self, rooms: dict) -> dict:
+        if not self.floors and not self.rooms:
+            return rooms
+        return {room_id: rows for room_id, rows in rooms.items() if self.matches(room_id)}
+
+
+class Client:
+    """
+    One connected dashboard. Frames are pulled by the client's own writer, so a
+    slow client never holds up the others: deltas pushed while it is still
+    sending are merged into one pending delta (bounded by its room count).
+    """
+
+    __slots__ = ("filter", "snapshot", "pending", "encoded", "seq", "wake")
+
+    def __init__(self, subscription: SubscriptionFilter):
+        self.filter = subscription
+        self.snapshot = None  # encoded snapshot frame to send first
+        self.pending = {}
+        self.encoded = None   # shared encoding of `pending` while it is a single frame
+        self.seq = 0
+        self.wake = asyncio.Event()
+
+    def reset(self, snapshot: str):
+        self.snapshot, self.pending, self.encoded = snapshot, {}, None
+        self.wake.set()
+
+    def push(self, part: dict, encoded: str, seq: int):
+        if not self.pending:
+            self.pending, self.encoded = part, encoded
+        else:
+            merged = dict(self.pending)
+            for room_id, rows in part.items():
+                merged[room_id] = {**merged.get(room_id, {}), **rows}
+            self.pending, self.encoded = merged, None
+        self.seq = seq
+        self.wake.set()
+
+    def take(self) -> tuple[str, str] | None:
+        """Next (event, frame) to send, or None when up to date."""
+        if self.snapshot is not None:
+            frame, self.snapshot = self.snapshot, None
+            return "snapshot", frame
+        if self.pending:
+            frame = self.encoded or _encode("delta", self.pending, self.seq)
+            self.pending, self.encoded = {}, None
+            return "delta", frame
+        return None
+
+
+class PushGateway:
+    """
+    Pushes room_states to dashboards over WebSocket (/ws) or Server-Sent
+    Events (/events), replacing one Supabase realtime stream of the whole
+    property per browser. Changes are coalesced and sent at most max_fps times
+    a second; each frame is filtered and encoded once per distinct
+    subscription, not once per client.
+    """
+
+    def __init__(self):
+        self.store = RoomStateStore()
+        self.clients = set()
+
+    # -----------------------------
+    # Frames
+    # -----------------------------
+    def snapshot(self, subscription: SubscriptionFilter) -> str:
+        return _encode("snapshot", subscription.select(self.store.rows), self.store.seq)
+
+    def broadcast(self):
+        delta = self.store.take_delta()
+        if not delta:
+            return
+        groups = {}
+        for client in self.clients:
+            groups.setdefault(client.filter.key, (client.filter, []))[1].append(client)
+        for subscription, clients in groups.values():
+            part = subscription.select(delta)
+            if not part:
+                continue
+            encoded = _encode("delta", part, self.store.seq)
+            for client in clients:
+                client.push(part, encoded, self.store.seq)
+
+    async def run_broadcaster(self):
+        interval = 1.0 / PUSH_GATEWAY_CONFIG["max_fps"]
+        while True:
+            await asyncio.sleep(interval)
+            self.broadcast()
+
+    # -----------------------------
+    # Feed
+    # -----------------------------
+    async def handle_message(self, message: aio_pika.IncomingMessage):
+        try:
+            async with message.process(ignore_processed=True):
+                self.store.apply(json.loads(message.body))
+        except Exception as e:
+            logger.error(f"[PushGateway] ❌ Error processing message: {e}")
+
+    async def consume(self, tenant: str):
+        name = tenant_name("PushGateway", tenant)
+        # Every replica needs every update, so each one gets its own queues; they
+        # are server-named and go away with the connection, so a replaced pod
+        # does not leave a durable queue filling up behind it
+        async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant)) as rabbitmq:
+            await rabbitmq.subscribe(
+                EXCHANGES["fault_alerts"], None, "*.fault",
+                self.handle_message, lane="critical", exclusive=True
+            )
+            await rabbitmq.subscribe(
+                EXCHANGES["occupancy"], None, "*.occupancy",
+                self.handle_message, lane="telemetry", exclusive=True
+            )
+            logger.info(f"[{name}] 🟢 Feeding room states from {EXCHANGES['fault_alerts']} and {EXCHANGES['occupancy']}")
+            await asyncio.Future()  # run forever
+
+    async def load_room_states(self):
+        """
+        One room_states read for the gateway instead of a select('*') per browser,
+        paged so PostgREST's max-rows cap cannot cut the property short.
+        """
+        page_size = PUSH_GATEWAY_CONFIG["page_size"]
+        try:
+            rows = []
+            async with httpx.AsyncClient() as client:
+                while True:
+                    resp = await client.get(
+                        f"{SUPABASE_HTTP_CONFIG['url']}/rest/v1/room_states",
+                        headers={"apikey": SUPABASE_HTTP_CONFIG["key"],
+                                 "Authorization": f"Bearer {SUPABASE_HTTP_CONFIG['key']}"},
+                        params={"select": "room_id,datapoint,is_occupied,health_status",
+                                "order": "room_id,datapoint", "limit": page_size, "offset": len(rows)},
+                    )
+                    resp.raise_for_status()
+                    page = resp.json()
+                    rows.extend(page)
+                    if len(page) < page_size:
+                        break
+            self.store.load(rows)
+            logger.info(f"[PushGateway] ✅ Loaded {len(self.store.rows)} room(s) from room_states")
+        except Exception as e:
+            logger.warning(f"[PushGateway] ⚠️ Could not load room_states, starting empty: {e}")
+
+    # -----------------------------
+    # HTTP
+    # -----------------------------
+    async def serve(self, client: Client, send):
+        """Register the client and run its writer until the connection goes away."""
+        self.clients.add(client)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(client.wake.wait(), PUSH_GATEWAY_CONFIG["heartbeat"])
+                except asyncio.TimeoutError:
+                    await send(None, None)  # keep-alive
+                    continue
+                client.wake.clear()
+                while (frame := client.take()) is not None:
+                    await send(*frame)
+        finally:
+            self.clients.discard(client)
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        """GET /ws?floor=1&rooms=room101,room102; send {"floors": [...], "rooms": [...]} to change the filter."""
+        ws = web.WebSocketResponse(heartbeat=PUSH_GATEWAY_CONFIG["heartbeat"])
+        await ws.prepare(request)
+        client = Client(SubscriptionFilter.parse(request.query))
+        client.reset(self.snapshot(client.filter))
+
+        async def send(event, frame):
+            if frame is not None:  # aiohttp sends the WebSocket pings itself
+                await ws.send_str(frame)
+
+        writer = asyncio.create_task(self.serve(client, send))
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    client.filter = SubscriptionFilter.parse(json.loads(msg.data))
+                except Exception as e:
+                    await ws.send_str(json.dumps({"type": "error", "error": str(e)}))
+                    continue
+                client.reset(self.snapshot(client.filter))
+        finally:
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+        return ws
+
+    async def handle_sse(self, request: web.Request) -> web.StreamResponse:
+        """GET /events?floor=1&rooms=room101 as text/event-stream (snapshot, then delta events)."""
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await response.prepare(request)
+        client = Client(SubscriptionFilter.parse(request.query))
+        client.reset(self.snapshot(client.filter))
+
+        async def send(event, frame):
+            text = f"event: {event}\ndata: {frame}\n\n" if frame is not None else ": ping\n\n"
+            await response.write(text.encode())
+
+        try:
+            await self.serve(client, send)
+        except ConnectionResetError:
+            pass  # browser went away; noticed on the next frame or keep-alive
+        return response
+
+    async def handle_snapshot(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.snapshot(SubscriptionFilter.parse(request.query)),
+                            content_type="application/json")
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_get("/events", self.handle_sse)
+        app.router.add_get("/snapshot", self.handle_snapshot)
+        return app
+
+
+async def main():
+    setup_tracing("PushGateway")
+    gateway = PushGateway()
+    if PUSH_GATEWAY_CONFIG["load_room_states"]:
+        await gateway.load_room_states()
+
+    runner = web.AppRunner(gateway.app())
+    await runner.setup()
+    await web.TCPSite(runner, PUSH_GATEWAY_CONFIG["host"], PUSH_GATEWAY_CONFIG["port"]).start()
+    logger.info(f"[PushGateway] 🌐 Serving /ws, /events and /snapshot on port {PUSH_GATEWAY_CONFIG['port']}")
+
+    broadcaster = asyncio.create_task(gateway.run_broadcaster())
+    try:
+        await run_for_tenants("PushGateway", gateway.consume)
+    finally:
+        broadcaster.cancel()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("[PushGateway] 🔴 Stopped by user.")
@@ -0,0 +1,270 @@
+# query_service.py
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import aio_pika
+import psycopg2
+from config import TIMESCALE_CONFIG, QUERY_CACHE_CONFIG, EXCHANGES, SENSOR_DATAPOINTS
+from time_service import clock
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("QueryService")
+
+# Continuous aggregates created in init_timescale.sql, by bucket name
+AGGREGATES = {
+    "1m": ("raw_data_1m", timedelta(minutes=1)),
+    "1h": ("raw_data_1h", timedelta(hours=1)),
+}
+
+NUMERIC_DATAPOINTS = {"temperature", "humidity", "co2", "power_kw_power_meter", "sensitivity"}
+
+
+def _aware(value: datetime) -> datetime:
+    """Naive window bounds are property-local time (TIMEZONE), like the simulator's readings."""
+    return clock.tz.localize(value) if value.tzinfo is None else value
+
+
+class WindowCache:
+    """
+    LRU cache of query windows with per-entry expiry.
+    Windows that end in the past can live long; windows still open at "now"
+    get a short TTL and are dropped as soon as new readings for their room
+    arrive. A room -> keys index makes that invalidation O(entries of room).
+    """
+
+    def __init__(self, max_entries: int, ttl_open: float, ttl_closed: float):
+        self.max_entries = max_entries
+        self.ttl_open = ttl_open
+        self.ttl_closed = ttl_closed
+        self.entries = OrderedDict()  # { key: (expires_at, is_open, value) }
+        self.by_room = {}             # { room_id: {key, ...} }
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, room_id: str, value, is_open: bool):
+        ttl = self.ttl_open if is_open else self.ttl_closed
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, is_open, value)
+            self.entries.move_to_end(key)
+            self.by_room.setdefault(room_id, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                self.by_room.get(old_key[1], set()).discard(old_key)
+
+    def invalidate_room(self, room_id: str, datapoints=None):
+        """Drop the room's open windows (optionally only for some datapoints)."""
+        with self.lock:
+            for key in list(self.by_room.get(room_id, ())):
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.by_room[room_id].discard(key)
+                elif entry[1] and (datapoints is None or key[2] in datapoints):
+                    del self.entries[key]
+                    self.by_room[room_id].discard(key)
+
+
+class SensorQueryService:
+    """
+    Windowed history and downsampled series for one or many rooms.
+    Series come from the raw_data_1m / raw_data_1h continuous aggregates when
+    they exist, otherwise from time_bucket() over raw_data. Results are cached
+    per room and window. Cache keys are (kind, room_id, datapoint, start, end, bucket).
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.aggregates = None  # views present in the database, checked once
+        self.cache = WindowCache(
+            QUERY_CACHE_CONFIG["max_entries"], QUERY_CACHE_CONFIG["ttl_open"], QUERY_CACHE_CONFIG["ttl_closed"]
+        )
+        self.db_lock = threading.Lock()
+
+    def connect(self):
+        self.conn = psycopg2.connect(
+            host=TIMESCALE_CONFIG["host"],
+            port=TIMESCALE_CONFIG["port"],
+            user=TIMESCALE_CONFIG["user"],
+            password=TIMESCALE_CONFIG["password"],
+            dbname=TIMESCALE_CONFIG["dbname"],
+        )
+        self.conn.set_session(readonly=True, autocommit=True)
+        logger.info("[QueryService] ✅ Connected to TimescaleDB")
+
+    def _fetch(self, sql: str, params: tuple) -> list[tuple]:
+        with self.db_lock:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            with self.conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def _aggregate_view(self, bucket: str) -> str | None:
+        if self.aggregates is None:
+            rows = self._fetch(
+                "SELECT view_name FROM timescaledb_information.continuous_aggregates WHERE view_name = ANY(%s)",
+                ([view for view, _ in AGGREGATES.values()],)
+            )
+            self.aggregates = {row[0] for row in rows}
+            logger.info(f"[QueryService] Continuous aggregates available: {sorted(self.aggregates) or 'none'}")
+        view = AGGREGATES[bucket][0]
+        return view if view in self.aggregates else None
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def history(self, room_id: str, datapoint: str, start: datetime, end: datetime) -> list[dict]:
+        """Raw readings of one datapoint for one room, oldest first."""
+        start, end = _aware(start), _aware(end)
+        key = ("history", room_id, datapoint, start, end, None)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        rows = self._fetch("""
+            SELECT datetime, value FROM raw_data
+            WHERE device_id = %s AND datapoint = %s AND datetime >= %s AND datetime < %s
+            ORDER BY datetime
+        """, (room_id, datapoint, start, end))
+        numeric = datapoint in NUMERIC_DATAPOINTS
+        points = [
+            {"datetime": dt, "value": float(value) if numeric and value != "null" else value}
+            for dt, value in rows
+        ]
+        self.cache.put(key, room_id, points, is_open=end > datetime.now(timezone.utc))
+        return points
+
+    def series(self, room_ids: list[str], datapoint: str, start: datetime, end: datetime,
+               bucket: str = "1m") -> dict[str, list[dict]]:
+        """Downsampled avg/min/max per bucket for many rooms; cached rooms are not queried again."""
+        start, end = _aware(start), _aware(end)
+        result, missing = {}, []
+        for room_id in room_ids:
+            cached = self.cache.get(("series", room_id, datapoint, start, end, bucket))
+            if cached is None:
+                missing.append(room_id)
+            else:
+                result[room_id] = cached
+        if not missing:
+            return result
+
+        view = self._aggregate_view(bucket)
+        if view:
+            sql = f"""
+                SELECT device_id, bucket, avg_value, min_value, max_value FROM {view}
+                WHERE device_id = ANY(%s) AND datapoint = %s AND bucket >= %s AND bucket < %s
+                ORDER BY device_id, bucket
+            """
+            params = (missing, datapoint, start, end)
+        else:
+            sql = """
+                SELECT device_id, time_bucket(%s, datetime) AS bucket,
+                       avg(NULLIF(value, 'null')::DOUBLE PRECISION),
+                       min(NULLIF(value, 'null')::DOUBLE PRECISION),
+                       max(NULLIF(value, 'null')::DOUBLE PRECISION)
+                FROM raw_data
+                WHERE device_id = ANY(%s) AND datapoint = %s AND datetime >= %s AND datetime < %s
+                GROUP BY device_id, bucket
+                ORDER BY device_id, bucket
+            """
+            params = (AGGREGATES[bucket][1], missing, datapoint, start, end)
+
+        fetched = {room_id: [] for room_id in missing}
+        for room_id, bucket_start, avg, low, high in self._fetch(sql, params):
+            fetched[room_id].append({"bucket": bucket_start, "avg": avg, "min": low, "max": high})
+
+        is_open = end > datetime.now(timezone.utc) - AGGREGATES[bucket][1]
+        for room_id, points in fetched.items():
+            self.cache.put(("series", room_id, datapoint, start, end, bucket), room_id, points, is_open)
+        result.update(fetched)
+        return result
+
+    def last(self, room_ids: list[str], datapoint: str, window: timedelta = timedelta(hours=1),
+             bucket: str = "1m") -> dict[str, list[dict]]:
+        """
+        Series for the trailing window, e.g. the last hour of CO₂.
+        The window is aligned to bucket boundaries so repeated calls within
+        one bucket hit the same cache entries.
+        """
+        step = AGGREGATES[bucket][1]
+        now = datetime.now(timezone.utc)
+        end = datetime.fromtimestamp((now.timestamp() // step.total_seconds() + 1) * step.total_seconds(), timezone.utc)
+        return self.series(room_ids, datapoint, end - window, end, bucket)
+
+    def energy_kwh(self, room_ids: list[str], start: datetime, end: datetime) -> dict[str, float]:
+        """Approximate energy use from per-minute average power (kW x 1/60 h per bucket)."""
+        series = self.series(room_ids, "power_kw_power_meter", start, end, bucket="1m")
+        return {
+            room_id: round(sum(point["avg"] or 0.0 for point in points) / 60, 3)
+            for room_id, points in series.items()
+        }
+
+    def energy_today(self, room_ids: list[str], tz: timezone = None) -> dict[str, float]:
+        """Energy since local midnight, in the property's TIMEZONE unless `tz` is given."""
+        if tz is None:
+            now_s = clock.now_s()
+            midnight = datetime.fromtimestamp(clock.local_day_start(now_s), timezone.utc)
+            return self.energy_kwh(room_ids, midnight, datetime.fromtimestamp(now_s, timezone.utc))
+        now = datetime.now(tz)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.energy_kwh(room_ids, midnight, now)
+
+    # -----------------------------
+    # Cache invalidation from the ingestion stream
+    # -----------------------------
+    def invalidate(self, room_id: str, sensor_type: str = None):
+        self.cache.invalidate_room(room_id, SENSOR_DATAPOINTS.get(sensor_type))
+
+    async def handle_ingestion(self, message: aio_pika.IncomingMessage):
+        async with message.process(ignore_processed=True):
+            room_id, _, sensor_type = message.routing_key.rpartition(".")
+            self.invalidate(room_id, sensor_type)
+
+    async def follow_ingestion(self, rabbitmq):
+        """Drop cached open windows of a room whenever new sensor data for it is published."""
+        await rabbitmq.subscribe(
+            EXCHANGES["sensor_data"], "query_service_invalidation_queue", "#",
+            self.handle_ingestion, lane="telemetry"
+        )
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+            logger.info("[QueryService] 🛑 TimescaleDB connection closed")
+
+
+# Optional: For testing
+if __name__ == "__main__":
+    from config import ROOM_IDS
+    from rabbitmq_management import AsyncRabbitMQManager
+
+    async def main():
+        service = SensorQueryService()
+        async with AsyncRabbitMQManager("QueryService") as rabbitmq:
+            await service.follow_ingestion(rabbitmq)
+            try:
+                while True:
+                    co2 = await asyncio.to_thread(service.last, ROOM_IDS, "co2")
+                    energy = await asyncio.to_thread(service.energy_today, ROOM_IDS)
+                    for room_id in ROOM_IDS:
+                        logger.info(f"[QueryService] {room_id}: {len(co2[room_id])} CO₂ buckets, "
+                                    f"{energy[room_id]} kWh today | cache hits={service.cache.hits} misses={service.cache.misses}")
+                    await asyncio.sleep(10)
+            finally:
+                service.close()
+
+    asyncio.run(main())
@@ -1,10 +1,18 @@
 # rabbitmq_management.py
 
-import pika
+import asyncio
+import aio_pika
 import json
 import logging
+import time
+from collections import deque
 from typing import Callable
-from config import RABBITMQ_CONFIG
+from aio_pika.pool import Pool
+from config import RABBITMQ_CONFIG, EXCHANGES, QUEUE_LANES, DEAD_LETTER_QUEUES
+from startup import lazy_import
+from tracing import tracer, traced_consumer
+
+pika = lazy_import("pika")  # only the blocking RabbitMQManager needs it
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -81,6 +89,195 @@ class RabbitMQManager:
             self.connection.close()
             logger.info("RabbitMQ connection closed")
 
+
+class AsyncRabbitMQManager:
+    """
+    asyncio counterpart of RabbitMQManager, built on aio_pika.
+    One robust connection shared by a pool of publisher-confirm channels and
+    one consumer channel per traffic lane (see QUEUE_LANES). Exchanges are
+    declared once per process, failed publishes are buffered (later ones queue
+    behind them) and retried after reconnect or every retry_interval, and the
+    robust consumer channels restore queues, bindings and consumers by themselves.
+    """
+
+    def __init__(self, name: str = "RabbitMQ", vhost: str = None, prefetch_cap: int = None):
+        self.name = name
+        self.vhost = vhost or RABBITMQ_CONFIG["vhost"]
+        self.prefetch_cap = prefetch_cap  # per-tenant ceiling on every lane's prefetch
+        self.connection = None
+        self.consumer_channel = None
+        self.lane_channels = {}       # { lane: channel }
+        self.channel_pool = None
+        self.declared_exchanges = {}  # { exchange_name: exchange_type }
+        self.subscriptions = []       # [(exchange, queue, routing_key)]
+        self.dead_letters_ready = set()  # dead-letter exchanges declared with their queue
+        self.retry_buffer = deque(maxlen=RABBITMQ_CONFIG["publish_buffer_size"])
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None        # background retry of retry_buffer, kept so it isn't collected
+        self.last_flush = 0.0         # monotonic time the last background retry started
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(
+            host=RABBITMQ_CONFIG["host"],
+            port=RABBITMQ_CONFIG["port"],
+            login=RABBITMQ_CONFIG["user"],
+            password=RABBITMQ_CONFIG["password"],
+            virtualhost=self.vhost
+        )
+        self.connection.reconnect_callbacks.add(self._on_reconnect)
+        self.consumer_channel = await self.connection.channel()
+        self.channel_pool = Pool(self._open_channel, max_size=RABBITMQ_CONFIG["channel_pool_size"])
+        logger.info(f"[{self.name}] Connected to RabbitMQ")
+
+    async def _open_channel(self) -> aio_pika.abc.AbstractChannel:
+        return await self.connection.channel(publisher_confirms=True)
+
+    def _on_reconnect(self, *args):
+        logger.warning(f"[{self.name}] Reconnected to RabbitMQ, {len(self.subscriptions)} subscription(s) restored")
+        self._schedule_flush(force=True)
+
+    def _schedule_flush(self, force: bool = False):
+        """Retry the buffer in the background, at most once per retry_interval unless forced."""
+        if not self.retry_buffer or (self.flush_task is not None and not self.flush_task.done()):
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < RABBITMQ_CONFIG["retry_interval"]:
+            return
+        self.last_flush = now
+        self.flush_task = asyncio.create_task(self.flush_retry_buffer())
+
+    async def declare_exchange(self, name: str, exchange_type: aio_pika.ExchangeType = aio_pika.ExchangeType.TOPIC,
+                               channel: aio_pika.abc.AbstractChannel = None) -> aio_pika.abc.AbstractExchange:
+        channel = channel or self.consumer_channel
+        if name in self.declared_exchanges:
+            return await channel.get_exchange(name, ensure=False)
+        exchange = await channel.declare_exchange(name, exchange_type, durable=True)
+        self.declared_exchanges[name] = exchange_type
+        return exchange
+
+    async def get_lane_channel(self, lane: str = None) -> aio_pika.abc.AbstractChannel:
+        if lane is None:
+            return self.consumer_channel
+        if lane not in self.lane_channels:
+            channel = await self.connection.channel()
+            prefetch = QUEUE_LANES[lane]["prefetch"]
+            await channel.set_qos(prefetch_count=min(prefetch, self.prefetch_cap or prefetch))
+            self.lane_channels[lane] = channel
+        return self.lane_channels[lane]
+
+    async def ensure_dead_letter(self, exchange_name: str = EXCHANGES["dead_letter"]):
+        if exchange_name in self.dead_letters_ready:
+            return
+        queue_name, arguments = DEAD_LETTER_QUEUES[exchange_name]
+        exchange = await self.declare_exchange(exchange_name)
+        queue = await self.consumer_channel.declare_queue(queue_name, durable=True, arguments=arguments)
+        await queue.bind(exchange, routing_key="#")
+        self.dead_letters_ready.add(exchange_name)
+
+    async def _publish(self, exchange_name: str, routing_key: str, body: bytes, properties: dict):
+        async with self.channel_pool.acquire() as channel:
+            if exchange_name:
+                exchange = await self.declare_exchange(exchange_name, channel=channel)
+            else:
+                exchange = channel.default_exchange
+            await exchange.publish(aio_pika.Message(body=body, **properties), routing_key=routing_key)
+
+    async def publish(self, exchange: str, routing_key: str, message: dict, **properties) -> bool:
+        """Publish and wait for the broker confirm. Failed messages are buffered for retry unless retry=False."""
+        return await self.publish_body(exchange, routing_key, json.dumps(message).encode(), **properties)
+
+    async def publish_body(self, exchange: str, routing_key: str, body: bytes, retry: bool = True, **properties) -> bool:
+        # Starts the trace when nothing upstream did (the publisher); consumers continue it
+        with tracer.span("publish", exchange=exchange, routing_key=routing_key) as span:
+            headers = tracer.headers(properties.get("headers"))
+            if headers:
+                properties["headers"] = headers
+            if retry and self.retry_buffer:
+                # Queue behind the buffered messages so they keep their order; the reconnect
+                # hook flushes them, or a rate-limited background retry while it hasn't fired
+                self._buffer(exchange, routing_key, body, properties)
+                self._schedule_flush()
+                if span is not None:
+                    span.set(buffered=True)
+                return False
+            try:
+                await self._publish(exchange, routing_key, body, properties)
+                logger.debug(f"[{self.name}] Published to {exchange}.{routing_key}: {body}")
+                return True
+            except Exception as e:
+                if not retry:
+                    logger.warning(f"[{self.name}] Publish to {exchange}.{routing_key} failed: {e}")
+                    return False
+                self._buffer(exchange, routing_key, body, properties)
+                logger.error(f"[{self.name}] Publish to {exchange}.{routing_key} failed, buffered for retry: {e}")
+                if span is not None:
+                    span.set(buffered=True)
+                return False
+
+    def _buffer(self, exchange: str, routing_key: str, body: bytes, properties: dict):
+        if len(self.retry_buffer) == self.retry_buffer.maxlen:
+            logger.error(f"[{self.name}] Retry buffer full, dropping oldest buffered message")
+        self.retry_buffer.append((exchange, routing_key, body, properties))
+
+    def backpressure(self) -> float:
+        """Fill ratio of the publish retry buffer (0.0 - 1.0)."""
+        return len(self.retry_buffer) / self.retry_buffer.maxlen
+
+    async def flush_retry_buffer(self):
+        async with self.flush_lock:
+            while self.retry_buffer:
+                exchange, routing_key, body, properties = self.retry_buffer[0]
+                try:
+                    await self._publish(exchange, routing_key, body, properties)
+                except Exception as e:
+                    logger.warning(f"[{self.name}] Retry of buffered messages deferred: {e}")
+                    return
+                self.retry_buffer.popleft()
+            logger.info(f"[{self.name}] Retry buffer drained")
+
+    async def subscribe(self, exchange: str, queue_name: str | None, routing_key: str, callback: Callable,
+                        exchange_type: aio_pika.ExchangeType = aio_pika.ExchangeType.TOPIC,
+                        lane: str = None, exclusive: bool = False) -> aio_pika.abc.AbstractQueue:
+        """
+        Bind `queue_name` to the exchange and consume it. With exclusive=True the
+        queue is server-named, private to this connection and deleted with it
+        (queue_name is ignored): a per-process copy of the stream that leaves
+        nothing behind on the broker, and is not dead-lettered.
+        """
+        arguments = QUEUE_LANES[lane]["arguments"] if lane else None
+        if exclusive and arguments:
+            arguments = {k: v for k, v in arguments.items() if k != "x-dead-letter-exchange"}
+        if arguments and "x-dead-letter-exchange" in arguments:
+            await self.ensure_dead_letter(arguments["x-dead-letter-exchange"])
+
+        channel = await self.get_lane_channel(lane)
+        source_exchange = await self.declare_exchange(exchange, exchange_type, channel=channel)
+        if exclusive:
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True, arguments=arguments)
+        else:
+            queue = await channel.declare_queue(queue_name, durable=True, arguments=arguments)
+        await queue.bind(source_exchange, routing_key=routing_key)
+        await queue.consume(traced_consumer(callback, queue=queue.name))
+        self.subscriptions.append((exchange, queue.name, routing_key))
+        logger.info(f"[{self.name}] Subscribed to {exchange}.{routing_key}" + (f" on lane '{lane}'" if lane else ""))
+        return queue
+
+    async def close(self):
+        if self.retry_buffer:
+            await self.flush_retry_buffer()
+        if self.channel_pool:
+            await self.channel_pool.close()
+        if self.connection and not self.connection.is_closed:
+            await self.connection.close()
+            logger.info(f"[{self.name}] RabbitMQ connection closed")
+
 # Test the connection and queue creation
 # This part is for testing the connection and queue creation
 if __name__ == "__main__":
@@ -0,0 +1,299 @@
+# room_registry.py
+
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from config import ROOM_IDS, ROOM_REGISTRY_CONFIG, TIMESCALE_CONFIG, get_floor
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("floor", "building", "property")
+
+
+def group_id(property: str, building: str = None, floor: str = None) -> str:
+    """
+    Group ID qualified by its ancestors: "hotel", "hotel:main", "hotel:main:1".
+    Floor and building numbers repeat across buildings and properties, so a
+    bare "1" would merge every first floor into one group.
+    """
+    return ":".join(str(part) for part in (property, building, floor) if part is not None)
+
+
+def floor_id(floor: str) -> str:
+    """A floor as given by a client: qualified IDs pass through, a bare floor number is in the default building."""
+    if ":" in str(floor):
+        return str(floor)
+    defaults = ROOM_REGISTRY_CONFIG["defaults"]
+    return group_id(defaults["property"], defaults["building"], floor)
+
+
+class Room:
+    __slots__ = ("room_id", "floor", "building", "property", "meta")
+
+    def __init__(self, room_id: str, floor: str, building: str, property: str, meta: dict = None):
+        self.room_id = room_id
+        self.floor = floor
+        self.building = building
+        self.property = property
+        self.meta = meta or {}
+
+    def group(self, level: str) -> str:
+        if level == "floor":
+            return group_id(self.property, self.building, self.floor)
+        if level == "building":
+            return group_id(self.property, self.building)
+        return self.property
+
+    def as_dict(self) -> dict:
+        return {"room_id": self.room_id, "floor": self.floor, "building": self.building,
+                "property": self.property, **self.meta}
+
+
+class RegistrySnapshot:
+    """Immutable view of the hierarchy with every group index precomputed."""
+
+    def __init__(self, rooms: list[Room]):
+        self.rooms = {room.room_id: room for room in rooms}
+        self.room_ids = [room.room_id for room in rooms]
+        groups = {level: defaultdict(list) for level in LEVELS}
+        for room in rooms:
+            for level in LEVELS:
+                groups[level][room.group(level)].append(room.room_id)
+        # { level: { group_id: (room_id, ...) } }
+        self.groups = {level: {key: tuple(ids) for key, ids in members.items()} for level, members in groups.items()}
+
+
+class RoomRegistry:
+    """
+    property -> building -> floor -> room metadata, loaded from a JSON file or
+    the `rooms` table and reloaded when it changes. Lookups read the current
+    snapshot (a single attribute read), so they are O(1) and safe while a
+    reload swaps in a new one. Floor and building groups are keyed by their
+    qualified IDs (see group_id), so "1" may be reused in every building.
+    Without a file or table the registry is built from ROOM_IDS / get_floor().
+    """
+
+    def __init__(self, source: str = None, path: str = None):
+        self.source = source or ROOM_REGISTRY_CONFIG["source"]
+        self.path = path or ROOM_REGISTRY_CONFIG["path"]
+        self.signature = None  # file mtime or table contents of the loaded snapshot
+        self.listeners = []    # callables(added, removed, snapshot)
+        self.lock = threading.Lock()
+        self.snapshot = RegistrySnapshot([])
+        self.reload()
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def _load_file(self):
+        if not os.path.exists(self.path):
+            return None, None
+        signature = os.path.getmtime(self.path)
+        if signature == self.signature:
+            return None, signature
+        with open(self.path) as f:
+            return json.load(f), signature
+
+    def _load_table(self):
+        import psycopg2  # only needed for the table source
+
+        conn = psycopg2.connect(
+            host=TIMESCALE_CONFIG["host"],
+            port=TIMESCALE_CONFIG["port"],
+            user=TIMESCALE_CONFIG["user"],
+            password=TIMESCALE_CONFIG["password"],
+            dbname=TIMESCALE_CONFIG["dbname"],
+        )
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT room_id, floor_id, building_id, property_id, metadata
+                    FROM rooms ORDER BY room_id
+                """)
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+        entries = [{"room_id": r, "floor": f, "building": b, "property": p, **(meta or {})}
+                   for r, f, b, p, meta in rows]
+        signature = json.dumps(entries, sort_keys=True, default=str)
+        return (None if signature == self.signature else entries), signature
+
+    @staticmethod
+    def _fallback_entries() -> list[dict]:
+        return [{"room_id": room_id, "floor": get_floor(room_id)} for room_id in ROOM_IDS]
+
+    def reload(self) -> bool:
+        """Re-read the source; returns True when a new snapshot was installed."""
+        with self.lock:
+            try:
+                entries, signature = self._load_table() if self.source == "table" else self._load_file()
+            except Exception as e:
+                logger.error(f"[RoomRegistry] ❌ Failed to load rooms from {self.source}, keeping current registry: {e}")
+                return False
+
+            if entries is None:
+                if signature is not None or self.snapshot.room_ids:
+                    return False
+                entries, signature = self._fallback_entries(), "fallback"
+
+            defaults = ROOM_REGISTRY_CONFIG["defaults"]
+            rooms = []
+            for entry in entries:
+                entry = dict(entry)
+                room_id = entry.pop("room_id")
+                rooms.append(Room(
+                    room_id,
+                    str(entry.pop("floor", None) or get_floor(room_id)),
+                    str(entry.pop("building", None) or defaults["building"]),
+                    str(entry.pop("property", None) or defaults["property"]),
+                    entry,
+                ))
+
+            # Room IDs key every per-room structure across all tenants, so they must be unique
+            seen, duplicates = set(), set()
+            for room in rooms:
+                (duplicates if room.room_id in seen else seen).add(room.room_id)
+            if duplicates:
+                logger.error(f"[RoomRegistry] ❌ Room IDs used more than once, keeping current registry: {sorted(duplicates)}")
+                return False
+
+            previous, snapshot = self.snapshot, RegistrySnapshot(rooms)
+            self.snapshot, self.signature = snapshot, signature
+
+        added = [room_id for room_id in snapshot.room_ids if room_id not in previous.rooms]
+        removed = [room_id for room_id in previous.room_ids if room_id not in snapshot.rooms]
+        logger.info(f"[RoomRegistry] 🏨 Loaded {len(snapshot.room_ids)} room(s) in "
+                    f"{len(snapshot.groups['floor'])} floor(s), {len(snapshot.groups['building'])} building(s)")
+        for listener in self.listeners:
+            try:
+                listener(added, removed, snapshot)
+            except Exception as e:
+                logger.error(f"[RoomRegistry] ❌ Reload listener failed: {e}")
+        return True
+
+    def on_change(self, listener):
+        self.listeners.append(listener)
+
+    def start_watching(self, interval: float = None) -> threading.Thread:
+        """Poll the source on a daemon thread and hot-reload on change."""
+        interval = interval or ROOM_REGISTRY_CONFIG["reload_interval"]
+        stop = threading.Event()
+
+        def poll():
+            while not stop.wait(interval):
+                self.reload()
+
+        thread = threading.Thread(target=poll, name="room-registry-reload", daemon=True)
+        thread.stop = stop
+        thread.start()
+        return thread
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    @property
+    def room_ids(self) -> list[str]:
+        return self.snapshot.room_ids
+
+    def get(self, room_id: str) -> Room | None:
+        return self.snapshot.rooms.get(room_id)
+
+    def floor_of(self, room_id: str) -> str:
+        """Qualified floor ID ("hotel:main:1") of the room."""
+        room = self.snapshot.rooms.get(room_id)
+        return room.group("floor") if room else floor_id(get_floor(room_id))
+
+    def group_of(self, room_id: str, level: str) -> str | None:
+        room = self.snapshot.rooms.get(room_id)
+        return room.group(level) if room else None
+
+    def rooms_in(self, level: str, group_id: str) -> tuple[str, ...]:
+        return self.snapshot.groups[level].get(group_id, ())
+
+    def groups(self, level: str) -> dict[str, tuple[str, ...]]:
+        return self.snapshot.groups[level]
+
+
+class HierarchyAggregator:
+    """
+    Floor / building / property summaries kept up to date as room readings
+    arrive. Each room remembers its last CO₂, occupancy and power; an update
+    applies only the difference to the room's ancestors, so a reading costs
+    O(levels) and a summary read is O(1). Rebuilt from the room values when
+    the registry is reloaded.
+    """
+
+    # per group: [co2_sum, co2_rooms, occupied_rooms, known_occupancy, power_kw_sum, power_rooms]
+    FIELDS = 6
+
+    def __init__(self, registry: RoomRegistry):
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.rooms = {}   # { room_id: [co2, is_occupied, power_kw] } (None = no reading yet)
+        self.groups = {}  # { (level, group_id): [..FIELDS..] }
+        registry.on_change(lambda added, removed, snapshot: self.rebuild())
+
+    @staticmethod
+    def _contribution(values) -> list[float]:
+        co2, occupied, power = values
+        return [
+            co2 or 0.0, 1 if co2 is not None else 0,
+            1 if occupied else 0, 1 if occupied is not None else 0,
+            power or 0.0, 1 if power is not None else 0,
+        ]
+
+    def _apply(self, room_id: str, delta: list[float]):
+        room = self.registry.get(room_id)
+        if room is None:
+            return
+        for level in LEVELS:
+            totals = self.groups.setdefault((level, room.group(level)), [0.0] * self.FIELDS)
+            for i, d in enumerate(delta):
+                totals[i] += d
+
+    def update(self, room_id: str, co2: float = None, is_occupied: bool = None, power_kw: float = None):
+        """Record the room's latest values; arguments left as None keep the previous value."""
+        with self.lock:
+            old = self.rooms.get(room_id, [None, None, None])
+            new = [co2 if co2 is not None else old[0],
+                   is_occupied if is_occupied is not None else old[1],
+                   power_kw if power_kw is not None else old[2]]
+            if new == old:
+                return
+            self.rooms[room_id] = new
+            self._apply(room_id, [n - o for n, o in zip(self._contribution(new), self._contribution(old))])
+
+    def rebuild(self):
+        with self.lock:
+            self.groups = {}
+            for room_id, values in self.rooms.items():
+                self._apply(room_id, self._contribution(values))
+
+    def summary(self, level: str, group_id: str) -> dict:
+        with self.lock:
+            co2_sum, co2_rooms, occupied, known, power, power_rooms = self.groups.get((level, group_id), [0] * self.FIELDS)
+        return {
+            "level": level,
+            "id": group_id,
+            "rooms": len(self.registry.rooms_in(level, group_id)),
+            "co2_avg": round(co2_sum / co2_rooms, 1) if co2_rooms else None,
+            "occupied_rooms": int(occupied),
+            "occupancy_rate": round(occupied / known, 3) if known else None,
+            "power_kw": round(power, 3) if power_rooms else None,
+        }
+
+    def summaries(self, level: str) -> dict[str, dict]:
+        return {group_id: self.summary(level, group_id) for group_id in self.registry.groups(level)}
+
+
+_registry = None
+
+
+def get_registry() -> RoomRegistry:
+    """Process-wide registry, loaded on first use."""
+    global _registry
+    if _registry is None:
+        _registry = RoomRegistry()
+    return _registry
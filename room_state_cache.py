@@ -0,0 +1,82 @@
+# room_state_cache.py
+
+import logging
+from time_service import clock
+
+logger = logging.getLogger(__name__)
+
+
+class RoomStateCache:
+    """
+    Write-behind cache for `room_states` upserts.
+    Keyed by (room_id, datapoint); keeps only the latest pending value per key,
+    drops updates that would not change is_occupied/health_status and hands out
+    dirty entries in batches for a single bulk upsert.
+    """
+
+    def __init__(self, max_batch: int = 500, high_water: int = 5000):
+        self.max_batch = max_batch
+        self.high_water = high_water
+        self.committed = {}  # { (room_id, datapoint): (is_occupied, health_status) }
+        self.in_flight = {}  # drained but not yet confirmed, same shape as committed
+        self.pending = {}    # { (room_id, datapoint): payload }
+        self.dropped = 0
+
+    def stage(self, room_id: str, is_occupied: bool, datapoint: str, health_status: str = "healthy") -> bool:
+        """Queue an update. Returns False when it is a no-op and was dropped."""
+        key = (room_id, datapoint)
+        state = (is_occupied, health_status)
+        # Compare against the last value sent: while a flush is in flight the
+        # database may end up with that value rather than the committed one
+        last_sent = self.in_flight.get(key, self.committed.get(key))
+
+        if key not in self.pending and last_sent == state:
+            self.dropped += 1
+            return False
+
+        if key in self.pending and last_sent == state:
+            # A pending change was reverted before it was flushed
+            del self.pending[key]
+            self.dropped += 1
+            return False
+
+        now = clock.isoformat(clock.now_s())
+        self.pending[key] = {
+            "room_id": room_id,
+            "is_occupied": is_occupied,
+            "vacancy_last_updated": now,
+            "datapoint": datapoint,
+            "health_status": health_status,
+            "datapoint_last_updated": now
+        }
+        return True
+
+    def __len__(self):
+        return len(self.pending)
+
+    def backpressure(self) -> float:
+        """Fill ratio of the pending set against its high-water mark (0.0 - 1.0)."""
+        return min(1.0, len(self.pending) / self.high_water)
+
+    def drain(self) -> list[dict]:
+        """Take up to max_batch dirty entries out of the cache."""
+        batch = []
+        for key in list(self.pending)[:self.max_batch]:
+            payload = self.pending.pop(key)
+            self.in_flight[key] = (payload["is_occupied"], payload["health_status"])
+            batch.append(payload)
+        return batch
+
+    def mark_flushed(self, batch: list[dict]):
+        for payload in batch:
+            key = (payload["room_id"], payload["datapoint"])
+            self.committed[key] = (payload["is_occupied"], payload["health_status"])
+            self.in_flight.pop(key, None)
+
+    def restore(self, batch: list[dict]):
+        """Put a failed batch back, unless a newer value was staged meanwhile."""
+        for payload in batch:
+            key = (payload["room_id"], payload["datapoint"])
+            self.in_flight.pop(key, None)
+            self.pending.setdefault(key, payload)
+        logger.warning(f"⏪ Re-queued {len(batch)} room state(s) after failed flush")
@@ -1,64 +1,64 @@
 import asyncio
 import logging
-import pytz
-from datetime import datetime
-import aio_pika
-import json
+import uuid
 
-from config import ROOM_IDS, get_routing_key, EXCHANGES, RABBITMQ_CONFIG
+from config import get_routing_key, EXCHANGES
 from sensors_simulator import SensorSimulator
+from rabbitmq_management import AsyncRabbitMQManager
+from flow_control import PublishFlowController
+from tenancy import run_for_tenants, tenant_name, tenant_rooms, tenant_vhost
+from time_service import clock
+from tracing import setup_tracing
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class AsyncSensorPublisher:
-    def __init__(self, room_id, exchange):
+    def __init__(self, room_id, flow: PublishFlowController):
         self.room_id = room_id
         self.simulator = SensorSimulator(room_id)
-        self.exchange = exchange
+        self.flow = flow
 
-    def _get_time(self):
-        now = datetime.now(pytz.timezone("Asia/Bangkok"))
-        return int(now.timestamp()), now.isoformat()
+    def _payload(self, data):
+        """Wrap a reading with a producer-assigned message ID and timestamp so consumers can dedup redeliveries."""
+        return {
+            "room_id": self.room_id,
+            "message_id": uuid.uuid4().hex,
+            "timestamp": clock.now_s(),
+            "data": data
+        }
 
     async def publish(self, routing_key, payload):
-        try:
-            await self.exchange.publish(
-                aio_pika.Message(body=json.dumps(payload).encode()),
-                routing_key=routing_key
-            )
-            logger.info(f"[Publisher] [{self.room_id}] Published to '{routing_key}': {payload['data']}")
-        except Exception as e:
-            logger.error(f"[Publisher] [{self.room_id}] Failed to publish to '{routing_key}': {e}")
+        """Hand the reading to flow control; it is buffered, not lost, while the broker is blocked or away."""
+        sensor_type = routing_key.rsplit(".", 1)[-1]
+        if not self.flow.submit(self.room_id, sensor_type, routing_key, payload):
+            logger.debug(f"[Publisher] [{self.room_id}] Over the room rate, dropped reading for '{routing_key}'")
 
     async def publish_iaq(self):
         while True:
-            ts, dt_str = self._get_time()
             # Call generate_iaq_data() without extra arguments
             data = self.simulator.generate_iaq_data()
             routing_key = get_routing_key(self.room_id, "iaq")
-            payload = {"room_id": self.room_id, "data": data}
+            payload = self._payload(data)
             await self.publish(routing_key, payload)
             await asyncio.sleep(60)
 
     async def publish_presence(self):
         while True:
-            ts, dt_str = self._get_time()
             # Call generate_presence_data() without extra arguments
             data = self.simulator.generate_presence_data()
             routing_key = get_routing_key(self.room_id, "presence")
-            payload = {"room_id": self.room_id, "data": data}
+            payload = self._payload(data)
             await self.publish(routing_key, payload)
             await asyncio.sleep(1)
 
     async def publish_power(self):
         while True:
-            ts, dt_str = self._get_time()
             # Call generate_power_data() without extra arguments
             data = self.simulator.generate_power_data()
             routing_key = get_routing_key(self.room_id, "power")
-            payload = {"room_id": self.room_id, "data": data}
+            payload = self._payload(data)
             await self.publish(routing_key, payload)
             await asyncio.sleep(60)
 
@@ -70,35 +70,29 @@ class AsyncSensorPublisher:
             self.publish_power()
         )
 
-async def main():
+async def run_tenant(tenant: str):
+    name = tenant_name("Publisher", tenant)
     try:
-        logger.info("[Publisher] Connecting to RabbitMQ...")
-        connection = await aio_pika.connect_robust(
-            host=RABBITMQ_CONFIG["host"],
-            port=RABBITMQ_CONFIG["port"],
-            login=RABBITMQ_CONFIG["user"],
-            password=RABBITMQ_CONFIG["password"],
-            virtualhost=RABBITMQ_CONFIG["vhost"]
-        )
-
-        async with connection:
-            channel = await connection.channel()
-            logger.info("[Publisher] ✅ Connected to RabbitMQ.")
+        logger.info(f"[{name}] Connecting to RabbitMQ...")
+        async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant)) as rabbitmq:
+            logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
 
             # Declare the topic exchange for sensor data
-            exchange = await channel.declare_exchange(
-                EXCHANGES["sensor_data"],
-                aio_pika.ExchangeType.TOPIC,
-                durable=True
-            )
-            logger.info(f"[Publisher] Exchange '{EXCHANGES['sensor_data']}' declared.")
+            await rabbitmq.declare_exchange(EXCHANGES["sensor_data"])
+            logger.info(f"[{name}] Exchange '{EXCHANGES['sensor_data']}' declared.")
 
-            # Start publishers for each room
-            publishers = [AsyncSensorPublisher(room_id, exchange) for room_id in ROOM_IDS]
-            await asyncio.gather(*(pub.start() for pub in publishers))
+            # Start publishers for each room; one flow controller paces the tenant's connection
+            flow = PublishFlowController(name, rabbitmq, EXCHANGES["sensor_data"])
+            publishers = [AsyncSensorPublisher(room_id, flow) for room_id in tenant_rooms(tenant)]
+            await asyncio.gather(flow.run(), *(pub.start() for pub in publishers))
 
     except Exception as e:
-        logger.error(f"[Publisher] ❌ Error during publishing setup: {e}")
+        logger.error(f"[{name}] ❌ Error during publishing setup: {e}")
+
+
+async def main():
+    setup_tracing("Publisher")
+    await run_for_tenants("Publisher", run_tenant)
 
 if __name__ == "__main__":
     try:
@@ -1,6 +1,6 @@
 import random
 import math
-from datetime import datetime
+from time_service import clock
 
 class SensorSimulator:
     def __init__(self, room_id: str):
@@ -26,7 +26,7 @@ class SensorSimulator:
         self.lambda_co2 = 0.1    # Exponential decay constant for CO₂
         
     def _generate_datetime(self) -> str:
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        return clock.format_local_ms(clock.now_ms())
     
     def update_occupancy_state(self):
         """
@@ -34,7 +34,7 @@ class SensorSimulator:
         Nighttime (before 8 AM or after 8 PM) drives high occupancy because hotel rooms
         are more likely to be in use. During the day, there's a higher chance of being unoccupied.
         """
-        now_hour = datetime.now().hour
+        now_hour = clock.local_hour(clock.now_s())
 
         # Define nighttime and daytime probabilities
         if now_hour >= 20 or now_hour < 8:
@@ -1,17 +1,25 @@
+import asyncio
+import aio_pika
 import json
-import pytz
 import logging
-from datetime import datetime
-from config import ROOM_IDS, EXCHANGES
-from rabbitmq_management import RabbitMQManager
+import uuid
+from typing import TYPE_CHECKING
+from config import EXCHANGES, LATEST_VALUES_CONFIG, ENVELOPE_CONFIG
+from envelopes import EnvelopeConsumer, envelopes_enabled, pack
+from rabbitmq_management import AsyncRabbitMQManager
+from message_dedup import MessageDeduplicator
+from tracing import setup_tracing, tracer
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from time_service import clock
+from room_registry import HierarchyAggregator, get_registry
+
+if TYPE_CHECKING:
+    from latest_values import LatestValueIndex  # main() imports it lazily, with numpy
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("sensors_subscriber")
 
-# Timezone configuration
-tz = pytz.timezone("Asia/Bangkok")
-
 # Global dictionary to aggregate IAQ and power data per room.
 AGGREGATED_DATA = {}
 
@@ -22,24 +30,28 @@ def get_aggregated_field(data, key):
 
 class SensorSubscriber:
     """
-    Subscribes to RabbitMQ sensor data and returns structured messages.
+    Joins raw sensor readings into structured room messages.
     Combines IAQ + Power + Presence if possible, otherwise returns Presence-only.
     """
 
-    def __init__(self):
-        self.tz = tz
+    def __init__(self, latest_index: "LatestValueIndex" = None, aggregator: HierarchyAggregator = None):
+        self.latest_index = latest_index
+        self.aggregator = aggregator
 
-    def format_base_message(self, room_id):
-        now = datetime.now(self.tz)
+    def format_base_message(self, room_id, timestamp=None):
+        """
+        Use the producer timestamp when the reading carries one, so redeliveries
+        map to the same rows. The ISO "datetime" is left to the writers
+        (clock.isoformat at the storage boundary).
+        """
         return {
-            "timestamp": int(now.timestamp()),
-            "datetime": now.isoformat(),
+            "timestamp": int(timestamp) if timestamp else clock.now_s(),
             "device_id": room_id
         }
 
-    def combine_message(self, room_id, presence_data):
+    def combine_message(self, room_id, presence_data, timestamp=None):
         """Combine IAQ + Power + Presence sensor data."""
-        base = self.format_base_message(room_id)
+        base = self.format_base_message(room_id, timestamp)
         iaq = AGGREGATED_DATA.get(room_id, {}).get("iaq", {})
         power = AGGREGATED_DATA.get(room_id, {}).get("power", {})
 
@@ -57,9 +69,9 @@ class SensorSubscriber:
         del AGGREGATED_DATA[room_id]
         return combined
 
-    def presence_only_message(self, room_id, presence_data):
+    def presence_only_message(self, room_id, presence_data, timestamp=None):
         """Return presence-only data structure."""
-        base = self.format_base_message(room_id)
+        base = self.format_base_message(room_id, timestamp)
         presence_msg = {
             **base,
             "presence_state": get_aggregated_field(presence_data, "presence_state"),
@@ -69,40 +81,57 @@ class SensorSubscriber:
         logger.info(f"[Subscriber] Received Presence-only sensor data: {presence_msg}")
         return presence_msg
 
+    def update_latest_index(self, room_id, sensor_type, data, timestamp):
+        """Feed every raw reading into the latest-value index, not only combined ones."""
+        if sensor_type == "power":
+            data = {"power_kw_power_meter": data.get("power_consumption_kw")}
+        self.latest_index.update(room_id, data, timestamp or clock.now_s())
+
+    def update_aggregator(self, room_id, sensor_type, data):
+        """Floor/building rollups; presence "occupied" or "passive" counts as an occupied room."""
+        if sensor_type == "iaq" and data.get("co2") is not None:
+            self.aggregator.update(room_id, co2=float(data["co2"]))
+        elif sensor_type == "power" and data.get("power_consumption_kw") is not None:
+            self.aggregator.update(room_id, power_kw=float(data["power_consumption_kw"]))
+        elif sensor_type == "presence" and data.get("presence_state"):
+            self.aggregator.update(room_id, is_occupied=data["presence_state"] in ("occupied", "passive"))
+
+    def join(self, room_id, sensor_type, data, timestamp=None):
+        """
+        Fold one decoded reading into the room's pending IAQ/power data. Returns
+        the combined (or presence-only) record on presence readings, else None.
+        """
+        if self.latest_index is not None:
+            self.update_latest_index(room_id, sensor_type, data, timestamp)
+        if self.aggregator is not None:
+            self.update_aggregator(room_id, sensor_type, data)
+
+        # Aggregating IAQ and power data
+        if sensor_type == "iaq":
+            AGGREGATED_DATA.setdefault(room_id, {})["iaq"] = data
+            logger.info(f"[Subscriber] Aggregated IAQ data for {room_id}: {data}")
+
+        elif sensor_type == "power":
+            AGGREGATED_DATA.setdefault(room_id, {})["power"] = data
+            logger.info(f"[Subscriber] Aggregated Power data for {room_id}: {data}")
+
+        elif sensor_type == "presence":
+            if "iaq" in AGGREGATED_DATA.get(room_id, {}) and "power" in AGGREGATED_DATA.get(room_id, {}):
+                return self.combine_message(room_id, data, timestamp)
+            return self.presence_only_message(room_id, data, timestamp)
+
+        else:
+            logger.warning(f"[Subscriber] Unhandled sensor type: {sensor_type} for {room_id}")
+        return None
+
     def sensor_callback(self, ch, method, properties, body):
         try:
             message = json.loads(body)
-            room_id = message.get("room_id")
-            data = message.get("data", {})
-            routing_key = method.routing_key
-            sensor_type = routing_key.split(".")[-1]
-
-            # Aggregating IAQ and power data
-            if sensor_type == "iaq":
-                AGGREGATED_DATA.setdefault(room_id, {})["iaq"] = data
-                logger.info(f"[Subscriber] Aggregated IAQ data for {room_id}: {data}")
-
-            elif sensor_type == "power":
-                AGGREGATED_DATA.setdefault(room_id, {})["power"] = data
-                logger.info(f"[Subscriber] Aggregated Power data for {room_id}: {data}")
-
-            elif sensor_type == "presence":
-                if "iaq" in AGGREGATED_DATA.get(room_id, {}) and "power" in AGGREGATED_DATA.get(room_id, {}):
-                    combined = self.combine_message(room_id, data)
-                    if ch:
-                        ch.basic_ack(delivery_tag=method.delivery_tag)
-                    return combined
-                else:
-                    presence_msg = self.presence_only_message(room_id, data)
-                    if ch:
-                        ch.basic_ack(delivery_tag=method.delivery_tag)
-                    return presence_msg
-
-            else:
-                logger.warning(f"[Subscriber] Unhandled sensor type: {sensor_type} from {routing_key}")
-
+            sensor_type = method.routing_key.split(".")[-1]
+            output = self.join(message.get("room_id"), sensor_type, message.get("data", {}), message.get("timestamp"))
             if ch:
                 ch.basic_ack(delivery_tag=method.delivery_tag)
+            return output
 
         except Exception as e:
             logger.error(f"[Subscriber] Callback error: {e}")
@@ -110,26 +139,128 @@ class SensorSubscriber:
                 ch.basic_nack(delivery_tag=method.delivery_tag)
             return None
 
-if __name__ == "__main__":
-    manager = RabbitMQManager()
-    subscriber = SensorSubscriber()
+def combined_fields(room_id, sensor_type, data, timestamp, combined, message_id=None) -> dict:
+    """
+    Record published on the combined exchange for every raw reading: the
+    reading itself (agents still need raw IAQ/power values and per-sensor
+    arrivals) plus the joined room record when the reading completed one.
+    """
+    record = {"room_id": room_id, "sensor_type": sensor_type, "timestamp": timestamp, "data": data}
+    if message_id:
+        record["message_id"] = message_id  # only inside envelopes; single records use the AMQP message ID
+    if combined:
+        record["combined"] = combined
+    return record
+
+
+def combined_record(room_id, sensor_type, data, timestamp, combined) -> bytes:
+    return json.dumps(combined_fields(room_id, sensor_type, data, timestamp, combined), separators=(",", ":")).encode()
+
+
+class EnrichmentService:
+    """
+    Joins raw readings per room once for the whole fleet and republishes them
+    on EXCHANGES["combined"] under the same routing key and message ID, so
+    downstream agents keep their redelivery dedup.
+    """
+
+    def __init__(self, rabbitmq: AsyncRabbitMQManager, subscriber: SensorSubscriber):
+        self.rabbitmq = rabbitmq
+        self.subscriber = subscriber
+        self.dedup = MessageDeduplicator()
+
+    async def handle_message(self, message: aio_pika.IncomingMessage):
+        try:
+            async with message.process(ignore_processed=True):
+                with tracer.span("decode"):
+                    parsed = json.loads(message.body)
+                room_id = parsed.get("room_id")
+                message_id = message.message_id or parsed.get("message_id")
+                if self.dedup.is_duplicate(room_id, message_id):
+                    logger.info(f"[Subscriber] ⏭️ Skipping redelivered message {message_id} for {room_id}")
+                    return
+
+                sensor_type = message.routing_key.rsplit(".", 1)[-1]
+                data = parsed.get("data", {})
+                timestamp = parsed.get("timestamp")
+                with tracer.span("join", room_id=room_id):
+                    combined = self.subscriber.join(room_id, sensor_type, data, timestamp)
+                await self.rabbitmq.publish_body(
+                    EXCHANGES["combined"], message.routing_key,
+                    combined_record(room_id, sensor_type, data, timestamp, combined), message_id=message_id
+                )
+                self.dedup.remember(room_id, message_id)
+
+        except Exception as e:
+            # Rejected without requeue, so the broker dead-letters it
+            logger.error(f"[Subscriber] ❌ Error enriching message: {e}")
+
+    async def process_batch(self, readings: list[dict]):
+        """Join an envelope of raw readings in order and republish them as one envelope of combined records."""
+        records = []
+        for reading in readings:
+            room_id = reading.get("room_id")
+            sensor_type = reading.get("sensor_type")
+            data = reading.get("data", {})
+            timestamp = reading.get("timestamp")
+            try:
+                with tracer.span("join", room_id=room_id):
+                    combined = self.subscriber.join(room_id, sensor_type, data, timestamp)
+                records.append(combined_fields(room_id, sensor_type, data, timestamp, combined, reading.get("message_id")))
+            except Exception as e:
+                logger.error(f"[Subscriber] ❌ Skipping reading {reading.get('message_id')} for {room_id} in envelope: {e}")
+        if not records:
+            return
+        await self.rabbitmq.publish_body(
+            EXCHANGES["combined"], ENVELOPE_CONFIG["routing_key"], pack(records), message_id=uuid.uuid4().hex
+        )
+
+
+async def run_tenant(tenant: str, subscriber: SensorSubscriber):
+    name = tenant_name("Subscriber", tenant)
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=tenant_quota(tenant).prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
+        await rabbitmq.declare_exchange(EXCHANGES["combined"])
+        service = EnrichmentService(rabbitmq, subscriber)
 
-    try:
         # Subscribe for all rooms and sensor types
-        for room_id in ROOM_IDS:
+        for room_id in tenant_rooms(tenant):
             for sensor_type in ["iaq", "presence", "power"]:
                 routing_key = f"{room_id}.{sensor_type}"
-                queue_name = f"{room_id}_{sensor_type}_queue"
+                queue_name = f"{room_id}_{sensor_type}_enrich_queue"
 
-                manager.subscribe(
-                    exchange=EXCHANGES["sensor_data"],
-                    queue_name=queue_name,
-                    routing_key=routing_key,
-                    callback=subscriber.sensor_callback
+                await rabbitmq.subscribe(
+                    EXCHANGES["sensor_data"], queue_name, routing_key, service.handle_message, lane="telemetry"
                 )
+        if envelopes_enabled():
+            envelopes = EnvelopeConsumer(name, service.process_batch, service.dedup)
+            await rabbitmq.subscribe(
+                EXCHANGES["sensor_data"], "envelope_enrich_queue", ENVELOPE_CONFIG["routing_key"],
+                envelopes.handle_message, lane="telemetry"
+            )
+
+        logger.info(f"[{name}] 🟢 Publishing combined records to {EXCHANGES['combined']}")
+        await asyncio.Future()  # run forever
+
+
+async def main():
+    setup_tracing("Subscriber")
+    # Agents embed SensorSubscriber only for message combining; the index and its numpy/HTTP stack load here
+    from latest_values import LatestValueIndex, serve_http
 
-        manager.start_consuming()
+    registry = get_registry()
+    registry.start_watching()
+    latest_index = LatestValueIndex()
+    aggregator = HierarchyAggregator(registry)
+    subscriber = SensorSubscriber(latest_index=latest_index, aggregator=aggregator)
+    if LATEST_VALUES_CONFIG["http_enabled"]:
+        serve_http(latest_index, aggregator=aggregator)
 
+    await run_for_tenants("Subscriber", lambda tenant: run_tenant(tenant, subscriber))
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("[Subscriber] Subscriber stopped by user.")
-        manager.close()
@@ -1,23 +1,54 @@
 import asyncio
 import aio_pika
-from config import EXCHANGES, RABBITMQ_CONFIG  # Ensure these are imported from your config
+from config import EXCHANGES, DEAD_LETTER_QUEUES
+from rabbitmq_management import AsyncRabbitMQManager
+from tenancy import tenant_ids, tenant_rooms, tenant_vhost
+
+# Queues the fault and occupancy agents read from sensor_data_exchange before they
+# moved to the combined exchange; still bound, they would fill up with no consumer
+RETIRED_QUEUES = {
+    "{room_id}_{sensor_type}_fault_queue": ("iaq", "power", "presence"),
+    "{room_id}_{sensor_type}_occupancy_queue": ("iaq", "presence"),
+}
 
 async def setup_exchanges():
-    # Connect to RabbitMQ
-    connection = await aio_pika.connect_robust(
-        host=RABBITMQ_CONFIG["host"],
-        port=RABBITMQ_CONFIG["port"],
-        login=RABBITMQ_CONFIG["user"],
-        password=RABBITMQ_CONFIG["password"]
-    )
-    channel = await connection.channel()
+    # One set of exchanges per tenant vhost (just the configured vhost without tenancy)
+    for tenant in tenant_ids():
+        await setup_vhost(tenant_vhost(tenant))
+        await retire_queues(tenant)
 
-    # Declare all required exchanges
-    for exchange_name in EXCHANGES.values():
-        await channel.declare_exchange(exchange_name, type=aio_pika.ExchangeType.TOPIC, durable=True)
-        print(f"✅ Declared exchange: {exchange_name}")
+async def retire_queues(tenant: str):
+    async with AsyncRabbitMQManager("Setup", vhost=tenant_vhost(tenant)) as rabbitmq:
+        for room_id in tenant_rooms(tenant):
+            for pattern, sensor_types in RETIRED_QUEUES.items():
+                for sensor_type in sensor_types:
+                    queue_name = pattern.format(room_id=room_id, sensor_type=sensor_type)
+                    # One channel per queue: the broker closes it on a missing or in-use queue
+                    channel = await rabbitmq.connection.channel()
+                    try:
+                        await channel.declare_queue(queue_name, passive=True)
+                        await channel.queue_delete(queue_name, if_unused=True)
+                        print(f"🗑️ Deleted retired queue: {queue_name}")
+                    except aio_pika.exceptions.ChannelNotFoundEntity:
+                        pass
+                    except aio_pika.exceptions.ChannelPreconditionFailed:
+                        print(f"⚠️ Retired queue {queue_name} still has a consumer, stop the old agent and run again")
+                    finally:
+                        if not channel.is_closed:
+                            await channel.close()
+
+async def setup_vhost(vhost: str):
+    # Connect to RabbitMQ
+    async with AsyncRabbitMQManager("Setup", vhost=vhost) as rabbitmq:
+        # Declare all required exchanges
+        for exchange_name in EXCHANGES.values():
+            await rabbitmq.declare_exchange(exchange_name)
+            print(f"✅ Declared exchange: {exchange_name} ({vhost})")
 
-    await connection.close()
+        # Dead-letter queues: rejected messages, and telemetry rejected or dropped on overflow
+        for exchange_name, (queue_name, _) in DEAD_LETTER_QUEUES.items():
+            await rabbitmq.ensure_dead_letter(exchange_name)
+            print(f"✅ Declared dead-letter queue: {queue_name}")
 
 if __name__ == "__main__":
     asyncio.run(setup_exchanges())
@@ -0,0 +1,172 @@
+# spool.py
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Record framing: payload length + CRC32, then the JSON payload
+HEADER = struct.Struct("<II")
+
+
+class SegmentedSpool:
+    """
+    Append-only on-disk spool made of fixed-size segment files.
+    Writers append rows here while their database is unreachable and drain
+    them in large batches once it is back. Segments are read through mmap, a
+    small cursor file remembers how far draining got, and the oldest segments
+    are dropped once the spool exceeds its disk budget.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 8 * 1024 * 1024,
+                 max_bytes: int = 512 * 1024 * 1024, fsync: bool = False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.cursor_path = os.path.join(directory, "cursor")
+        self.dropped_records = 0
+        self.writer = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".seg"))
+        self.read_segment, self.read_offset = self._load_cursor()
+        self.pending_records = sum(self._count_records(seq) for seq in self.segments)
+        if self.pending_records:
+            logger.warning(f"📦 Spool {directory} holds {self.pending_records} record(s) from a previous run")
+
+    # -----------------------------
+    # Paths and cursor
+    # -----------------------------
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:016d}.seg")
+
+    def _load_cursor(self) -> tuple[int, int]:
+        try:
+            with open(self.cursor_path) as f:
+                seq, offset = (int(x) for x in f.read().split())
+            if seq in self.segments:
+                return seq, offset
+        except (OSError, ValueError):
+            pass
+        return (self.segments[0] if self.segments else 0), 0
+
+    def _save_cursor(self):
+        tmp = self.cursor_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{self.read_segment} {self.read_offset}")
+        os.replace(tmp, self.cursor_path)
+
+    def _iter_records(self, seq: int, offset: int = 0):
+        """Yield (end_offset, payload bytes) for each intact record from offset on."""
+        path = self._segment_path(seq)
+        size = os.path.getsize(path)
+        if size <= offset:
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            while offset + HEADER.size <= size:
+                length, crc = HEADER.unpack_from(view, offset)
+                start, end = offset + HEADER.size, offset + HEADER.size + length
+                if end > size or zlib.crc32(view[start:end]) != crc:
+                    logger.warning(f"⚠️ Truncated or corrupt record in {path} at offset {offset}")
+                    return
+                yield end, view[start:end]
+                offset = end
+
+    def _count_records(self, seq: int) -> int:
+        offset = self.read_offset if seq == self.read_segment else 0
+        return sum(1 for _ in self._iter_records(seq, offset))
+
+    # -----------------------------
+    # Writing
+    # -----------------------------
+    def append(self, record: dict):
+        payload = json.dumps(record, default=str).encode()
+        if self.writer is None or self.writer.tell() >= self.segment_bytes:
+            self._roll()
+        self.writer.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.writer.flush()
+        if self.fsync:
+            os.fsync(self.writer.fileno())
+        self.pending_records += 1
+
+    def _roll(self):
+        if self.writer:
+            self.writer.close()
+        seq = self.segments[-1] + 1 if self.segments else 1
+        self.segments.append(seq)
+        if len(self.segments) == 1:
+            self.read_segment, self.read_offset = seq, 0
+        self.writer = open(self._segment_path(seq), "ab")
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        total = sum(os.path.getsize(self._segment_path(seq)) for seq in self.segments)
+        while total > self.max_bytes and len(self.segments) > 1:
+            oldest = self.segments.pop(0)
+            lost = self._count_records(oldest)
+            total -= os.path.getsize(self._segment_path(oldest))
+            os.remove(self._segment_path(oldest))
+            self.pending_records -= lost
+            self.dropped_records += lost
+            self.read_segment, self.read_offset = self.segments[0], 0
+            self._save_cursor()
+            logger.error(f"🗑️ Spool {self.directory} over budget, dropped {lost} oldest record(s)")
+
+    # -----------------------------
+    # Draining
+    # -----------------------------
+    def __len__(self):
+        return self.pending_records
+
+    def read_batch(self, max_records: int) -> tuple[list[dict], tuple[int, int, int]]:
+        """
+        Return up to max_records of the oldest records plus a position token.
+        Nothing is removed until commit(token) is called, so a failed drain
+        simply reads the same batch again.
+        """
+        records = []
+        seq, offset = self.read_segment, self.read_offset
+        for seq in [s for s in self.segments if s >= self.read_segment]:
+            start = offset if seq == self.read_segment else 0
+            offset = start
+            for end, payload in self._iter_records(seq, start):
+                records.append(json.loads(payload))
+                offset = end
+                if len(records) >= max_records:
+                    return records, (seq, offset, len(records))
+        return records, (seq, offset, len(records))
+
+    def commit(self, token: tuple[int, int, int]):
+        seq, offset, count = token
+        for done in [s for s in self.segments if s < seq]:
+            os.remove(self._segment_path(done))
+            self.segments.remove(done)
+        self.read_segment, self.read_offset = seq, offset
+        self.pending_records -= count
+
+        if self.pending_records <= 0:
+            # Fully drained: drop the segments and start over with a fresh one on the next append
+            self.close()
+            for done in self.segments:
+                os.remove(self._segment_path(done))
+            self.segments = []
+            self.read_segment, self.read_offset, self.pending_records = 0, 0, 0
+        self._save_cursor()
+
+    def stats(self) -> dict:
+        return {
+            "records": self.pending_records,
+            "segments": len(self.segments),
+            "bytes": sum(os.path.getsize(self._segment_path(seq)) for seq in self.segments),
+            "dropped_records": self.dropped_records,
+        }
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
@@ -0,0 +1,70 @@
+# startup.py
+
+import importlib
+import logging
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Agents import this module first, so this is close to interpreter start
+STARTED = time.perf_counter()
+
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name: str):
+    """
+    Defer importing a heavy dependency until it is used. Also works in
+    `except lazy.Error:` clauses, which are only evaluated when an exception
+    actually reaches them.
+    """
+    return _LazyModule(name)
+
+
+def elapsed_ms() -> float:
+    return (time.perf_counter() - STARTED) * 1000
+
+
+def mark_ready(name: str):
+    """Log how long the agent took from import to consuming."""
+    logger.info(f"[{name}] ⚡ Ready to consume in {elapsed_ms():.0f} ms")
+
+
+def import_profile(module: str, top: int = 15) -> list[tuple[int, str]]:
+    """
+    Import `module` in a fresh interpreter with -X importtime and return the
+    slowest imports as (cumulative microseconds, module name).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), name.strip()))
+    if result.returncode != 0:
+        logger.error(f"[Startup] ❌ import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    return sorted(timings, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    # python startup.py fault_detection_agent [occupancy_detection_agent ...]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for module in sys.argv[1:] or ["fault_detection_agent"]:
+        print(f"⏱️ {module}")
+        for cumulative, name in import_profile(module):
+            print(f"{cumulative / 1000:10.1f} ms  {name}")
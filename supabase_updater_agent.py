@@ -1,10 +1,16 @@
+from startup import mark_ready  # first import, starts the startup clock
 import asyncio
 import aio_pika
 import json
 import logging
 import httpx
 from datetime import datetime, timedelta
-from config import ROOM_IDS, EXCHANGES, RABBITMQ_CONFIG, SUPABASE_HTTP_CONFIG
+from config import EXCHANGES, SUPABASE_HTTP_CONFIG, ROOM_STATE_CACHE_CONFIG
+from room_state_cache import RoomStateCache
+from rabbitmq_management import AsyncRabbitMQManager
+from flow_control import AdaptiveConcurrencyLimiter
+from tenancy import run_for_tenants, tenant_name, tenant_quota, tenant_rooms, tenant_vhost
+from tracing import setup_tracing, tracer
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,6 +24,10 @@ SUPABASE_HEADERS = {
 
 ROOM_TIMERS = {}  # { room_id: { last_update, last_values, started } }
 
+ROOM_STATE_CACHE = RoomStateCache(
+    max_batch=ROOM_STATE_CACHE_CONFIG["max_batch"], high_water=ROOM_STATE_CACHE_CONFIG["high_water"]
+)
+
 ALL_DATAPOINTS = [
     "temperature",
     "humidity",
@@ -31,30 +41,43 @@ ALL_DATAPOINTS = [
 
 
 async def upsert_room_state_http(room_id, is_occupied, datapoint, health_status="healthy"):
-    now = datetime.now().isoformat()
-    payload = {
-        "room_id": room_id,
-        "is_occupied": is_occupied,
-        "vacancy_last_updated": now,
-        "datapoint": datapoint,
-        "health_status": health_status,
-        "datapoint_last_updated": now
-    }
+    """Stage a room state for the next batched flush; unchanged states are dropped."""
+    if not ROOM_STATE_CACHE.stage(room_id, is_occupied, datapoint, health_status):
+        logger.debug(f"⏭️ Skipped unchanged room state: {room_id} - {datapoint}")
 
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{SUPABASE_HTTP_CONFIG['url']}/rest/v1/room_states",
-                headers=SUPABASE_HEADERS,
-                json=payload,
-                params={"on_conflict": "room_id,datapoint"}
-            )
+
+async def flush_room_states_http(client: httpx.AsyncClient):
+    while len(ROOM_STATE_CACHE):
+        batch = ROOM_STATE_CACHE.drain()
+        try:
+            # A batch mixes many messages, so the flush is its own (sampled) trace
+            with tracer.span("db_write", table="room_states", rows=len(batch)):
+                resp = await client.post(
+                    f"{SUPABASE_HTTP_CONFIG['url']}/rest/v1/room_states",
+                    headers={**SUPABASE_HEADERS, "Prefer": "resolution=merge-duplicates"},
+                    json=batch,
+                    params={"on_conflict": "room_id,datapoint"}
+                )
             if resp.status_code >= 300:
-                logger.error(f"❌ Failed to upsert room state to Supabase: {resp.json()}")
-            else:
-                logger.info(f"🟢 Upserted room state to Supabase: {room_id} - {datapoint}")
-    except Exception as e:
-        logger.error(f"❌ Supabase request failed: {e}")
+                logger.error(f"❌ Failed to upsert room states to Supabase: {resp.text}")
+                ROOM_STATE_CACHE.restore(batch)
+                return
+            ROOM_STATE_CACHE.mark_flushed(batch)
+            logger.info(f"🟢 Upserted {len(batch)} room state(s) to Supabase")
+        except Exception as e:
+            logger.error(f"❌ Supabase request failed: {e}")
+            ROOM_STATE_CACHE.restore(batch)
+            return
+
+
+async def room_state_flusher():
+    async with httpx.AsyncClient() as client:
+        try:
+            while True:
+                await asyncio.sleep(ROOM_STATE_CACHE_CONFIG["flush_interval"])
+                await flush_room_states_http(client)
+        finally:
+            await flush_room_states_http(client)
 
 
 async def periodic_room_health_updater(room_id):
@@ -66,72 +89,80 @@ async def periodic_room_health_updater(room_id):
                 await upsert_room_state_http(room_id, is_occupied=True, datapoint=dp, health_status="healthy")
 
 
-async def handle_message(message: aio_pika.IncomingMessage):
-    async with message.process(ignore_processed=True):
-        try:
-            routing_key = message.routing_key
-            raw_body = message.body.decode()
-            parsed = json.loads(raw_body)
-            room_id = parsed.get("room_id")
-            is_occupied = parsed.get("is_occupied", True)
-            datapoint = parsed.get("datapoint", "unknown")
-            health_status = parsed.get("health_status", "healthy")
+async def process_update(parsed: dict):
+    """Apply one occupancy or fault payload (from the broker or published in process)."""
+    room_id = parsed.get("room_id")
+    is_occupied = parsed.get("is_occupied", True)
+    datapoint = parsed.get("datapoint", "unknown")
+    health_status = parsed.get("health_status", "healthy")
 
-            logger.info(f"[SupabaseUpdater] Received {datapoint} for {room_id} | status={health_status}")
+    logger.info(f"[SupabaseUpdater] Received {datapoint} for {room_id} | status={health_status}")
 
-            # Save last values for periodic refresh
-            if room_id not in ROOM_TIMERS:
-                ROOM_TIMERS[room_id] = {
-                    "last_values": {},
-                    "started": False
-                }
+    # Save last values for periodic refresh
+    if room_id not in ROOM_TIMERS:
+        ROOM_TIMERS[room_id] = {
+            "last_values": {},
+            "started": False
+        }
 
-            ROOM_TIMERS[room_id]["last_values"][datapoint] = health_status
+    ROOM_TIMERS[room_id]["last_values"][datapoint] = health_status
 
-            if not ROOM_TIMERS[room_id]["started"]:
-                asyncio.create_task(periodic_room_health_updater(room_id))
-                ROOM_TIMERS[room_id]["started"] = True
+    if not ROOM_TIMERS[room_id]["started"]:
+        asyncio.create_task(periodic_room_health_updater(room_id))
+        ROOM_TIMERS[room_id]["started"] = True
 
-            # Immediate upsert
-            await upsert_room_state_http(room_id, is_occupied, datapoint, health_status)
+    # Staged upsert, flushed in batches by room_state_flusher
+    with tracer.span("db_write", room_id=room_id, table="room_states", staged=True):
+        await upsert_room_state_http(room_id, is_occupied, datapoint, health_status)
 
-        except Exception as e:
-            logger.error(f"[SupabaseUpdater] ❌ Error processing message: {e}")
 
+async def handle_message(message: aio_pika.IncomingMessage):
+    try:
+        async with message.process(ignore_processed=True):
+            await process_update(json.loads(message.body.decode()))
 
-async def main():
-    logger.info("[SupabaseUpdater] Connecting to RabbitMQ...")
-
-    connection = await aio_pika.connect_robust(
-        host=RABBITMQ_CONFIG["host"],
-        port=RABBITMQ_CONFIG["port"],
-        login=RABBITMQ_CONFIG["user"],
-        password=RABBITMQ_CONFIG["password"],
-        virtualhost=RABBITMQ_CONFIG["vhost"]
-    )
-
-    async with connection:
-        channel = await connection.channel()
-        logger.info("[SupabaseUpdater] ✅ Connected to RabbitMQ.")
-
-        fault_exchange = await channel.declare_exchange(
-            EXCHANGES["fault_alerts"], aio_pika.ExchangeType.TOPIC, durable=True
-        )
-        occupancy_exchange = await channel.declare_exchange(
-            EXCHANGES["occupancy"], aio_pika.ExchangeType.TOPIC, durable=True
-        )
-
-        for room_id in ROOM_IDS:
-            for exchange, topic in [(fault_exchange, "fault"), (occupancy_exchange, "occupancy")]:
+    except Exception as e:
+        # Rejected without requeue, so the broker dead-letters it
+        logger.error(f"[SupabaseUpdater] ❌ Error processing message: {e}")
+
+
+async def run_tenant(tenant: str):
+    name = tenant_name("SupabaseUpdater", tenant)
+    quota = tenant_quota(tenant)
+    logger.info(f"[{name}] Connecting to RabbitMQ...")
+
+    async with AsyncRabbitMQManager(name, vhost=tenant_vhost(tenant), prefetch_cap=quota.prefetch) as rabbitmq:
+        logger.info(f"[{name}] ✅ Connected to RabbitMQ.")
+
+        # Occupancy updates slow down while Supabase lags behind; fault alerts are never throttled
+        flow = AdaptiveConcurrencyLimiter(name, backpressure=ROOM_STATE_CACHE.backpressure,
+                                          max_concurrency=quota.max_concurrency, max_prefetch=quota.prefetch)
+        await flow.attach(await rabbitmq.get_lane_channel("telemetry"))
+        handlers = {"critical": handle_message, "telemetry": flow.wrap(handle_message)}
+
+        for room_id in tenant_rooms(tenant):
+            # Fault alerts get their own priority lane so they never queue behind occupancy updates
+            for exchange, topic, lane in [(EXCHANGES["fault_alerts"], "fault", "critical"),
+                                          (EXCHANGES["occupancy"], "occupancy", "telemetry")]:
                 routing_key = f"{room_id}.{topic}"
                 queue_name = f"{room_id}_{topic}_updater_queue"
 
-                queue = await channel.declare_queue(queue_name, durable=True)
-                await queue.bind(exchange, routing_key=routing_key)
-                await queue.consume(handle_message)
+                await rabbitmq.subscribe(exchange, queue_name, routing_key, handlers[lane], lane=lane)
+
+        logger.info(f"[{name}] 🟢 Waiting for messages...")
+        mark_ready(name)
+        await flow.run()
 
-        logger.info("[SupabaseUpdater] 🟢 Waiting for messages...")
-        await asyncio.Future()  # run forever
+
+async def main():
+    setup_tracing("SupabaseUpdater")
+    # One room_states cache and flusher shared by every tenant
+    flusher = asyncio.create_task(room_state_flusher())
+    try:
+        await run_for_tenants("SupabaseUpdater", run_tenant)
+    finally:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+# tenancy.py
+
+import asyncio
+import logging
+import threading
+import time
+from config import TENANCY_CONFIG, RABBITMQ_CONFIG
+from room_registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Rate limit of `rate` units per second with bursts of up to `burst`. rate=None means unlimited."""
+
+    def __init__(self, rate: float = None, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, n: int = 1) -> bool:
+        if self.rate is None:
+            return True
+        with self.lock:
+            self._refill()
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+    def take_up_to(self, n: int) -> int:
+        """Take as many whole tokens as available, at most n."""
+        if self.rate is None:
+            return n
+        with self.lock:
+            self._refill()
+            granted = min(n, int(self.tokens))
+            self.tokens -= granted
+            return granted
+
+
+class TenantQuota:
+    """Per-property limits: broker prefetch, handler concurrency and raw_data write rate."""
+
+    def __init__(self, tenant: str, limits: dict):
+        self.tenant = tenant
+        self.prefetch = limits.get("prefetch")
+        self.max_concurrency = limits.get("max_concurrency")
+        self.writes = TokenBucket(limits.get("writes_per_second"), limits.get("write_burst"))
+
+
+def tenancy_enabled() -> bool:
+    return TENANCY_CONFIG["enabled"]
+
+
+def tenant_ids() -> list[str]:
+    """One tenant per property in the room registry, or the single default tenant."""
+    if not tenancy_enabled():
+        return [TENANCY_CONFIG["default_tenant"]]
+    return sorted(get_registry().groups("property"))
+
+
+def tenant_rooms(tenant: str) -> tuple[str, ...]:
+    registry = get_registry()
+    if not tenancy_enabled():
+        return tuple(registry.room_ids)
+    return registry.rooms_in("property", tenant)
+
+
+def tenant_name(name: str, tenant: str) -> str:
+    """Log prefix / connection name of an agent serving one tenant."""
+    return f"{name}:{tenant}" if tenancy_enabled() else name
+
+
+def tenant_vhost(tenant: str) -> str:
+    """Each property gets its own RabbitMQ vhost, so exchange and queue names stay unprefixed."""
+    if not tenancy_enabled():
+        return RABBITMQ_CONFIG["vhost"]
+    return TENANCY_CONFIG["vhost_template"].format(tenant=tenant)
+
+
+_quotas = {}
+
+
+def tenant_quota(tenant: str) -> TenantQuota:
+    """Shared per process, so every writer of a tenant draws from the same write budget."""
+    if tenant not in _quotas:
+        limits = {**TENANCY_CONFIG["quotas"]["default"], **TENANCY_CONFIG["quotas"].get(tenant, {})}
+        _quotas[tenant] = TenantQuota(tenant, limits)
+    return _quotas[tenant]
+
+
+async def run_for_tenants(name: str, run_tenant):
+    """
+    Run `run_tenant(tenant)` for every tenant side by side. A failing tenant
+    is logged and does not stop the others.
+    """
+    tenants = tenant_ids()
+    if tenancy_enabled():
+        logger.info(f"[{name}] 🏨 Serving {len(tenants)} tenant(s): {', '.join(tenants)}")
+    results = await asyncio.gather(*(run_tenant(tenant) for tenant in tenants), return_exceptions=True)
+    for tenant, result in zip(tenants, results):
+        if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+            logger.error(f"[{name}] ❌ Tenant {tenant} stopped: {result}")
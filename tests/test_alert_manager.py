@@ -0,0 +1,50 @@
+from alert_manager import AlertManager
+from config import ALERT_CONFIG
+
+WARNING = {"co2": ("warning", ["co2 spike"])}
+CRITICAL = {"co2": ("critical", ["co2 above max"])}
+
+
+def observe(alerts, violations, now=0.0):
+    return alerts.observe("room101", "anomaly", violations, checked=["co2"], now=now)
+
+
+def test_raise_waits_for_consecutive_violations():
+    alerts = AlertManager({"critical": 1, "warning": 2}, clear_after=3)
+    assert observe(alerts, WARNING) == ([], [])
+    observe(alerts, {})  # streak broken before it was raised
+    assert not alerts.incidents
+    observe(alerts, WARNING)
+    raised, _ = observe(alerts, WARNING)
+    assert raised == [("co2", "warning", ["co2 spike"])]
+
+
+def test_configured_warning_raises_on_first_violation():
+    alerts = AlertManager(ALERT_CONFIG["raise_after"], ALERT_CONFIG["clear_after"])
+    raised, _ = observe(alerts, WARNING)
+    assert raised == [("co2", "warning", ["co2 spike"])]
+
+
+def test_repeats_are_suppressed_and_escalation_raises_again():
+    alerts = AlertManager({"critical": 1, "warning": 1}, clear_after=3)
+    observe(alerts, WARNING)
+    assert observe(alerts, WARNING) == ([], [])
+    raised, _ = observe(alerts, CRITICAL)
+    assert raised == [("co2", "critical", ["co2 above max"])]
+    assert observe(alerts, WARNING) == ([], [])  # de-escalation is not an alert
+
+    digest, = alerts.digest(now=60.0)
+    assert digest["suppressed"] == 2
+    assert digest["health_status"] == "critical"
+
+
+def test_clear_needs_consecutive_clean_checks():
+    alerts = AlertManager({"critical": 1}, clear_after=3)
+    observe(alerts, CRITICAL)
+    observe(alerts, {})
+    observe(alerts, {})
+    observe(alerts, CRITICAL)  # flapping back resets the clean streak
+    observe(alerts, {})
+    assert observe(alerts, {}) == ([], [])
+    assert observe(alerts, {}) == ([], ["co2"])
+    assert not alerts.active()
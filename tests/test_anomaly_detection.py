@@ -0,0 +1,44 @@
+import numpy as np
+
+from anomaly_detection import StreamingAnomalyDetector
+
+DATAPOINTS = ["temperature", "humidity", "co2", "power_kw_power_meter"]
+
+
+def readings(rooms, count):
+    """Interleaved co2 readings a minute apart, with a spike in the last reading of rooms[0]."""
+    room_ids, rows, timestamps = [], [], []
+    for step in range(count):
+        for r, room_id in enumerate(rooms):
+            row = [np.nan, np.nan, 600.0 + 10 * r + (5 if step % 2 else -5), np.nan]
+            room_ids.append(room_id)
+            rows.append(row)
+            timestamps.append(60.0 * step)
+    rows[-len(rooms)][2] = 900.0
+    return room_ids, np.array(rows), np.array(timestamps)
+
+
+def test_batch_matches_reading_by_reading():
+    room_ids, values, timestamps = readings(["room101", "room102"], 40)
+
+    batched = StreamingAnomalyDetector(DATAPOINTS)
+    found = batched.observe_batch(room_ids, values, timestamps)
+
+    single = StreamingAnomalyDetector(DATAPOINTS)
+    expected = []
+    for i, room_id in enumerate(room_ids):
+        for anomaly in single.observe_batch([room_id], values[i:i + 1], timestamps[i:i + 1]):
+            expected.append({**anomaly, "index": i})
+
+    key = lambda anomaly: (anomaly["index"], anomaly["kind"])
+    assert sorted(found, key=key) == sorted(expected, key=key)
+    np.testing.assert_allclose(batched.mean, single.mean)
+    np.testing.assert_allclose(batched.m2, single.m2)
+
+
+def test_anomaly_carries_index_of_its_reading():
+    room_ids, values, timestamps = readings(["room101", "room102"], 40)
+    detector = StreamingAnomalyDetector(DATAPOINTS)
+    spikes = [a for a in detector.observe_batch(room_ids, values, timestamps) if a["kind"] == "spike"]
+    assert [(a["index"], a["room_id"], a["datapoint"]) for a in spikes] == [(len(room_ids) - 2, "room101", "co2")]
+    assert spikes[0]["severity"] == "critical"
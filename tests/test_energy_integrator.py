@@ -0,0 +1,40 @@
+import pytest
+
+from energy_analytics_agent import EnergyIntegrator
+
+
+def test_segment_crossing_the_hour_is_split_at_the_boundary():
+    integrator = EnergyIntegrator()
+    integrator.add_power("room101", 3300, 1.0)
+    added = integrator.add_power("room101", 3900, 3.0)
+
+    # Power is interpolated to 2.0 kW at 3600s
+    assert integrator.pending[("room101", "hour", 0)][0] == pytest.approx(1.5 * 300 / 3600)
+    assert integrator.pending[("room101", "hour", 3600)][0] == pytest.approx(2.5 * 300 / 3600)
+    assert integrator.pending[("room101", "day", 0)][0] == pytest.approx(added)
+    assert added == pytest.approx(2.0 * 600 / 3600)
+
+
+def test_daily_bucket_follows_the_local_day():
+    integrator = EnergyIntegrator(utc_offset_seconds=3600)
+    integrator.add_power("room101", 82800 - 300, 1.0)
+    integrator.add_power("room101", 82800 + 300, 1.0)  # local midnight is 23:00 UTC
+    assert integrator.pending[("room101", "day", -3600)][0] == pytest.approx(300 / 3600)
+    assert integrator.pending[("room101", "day", 82800)][0] == pytest.approx(300 / 3600)
+
+
+def test_vacant_energy_is_tracked_separately():
+    integrator = EnergyIntegrator()
+    integrator.set_occupancy("room101", False)
+    integrator.add_power("room101", 0, 1.2)
+    integrator.add_power("room101", 600, 1.2)
+    kwh, vacant_kwh = integrator.pending[("room101", "hour", 0)]
+    assert vacant_kwh == pytest.approx(kwh) == pytest.approx(0.2)
+
+
+def test_gaps_and_late_readings_are_not_integrated():
+    integrator = EnergyIntegrator(max_gap_seconds=900)
+    integrator.add_power("room101", 0, 1.0)
+    assert integrator.add_power("room101", 1800, 1.0) == 0.0
+    assert integrator.add_power("room101", 1700, 1.0) == 0.0
+    assert not integrator.pending
@@ -0,0 +1,27 @@
+from latest_values import LatestValueIndex
+
+
+def test_late_reading_does_not_overwrite_newer_value():
+    index = LatestValueIndex(["room101"])
+    index.update("room101", {"co2": 900, "temperature": 24.0}, 1000)
+    index.update("room101", {"co2": 450}, 990)  # delivered late
+    room = index.snapshot()["room101"]
+    assert room["co2"] == 900
+    assert room["timestamp"] == 1000
+
+
+def test_older_reading_still_fills_other_datapoints():
+    index = LatestValueIndex(["room101"])
+    index.update("room101", {"co2": 900}, 1000)
+    index.update("room101", {"co2": 450, "presence_state": "occupied"}, 990)
+    room = index.snapshot()["room101"]
+    assert room["co2"] == 900
+    assert room["presence_state"] == "occupied"
+
+
+def test_stamps_follow_growth():
+    index = LatestValueIndex([], capacity=1)
+    for i in range(3):
+        index.update(f"room10{i}", {"co2": 500 + i}, 1000)
+    index.update("room102", {"co2": 400}, 999)
+    assert index.snapshot()["room102"]["co2"] == 502
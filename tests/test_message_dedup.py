@@ -0,0 +1,36 @@
+from message_dedup import MessageDeduplicator
+
+
+def test_redelivery_is_recognised_once_processed():
+    dedup = MessageDeduplicator(window=8)
+    assert not dedup.is_duplicate("room101", "m1")
+    dedup.remember("room101", "m1")
+    assert dedup.is_duplicate("room101", "m1")
+    assert not dedup.is_duplicate("room102", "m1")  # windows are per room
+    assert dedup.duplicates == 1
+
+
+def test_messages_without_id_are_never_duplicates():
+    dedup = MessageDeduplicator(window=8)
+    dedup.remember("room101", None)
+    assert not dedup.is_duplicate("room101", None)
+    assert "room101" not in dedup.rooms
+
+
+def test_oldest_id_is_evicted_past_the_window():
+    dedup = MessageDeduplicator(window=2)
+    for message_id in ("m1", "m2", "m3"):
+        dedup.remember("room101", message_id)
+    assert not dedup.is_duplicate("room101", "m1")
+    assert dedup.is_duplicate("room101", "m2")
+    assert dedup.is_duplicate("room101", "m3")
+
+
+def test_redelivered_id_is_kept_over_older_ones():
+    dedup = MessageDeduplicator(window=2)
+    dedup.remember("room101", "m1")
+    dedup.remember("room101", "m2")
+    assert dedup.is_duplicate("room101", "m1")  # seen again, so m2 is now the oldest
+    dedup.remember("room101", "m3")
+    assert dedup.is_duplicate("room101", "m1")
+    assert not dedup.is_duplicate("room101", "m2")
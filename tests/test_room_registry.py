@@ -0,0 +1,51 @@
+import json
+import os
+
+from room_registry import HierarchyAggregator, RoomRegistry
+
+
+def registry_with(tmp_path, rooms):
+    path = tmp_path / "rooms.json"
+    path.write_text(json.dumps(rooms))
+    return RoomRegistry(source="file", path=str(path))
+
+
+def test_same_floor_number_in_two_buildings_stays_apart(tmp_path):
+    registry = registry_with(tmp_path, [
+        {"room_id": "room101", "floor": "1", "building": "main", "property": "hotel"},
+        {"room_id": "room102", "floor": "1", "building": "annex", "property": "hotel"},
+        {"room_id": "villa101", "floor": "1", "building": "main", "property": "resort"},
+    ])
+    assert registry.floor_of("room101") == "hotel:main:1"
+    assert registry.rooms_in("floor", "hotel:main:1") == ("room101",)
+    assert registry.rooms_in("floor", "hotel:annex:1") == ("room102",)
+    assert registry.rooms_in("building", "hotel:main") == ("room101",)
+    assert registry.rooms_in("property", "hotel") == ("room101", "room102")
+
+
+def test_aggregator_sums_per_qualified_floor(tmp_path):
+    registry = registry_with(tmp_path, [
+        {"room_id": "room101", "floor": "1", "building": "main", "property": "hotel"},
+        {"room_id": "room102", "floor": "1", "building": "annex", "property": "hotel"},
+    ])
+    aggregator = HierarchyAggregator(registry)
+    aggregator.update("room101", power_kw=1.0)
+    aggregator.update("room102", power_kw=2.0)
+    assert aggregator.summary("floor", "hotel:main:1")["power_kw"] == 1.0
+    assert aggregator.summary("floor", "hotel:annex:1")["power_kw"] == 2.0
+    assert aggregator.summary("property", "hotel")["power_kw"] == 3.0
+
+
+
+def test_duplicate_room_ids_are_refused(tmp_path):
+    registry = registry_with(tmp_path, [
+        {"room_id": "room101", "floor": "1", "building": "main", "property": "hotel"},
+    ])
+    path = tmp_path / "rooms.json"
+    path.write_text(json.dumps([
+        {"room_id": "room101", "floor": "1", "building": "main", "property": "hotel"},
+        {"room_id": "room101", "floor": "1", "building": "main", "property": "resort"},
+    ]))
+    os.utime(path, (1, 1))
+    assert not registry.reload()
+    assert registry.get("room101").property == "hotel"
@@ -0,0 +1,43 @@
+from room_state_cache import RoomStateCache
+
+
+def test_unchanged_state_is_dropped():
+    cache = RoomStateCache()
+    assert cache.stage("room101", False, "occupancy")
+    cache.mark_flushed(cache.drain())
+    assert not cache.stage("room101", False, "occupancy")
+    assert len(cache) == 0
+
+
+def test_revert_while_flush_in_flight_is_not_lost():
+    cache = RoomStateCache()
+    cache.stage("room101", False, "occupancy")
+    cache.mark_flushed(cache.drain())
+
+    cache.stage("room101", True, "occupancy")
+    in_flight = cache.drain()
+    # Room empties again while the True upsert is still on the wire
+    assert cache.stage("room101", False, "occupancy")
+    cache.mark_flushed(in_flight)
+
+    batch = cache.drain()
+    assert [(row["room_id"], row["is_occupied"]) for row in batch] == [("room101", False)]
+
+
+def test_revert_to_in_flight_value_drops_pending():
+    cache = RoomStateCache()
+    cache.stage("room101", True, "occupancy")
+    in_flight = cache.drain()
+    cache.stage("room101", False, "occupancy")
+    assert not cache.stage("room101", True, "occupancy")
+    assert len(cache) == 0
+    cache.mark_flushed(in_flight)
+    assert cache.committed[("room101", "occupancy")] == (True, "healthy")
+
+
+def test_failed_flush_is_restored():
+    cache = RoomStateCache()
+    cache.stage("room101", True, "occupancy")
+    cache.restore(cache.drain())
+    assert len(cache) == 1
+    assert not cache.in_flight
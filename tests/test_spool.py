@@ -0,0 +1,77 @@
+from spool import SegmentedSpool
+
+# {"i": n} plus its 8-byte header is 16 bytes, so two records fill a segment
+SEGMENT_BYTES = 32
+
+
+def fill(spool, count, start=0):
+    for i in range(start, start + count):
+        spool.append({"i": i})
+
+
+def test_batches_are_read_and_committed_across_segments(tmp_path):
+    spool = SegmentedSpool(str(tmp_path), segment_bytes=SEGMENT_BYTES)
+    fill(spool, 5)
+    assert spool.stats()["segments"] == 3
+
+    records, token = spool.read_batch(3)
+    assert [r["i"] for r in records] == [0, 1, 2]
+    spool.commit(token)
+    assert len(spool) == 2
+    assert spool.stats()["segments"] == 2
+
+    records, token = spool.read_batch(10)
+    assert [r["i"] for r in records] == [3, 4]
+    spool.commit(token)
+    assert len(spool) == 0
+    assert spool.stats()["segments"] == 0
+
+
+def test_uncommitted_batch_is_read_again(tmp_path):
+    spool = SegmentedSpool(str(tmp_path), segment_bytes=SEGMENT_BYTES)
+    fill(spool, 3)
+    first, _ = spool.read_batch(2)
+    again, _ = spool.read_batch(2)
+    assert first == again
+    assert len(spool) == 3
+
+
+def test_oldest_segments_are_dropped_over_budget(tmp_path):
+    spool = SegmentedSpool(str(tmp_path), segment_bytes=SEGMENT_BYTES, max_bytes=2 * SEGMENT_BYTES)
+    fill(spool, 10)
+    stats = spool.stats()
+    assert stats["dropped_records"] > 0
+    assert stats["records"] + stats["dropped_records"] == 10
+
+    records, _ = spool.read_batch(10)
+    assert [r["i"] for r in records] == list(range(10 - len(records), 10))
+
+
+def test_reopen_resumes_from_the_committed_cursor(tmp_path):
+    spool = SegmentedSpool(str(tmp_path), segment_bytes=SEGMENT_BYTES)
+    fill(spool, 5)
+    _, token = spool.read_batch(3)
+    spool.commit(token)
+    # Crash: the spool is never closed, the next process opens the same directory
+
+    reopened = SegmentedSpool(str(tmp_path), segment_bytes=SEGMENT_BYTES)
+    assert len(reopened) == 2
+    records, _ = reopened.read_batch(10)
+    assert [r["i"] for r in records] == [3, 4]
+
+    fill(reopened, 1, start=5)
+    records, _ = reopened.read_batch(10)
+    assert [r["i"] for r in records] == [3, 4, 5]
+
+
+def test_truncated_record_is_ignored_on_reopen(tmp_path):
+    spool = SegmentedSpool(str(tmp_path), segment_bytes=1024)
+    fill(spool, 3)
+    spool.close()
+    with open(spool._segment_path(spool.segments[-1]), "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")  # header of a record cut short by the crash
+
+    reopened = SegmentedSpool(str(tmp_path), segment_bytes=1024)
+    assert len(reopened) == 3
+    records, _ = reopened.read_batch(10)
+    assert [r["i"] for r in records] == [0, 1, 2]
@@ -0,0 +1,114 @@
+# time_service.py
+
+import time
+from datetime import datetime
+from config import TIMEZONE
+
+# UTC offset changes only ever happen on quarter-hour boundaries
+OFFSET_WINDOW = 900
+
+
+class TimeService:
+    """
+    One clock and local-time formatter for the whole process.
+    now_ms() is integer epoch milliseconds read from the monotonic clock,
+    anchored to the wall clock and re-anchored every resync_seconds; it never
+    steps backwards. The timezone object and its current UTC offset are cached,
+    so local hours, day starts and ISO strings are integer arithmetic, and ISO
+    strings are only built when something is about to be stored. pytz is only
+    imported on the first offset lookup.
+    Public helpers take epoch seconds, the unit carried on the bus and in
+    raw_data.timestamp.
+    """
+
+    def __init__(self, tz_name: str = TIMEZONE, resync_seconds: int = 60):
+        self.tz_name = tz_name
+        self._tz = None
+        self.resync_ms = resync_seconds * 1000
+        self.offset_window = (0, -1, 0)  # (start_s, end_s, offset_s)
+        self.iso_cache = (None, "")      # (epoch second, ISO string)
+        self.local_cache = (None, "")    # (epoch second, "YYYY-MM-DD HH:MM:SS")
+        self.last_ms = 0
+        self._anchor()
+
+    def _anchor(self):
+        self.wall_ms = time.time_ns() // 1_000_000
+        self.mono_ms = time.monotonic_ns() // 1_000_000
+
+    # -----------------------------
+    # Clock
+    # -----------------------------
+    def now_ms(self) -> int:
+        mono = time.monotonic_ns() // 1_000_000
+        if mono - self.mono_ms >= self.resync_ms:
+            self._anchor()
+            mono = self.mono_ms
+        now = max(self.last_ms, self.wall_ms + mono - self.mono_ms)
+        self.last_ms = now
+        return now
+
+    def now_s(self) -> int:
+        return self.now_ms() // 1000
+
+    # -----------------------------
+    # Local time
+    # -----------------------------
+    @property
+    def tz(self):
+        if self._tz is None:
+            import pytz
+            self._tz = pytz.timezone(self.tz_name)
+        return self._tz
+
+    def utc_offset_seconds(self, epoch_s: float = None) -> int:
+        epoch_s = self.now_s() if epoch_s is None else int(epoch_s)
+        start, end, offset = self.offset_window
+        if start <= epoch_s < end:
+            return offset
+        offset = int(datetime.fromtimestamp(epoch_s, self.tz).utcoffset().total_seconds())
+        start = epoch_s - epoch_s % OFFSET_WINDOW
+        self.offset_window = (start, start + OFFSET_WINDOW, offset)
+        return offset
+
+    def local_hour(self, epoch_s: float) -> int:
+        epoch_s = int(epoch_s)
+        return (epoch_s + self.utc_offset_seconds(epoch_s)) // 3600 % 24
+
+    def local_day_start(self, epoch_s: float) -> int:
+        """Epoch seconds of the local midnight starting the day epoch_s falls in."""
+        epoch_s = int(epoch_s)
+        offset = self.utc_offset_seconds(epoch_s)
+        return (epoch_s + offset) // 86400 * 86400 - offset
+
+    # -----------------------------
+    # Formatting (storage boundary only)
+    # -----------------------------
+    def isoformat(self, epoch_s: float) -> str:
+        """Same text as datetime.fromtimestamp(epoch_s, tz).isoformat() for whole seconds."""
+        second = int(epoch_s)
+        cached_second, text = self.iso_cache
+        if cached_second != second:
+            offset = self.utc_offset_seconds(second)
+            sign = "+" if offset >= 0 else "-"
+            hours, minutes = divmod(abs(offset) // 60, 60)
+            text = f"{self._local_text(second, offset, 'T')}{sign}{hours:02d}:{minutes:02d}"
+            self.iso_cache = (second, text)
+        return text
+
+    def format_local_ms(self, epoch_ms: int) -> str:
+        """Naive local "YYYY-MM-DD HH:MM:SS.mmm" (the simulator's reading format)."""
+        second, millis = divmod(epoch_ms, 1000)
+        cached_second, text = self.local_cache
+        if cached_second != second:
+            text = self._local_text(second, self.utc_offset_seconds(second), " ")
+            self.local_cache = (second, text)
+        return f"{text}.{millis:03d}"
+
+    @staticmethod
+    def _local_text(second: int, offset: int, separator: str) -> str:
+        t = time.gmtime(second + offset)
+        return (f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}{separator}"
+                f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}")
+
+
+clock = TimeService()
@@ -0,0 +1,339 @@
+# tracing.py
+
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from config import TRACING_CONFIG, PROFILER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("trace_context", default=None)
+
+
+class SpanContext:
+    """Trace and span ID of the current span, carried in AMQP headers as a W3C traceparent."""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def parse(cls, value) -> "SpanContext | None":
+        if isinstance(value, bytes):
+            value = value.decode()
+        try:
+            version, trace_id, span_id, flags = value.split("-")
+            int(trace_id, 16), int(span_id, 16)
+            return cls(trace_id, span_id, bool(int(flags, 16) & 1))
+        except (AttributeError, ValueError):
+            return None
+
+
+def _trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+def _span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    __slots__ = ("name", "context", "parent_id", "start_ns", "started", "attributes")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class FileExporter:
+    """Spans as JSON lines appended to a local file."""
+
+    def __init__(self):
+        directory = os.path.dirname(TRACING_CONFIG["path"])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(TRACING_CONFIG["path"], "a", encoding="utf-8")
+
+    def export(self, records: list[dict]):
+        self.file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class UdpExporter:
+    """Spans as JSON datagrams to a local collector; nothing waits on it and lost datagrams are lost spans."""
+
+    def __init__(self):
+        self.address = (TRACING_CONFIG["collector_host"], TRACING_CONFIG["collector_port"])
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def export(self, records: list[dict]):
+        for record in records:
+            try:
+                self.sock.sendto(json.dumps(record, separators=(",", ":")).encode(), self.address)
+            except OSError:
+                pass
+
+    def close(self):
+        self.sock.close()
+
+
+EXPORTERS = {"file": FileExporter, "udp": UdpExporter}
+
+
+class Tracer:
+    """
+    Spans for one process. A trace starts where a message enters the system
+    without a traceparent (normally the publisher) and is sampled there; the
+    decision travels with the message, so unsampled messages cost one context
+    object per hop and are never recorded. Finished spans are buffered and
+    exported every flush_interval (by run_flusher, even when no other span
+    finishes) or max_buffer spans, and on exit or SIGTERM.
+    """
+
+    def __init__(self, service: str = None):
+        self.service = service or os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+        self.enabled = TRACING_CONFIG["enabled"]
+        self.sample_rate = TRACING_CONFIG["sample_rate"]
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self._exporter = None
+        self.flush_task = None
+
+    @property
+    def exporter(self):
+        if self._exporter is None:
+            self._exporter = EXPORTERS[TRACING_CONFIG["exporter"]]()
+        return self._exporter
+
+    def current(self) -> SpanContext | None:
+        return _current.get()
+
+    @contextmanager
+    def span(self, name: str, parent: SpanContext = None, **attributes):
+        """
+        Time the block as a child of `parent` (or the current span). Yields the
+        Span, or None when the trace is not sampled or tracing is off.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent = parent or _current.get()
+        if parent is None:
+            context = SpanContext(_trace_id(), _span_id(), random.random() < self.sample_rate)
+        else:
+            context = SpanContext(parent.trace_id, _span_id(), parent.sampled)
+
+        token = _current.set(context)
+        if not context.sampled:
+            try:
+                yield None
+            finally:
+                _current.reset(token)
+            return
+
+        span = Span(name, context, parent.span_id if parent else None, attributes)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(span, error)
+
+    def finish(self, span: Span, error: str = None):
+        record = {
+            "trace_id": span.context.trace_id,
+            "span_id": span.context.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "service": self.service,
+            "start_us": span.start_ns // 1000,
+            "duration_ms": round((time.perf_counter() - span.started) * 1000, 3),
+            "attributes": span.attributes,
+        }
+        if error:
+            record["error"] = error
+        self.buffer.append(record)
+        if len(self.buffer) >= TRACING_CONFIG["max_buffer"] or \
+                time.monotonic() - self.last_flush >= TRACING_CONFIG["flush_interval"]:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        records, self.buffer = self.buffer, []
+        try:
+            self.exporter.export(records)
+        except Exception as e:
+            logger.warning(f"[Tracing] ⚠️ Dropped {len(records)} span(s): {e}")
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(TRACING_CONFIG["flush_interval"])
+            if time.monotonic() - self.last_flush >= TRACING_CONFIG["flush_interval"]:
+                self.flush()
+
+    def terminate(self):
+        """SIGTERM handler: a normal exit instead of being killed, so finally blocks and atexit run."""
+        self.flush()
+        raise SystemExit(128 + signal.SIGTERM)
+
+    def headers(self, headers: dict = None) -> dict | None:
+        """AMQP headers carrying the current trace context (unchanged when there is none)."""
+        context = _current.get()
+        if context is None:
+            return headers
+        headers = dict(headers or {})
+        headers["traceparent"] = context.traceparent
+        return headers
+
+    def close(self):
+        self.flush()
+        if self._exporter is not None:
+            self._exporter.close()
+
+
+tracer = Tracer()
+
+
+def extract(headers) -> SpanContext | None:
+    """Trace context from the headers of a received message."""
+    value = (headers or {}).get("traceparent")
+    return SpanContext.parse(value) if value else None
+
+
+def traced_consumer(handler, **attributes):
+    """Run an aio_pika consumer callback inside a "consume" span continuing the message's trace."""
+    async def consume(message):
+        with tracer.span("consume", parent=extract(message.headers), routing_key=message.routing_key, **attributes):
+            await handler(message)
+    return consume
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a live agent: a background thread samples the
+    main thread's stack every `interval` seconds and counts collapsed stacks,
+    written on stop in the folded format flamegraph.pl / speedscope read.
+    """
+
+    def __init__(self, name: str, interval: float = None):
+        self.name = name
+        self.interval = interval or PROFILER_CONFIG["interval"]
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.target = threading.main_thread().ident
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def _sample(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        logger.info(f"[{self.name}] 🔬 Profiler started (every {self.interval * 1000:.0f} ms)")
+
+    def stop(self) -> str | None:
+        if not self.running:
+            return None
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+        os.makedirs(PROFILER_CONFIG["directory"], exist_ok=True)
+        path = os.path.join(PROFILER_CONFIG["directory"], f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"[{self.name}] 🔬 Profiler stopped, {self.samples} sample(s) written to {path}")
+        return path
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+
+def setup_tracing(name: str) -> SamplingProfiler:
+    """
+    Name this process's spans, export them periodically and on SIGTERM
+    (`docker stop`), and install the profiler toggle: `kill -USR2 <pid>`
+    starts sampling, the next signal stops it and writes the profile.
+    """
+    tracer.service = name
+    atexit.register(tracer.close)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    def on_signal(signum, handler):
+        if loop is not None:
+            loop.add_signal_handler(signum, handler)
+        else:
+            signal.signal(signum, lambda *_: handler())
+
+    if tracer.enabled:
+        if loop is not None:
+            tracer.flush_task = loop.create_task(tracer.run_flusher())
+        on_signal(signal.SIGTERM, tracer.terminate)
+
+    profiler = SamplingProfiler(name)
+    signum = getattr(signal, PROFILER_CONFIG["signal"], None)
+    if signum is not None:
+        on_signal(signum, profiler.toggle)
+    return profiler